@@ -19,66 +19,271 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 import sys
-import io
+import time
 import json
+import threading
+from collections import namedtuple
 import base64
 import beanstalkc as beanstalk
 import gphoto2 as gp  #pylint: disable=E0401
 from cloud_drive import google_drive
+from cameractrl.pipeline import Pipeline
+from cameractrl.session import SessionManifest
+from cameractrl.settings import CameraConfig
+from cameractrl.photo_ring import PhotoRing
+
+# where a picture is on the camera, like a gp.CameraFilePath
+CardFile = namedtuple('CardFile', 'folder name')
+
+
+# python-gphoto2's logging is set up once per process, see setup_logging()
+GP_LOGGING = None
+
+
+def setup_logging() -> None:
+    """send libgphoto2's messages to python logging, once"""
+    global GP_LOGGING  # pylint:disable=W0603
+    if GP_LOGGING is None:
+        logging.basicConfig(
+            format='%(levelname)s: %(name)s: %(message)s', level=logging.WARNING)
+        GP_LOGGING = gp.check_result(gp.use_python_logging())
 
 
 def init_camera() -> gp.camera:
     """initialize the camera"""
-    logging.basicConfig(
-        format='%(levelname)s: %(name)s: %(message)s', level=logging.WARNING)
-    gp.check_result(gp.use_python_logging())
+    setup_logging()
     camera = gp.check_result(gp.gp_camera_new())
     gp.check_result(gp.gp_camera_init(camera))
     return camera
 
 
-def take_picture(camera: gp.camera,
-                 rotation_pos: int, declination_pos: int,
-                 queue: beanstalk.Connection) -> str:
-    """take a picture and save it to the USB drive
-    or the google drive, if specified"""
+def capture_target(config: CameraConfig, card: bool) -> str:
+    """the 'capture_target' setting that has the camera keep pictures
+    on its card, or in its RAM (until we download them). None if the
+    camera can't"""
+    try:
+        for choice in config.choices('capture_target'):
+            if ('card' in choice.lower()) == card:
+                return choice
+    except (NameError, gp.GPhoto2Error) as error:
+        print('cannot set the capture target: {0}'.format(error))
+    return None
+
+
+def capture(camera: gp.camera) -> gp.CameraFilePath:
+    """take a picture, it stays on the camera until we download it.
+    Once this returns the shutter has closed and the rig can move"""
+    return gp.check_result(gp.gp_camera_capture(camera, gp.GP_CAPTURE_IMAGE))
+
 
-    # take the picture
-    file_path = gp.check_result(gp.gp_camera_capture(
-        camera, gp.GP_CAPTURE_IMAGE))
-    file_name = 'P{dec:02d}{rot:02d}_'.\
-                    format(dec=declination_pos, rot=rotation_pos) + file_path.name
+def photo_file_name(file_path: gp.CameraFilePath,
+                    rotation_pos: int, declination_pos: int) -> str:
+    """the name we save a picture as, P{declination}{rotation}_{camera's name}"""
+    return 'P{dec:02d}{rot:02d}_'.\
+        format(dec=declination_pos, rot=rotation_pos) + file_path.name
 
-    # read the photo from the camera
+
+def read_photo(camera: gp.camera, file_path: gp.CameraFilePath) -> bytes:
+    """read a picture we've taken from the camera"""
     camera_file = gp.check_result(gp.gp_camera_file_get(camera,
                                                         file_path.folder,
                                                         file_path.name,
                                                         gp.GP_FILE_TYPE_NORMAL))
-
-    # if a google drive isn't specified, write to the local USB drive
-    # read the image from the camera into memory
-    # and upload it
     file_data = gp.check_result(gp.gp_file_get_data_and_size(camera_file))
+    return bytes(file_data)
+
 
-    # okay, upload to the Google drive via a thread...
-    byte_stream = io.BytesIO(file_data)
-    camera_bytes = byte_stream.read(-1)
-    job = {'task': 'photo',
-           'filename': file_name,
-           'data': base64.encodebytes(camera_bytes).decode('ascii')}
-    # now send the photo to the Google Drive process
+def encode_photo(file_name: str, camera_bytes: bytes, ring: PhotoRing = None) -> str:
+    """the job that sends a picture to the google drive process. With
+    a ring the picture goes in shared memory & the job just says where,
+    if it won't go in we fall back to sending it base64 encoded"""
+    slot = ring.put(camera_bytes) if ring else None
+    if slot:
+        job = {'task': 'photo_ref',
+               'filename': file_name,
+               'slot': slot[0],
+               'sequence': slot[1],
+               'length': len(camera_bytes)}
+    else:
+        job = {'task': 'photo',
+               'filename': file_name,
+               'data': base64.encodebytes(camera_bytes).decode('ascii')}
+    return json.dumps(job)
+
+
+def enqueue_photo(queue: beanstalk.Connection, job_str: str) -> None:
+    """send the photo to the Google Drive process"""
     queue.use(google_drive.GDRIVE_QUEUE)
-    job_str = json.dumps(job)
     print("photo job size is {0} bytes".format(len(job_str)))
     queue.put(job_str)
+
+
+def download(camera: gp.camera, file_path: gp.CameraFilePath,
+             rotation_pos: int, declination_pos: int,
+             queue: beanstalk.Connection) -> str:
+    """read a picture we've taken from the camera and send
+    it to the google drive process"""
+    file_name = photo_file_name(file_path, rotation_pos, declination_pos)
+    enqueue_photo(queue, encode_photo(file_name, read_photo(camera, file_path)))
     return file_name
 
 
+class PhotoEnqueuer:
+    """the enqueue stage of the photo pipeline, it has its own beanstalk
+    connection (a connection can't be shared between threads).
+    'on_sent(key)' is called once a photo with a manifest key has been
+    queued"""
+
+    def __init__(self, on_sent=None) -> None:
+        self.queue = None
+        self.on_sent = on_sent
+
+    def __call__(self, photo: tuple) -> None:
+        file_name, job_str, key = photo
+        if self.queue is None:
+            self.queue = beanstalk.Connection(host='localhost', port=14711)
+        enqueue_photo(self.queue, job_str)
+        self.queue.use(google_drive.STATUS_QUEUE)
+        self.queue.put(json.dumps({'msg': "Filename={0}".format(file_name)}))
+        if self.on_sent and key is not None:
+            self.on_sent(key)
+
+    def close(self) -> None:
+        """the pipeline's stopped, hang up"""
+        if self.queue is not None:
+            self.queue.close()
+            self.queue = None
+
+
+def photo_pipeline(camera: gp.camera, camera_lock: threading.Lock,
+                   depth: int = 2, on_sent=None, ring: PhotoRing = None) -> Pipeline:
+    """download -> encode -> enqueue stages for the pictures we take,
+    put (file_path, rotation, declination) in once the shutter has closed,
+    with the picture's manifest key on the end if it has one.
+    The download holds 'camera_lock', hold it too while capturing. With
+    a 'ring' the pictures are handed over in shared memory"""
+    def download_stage(picture: tuple) -> tuple:
+        file_path, rotation_pos, declination_pos = picture[:3]
+        key = picture[3] if len(picture) > 3 else None
+        with camera_lock:
+            camera_bytes = read_photo(camera, file_path)
+        return photo_file_name(file_path, rotation_pos, declination_pos), camera_bytes, key
+
+    def encode_stage(photo: tuple) -> tuple:
+        file_name, camera_bytes, key = photo
+        return file_name, encode_photo(file_name, camera_bytes, ring), key
+
+    return Pipeline([('download', download_stage),
+                     ('encode', encode_stage),
+                     ('enqueue', PhotoEnqueuer(on_sent))], depth)
+
+
+def record_capture(manifest: SessionManifest, file_path: gp.CameraFilePath,
+                   rotation_pos: int, declination_pos: int) -> tuple:
+    """note a picture left on the card for bulk_download(), returns
+    its manifest key"""
+    return manifest.add(file_path.folder, file_path.name,
+                 photo_file_name(file_path, rotation_pos, declination_pos),
+                 rotation_pos, declination_pos)
+
+
+def bulk_download(camera: gp.camera, manifest: SessionManifest,
+                  camera_lock: threading.Lock = None, depth: int = 2,
+                  ring: PhotoRing = None) -> int:
+    """download every picture in the manifest we haven't sent on yet,
+    in one pass, and send them on. Returns how many were sent"""
+    pending = manifest.pending()
+    manifest.attempted([manifest.key(entry) for entry in pending])
+    pipeline = photo_pipeline(camera, camera_lock if camera_lock else threading.Lock(),
+                              depth, on_sent=manifest.sent, ring=ring)
+    for entry in pending:
+        pipeline.put((CardFile(entry['folder'], entry['name']),
+                      entry['rotation'], entry['declination'], manifest.key(entry)))
+    failures = pipeline.close()
+    if failures:
+        print('{0} pictures not sent, they stay in the manifest'.format(len(failures)))
+    return len(pending) - len(manifest.pending())
+
+
+def take_picture(camera: gp.camera,
+                 rotation_pos: int, declination_pos: int,
+                 queue: beanstalk.Connection) -> str:
+    """take a picture and save it to the USB drive
+    or the google drive, if specified"""
+    return download(camera, capture(camera), rotation_pos, declination_pos, queue)
+
+
 def exit_camera(camera: gp.camera) -> None:
     """free up the camera resource"""
     gp.check_result(gp.gp_camera_exit(camera))
 
 
+def camera_ok(camera: gp.camera) -> bool:
+    """is the camera still there & talking to us"""
+    try:
+        gp.check_result(gp.gp_camera_get_summary(camera))
+        return True
+    except gp.GPhoto2Error as error:
+        print('camera not responding: {0}'.format(error))
+        return False
+
+
+class CameraManager:
+    """keeps the camera open from one scan to the next, opening it
+    takes seconds over USB. Between jobs idle() checks on it every
+    'keepalive' seconds (which also stops it dropping the connection),
+    we only reconnect if it has stopped responding. 'lock' is held
+    by anyone talking to the camera, 'config' is the open camera's
+    cached configuration"""
+
+    def __init__(self, keepalive: float = 60.0) -> None:
+        self.camera = None
+        self.config = None
+        self.keepalive = keepalive
+        self.lock = threading.Lock()
+        self.last_used = 0.0
+
+    def acquire(self) -> gp.camera:
+        """the camera for the next job, checked and only reopened if it
+        isn't responding. Raises GPhoto2Error if there's no camera"""
+        with self.lock:
+            if self.camera and not camera_ok(self.camera):
+                self._close()
+            if not self.camera:
+                self.camera = init_camera()
+                self.config = CameraConfig(self.camera)
+            self.last_used = time.monotonic()
+            return self.camera
+
+    def release(self) -> None:
+        """the job's done with the camera, it stays open"""
+        self.last_used = time.monotonic()
+
+    def idle(self) -> None:
+        """call while waiting for work"""
+        if not self.camera or time.monotonic() - self.last_used < self.keepalive:
+            return
+        with self.lock:
+            if not camera_ok(self.camera):
+                self._close()  # reconnect when it's next wanted
+                return
+            self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        """free up the camera"""
+        with self.lock:
+            self._close()
+
+    def _close(self) -> None:
+        if self.camera:
+            try:
+                exit_camera(self.camera)
+            except gp.GPhoto2Error:
+                pass  # it's gone anyway
+        self.camera = None
+        self.config = None
+
+
 def main():
     """simple standalone testing, take some pictures"""
     camera = init_camera()
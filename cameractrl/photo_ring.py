@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Photo Ring - hands pictures to the Google Drive process through
+shared memory rather than base64 in a beanstalk job. The ring is a
+few fixed size slots in a memory mapped file (in /dev/shm, so RAM
+backed), a picture is copied into a free one and only a small
+descriptor goes over beanstalk:
+
+    {'task': 'photo_ref', 'filename': ..., 'slot': 2, 'sequence': ..., 'length': ...}
+
+the uploader spools the picture straight out of the slot and releases
+it. A slot is free while its sequence number is 0, only the writer
+makes it non-zero and only the reader zeroes it, so no lock is needed
+between the processes. If there's no free slot (or the picture won't
+fit) put() returns None and the picture goes the old way.
+
+    ring = PhotoRing.create()         # before starting the drive process
+    slot, sequence = ring.put(data)   # camera side
+    view = ring.read(slot, sequence)  # drive side
+    ...
+    view.release()
+    ring.release(slot, sequence)
+
+RPIPG_RING_SLOTS & RPIPG_RING_SLOT_MB size it, the memory is only
+used once a slot has been written to"""
+import os
+import mmap
+import time
+import struct
+import threading
+
+RING_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp'
+RING_PATH = os.path.join(RING_DIR, 'rpipg_photos')
+RING_SLOTS = int(os.environ.get('RPIPG_RING_SLOTS', '3'))
+SLOT_SIZE = int(os.environ.get('RPIPG_RING_SLOT_MB', '8')) * 1024 * 1024  # our JPEGs are ~4.5MB
+
+RING_HEADER = struct.Struct('<II')  # slots, slot size
+SLOT_HEADER = struct.Struct('<QQ')  # sequence number (0 when free), length
+
+
+class PhotoRing:
+    """fixed size slots in shared memory, one writer & one reader"""
+
+    def __init__(self, path: str, owner: bool = False) -> None:
+        self.path = path
+        self.owner = owner  # we created it, so we remove it
+        self._pid = os.getpid()  # a forked child doesn't own it
+        with open(path, 'r+b') as ring_file:
+            self._map = mmap.mmap(ring_file.fileno(), 0)
+        self.buf = memoryview(self._map)
+        self.slots, self.slot_size = RING_HEADER.unpack_from(self.buf, 0)
+        self._lock = threading.Lock()  # writers in this process
+        self._sequence = time.time_ns()  # so descriptors from a past run never match
+
+    @classmethod
+    def create(cls, path: str = RING_PATH, slots: int = RING_SLOTS,
+               slot_size: int = SLOT_SIZE) -> 'PhotoRing':
+        """make the ring, replacing one left behind by a crash"""
+        size = RING_HEADER.size + slots * (SLOT_HEADER.size + slot_size)
+        with open(path, 'wb') as ring_file:
+            ring_file.truncate(size)  # all zero, so every slot is free
+            ring_file.write(RING_HEADER.pack(slots, slot_size))
+        return cls(path, owner=True)
+
+    @classmethod
+    def attach(cls, path: str = RING_PATH) -> 'PhotoRing':
+        """use a ring another process created"""
+        return cls(path)
+
+    @staticmethod
+    def _offset(slot: int, slot_size: int) -> int:
+        return RING_HEADER.size + slot * (SLOT_HEADER.size + slot_size)
+
+    def put(self, data: bytes) -> tuple:
+        """copy the picture into a free slot, returns (slot, sequence)
+        for the descriptor or None if it can't go in the ring"""
+        if len(data) > self.slot_size:
+            return None
+        with self._lock:
+            for slot in range(self.slots):
+                offset = self._offset(slot, self.slot_size)
+                sequence, _ = SLOT_HEADER.unpack_from(self.buf, offset)
+                if sequence:
+                    continue  # still waiting to be uploaded
+                self._sequence += 1
+                start = offset + SLOT_HEADER.size
+                self.buf[start:start + len(data)] = data
+                SLOT_HEADER.pack_into(self.buf, offset, self._sequence, len(data))
+                return slot, self._sequence
+        return None
+
+    def read(self, slot: int, sequence: int) -> memoryview:
+        """the picture in a slot, a view of the shared memory that's
+        good until release() (release the view too). None if the slot
+        no longer holds it"""
+        offset = self._offset(slot, self.slot_size)
+        held, length = SLOT_HEADER.unpack_from(self.buf, offset)
+        if held != sequence:
+            return None
+        start = offset + SLOT_HEADER.size
+        return self.buf[start:start + length]
+
+    def release(self, slot: int, sequence: int) -> None:
+        """done with the picture, the slot can be used again"""
+        offset = self._offset(slot, self.slot_size)
+        held, _ = SLOT_HEADER.unpack_from(self.buf, offset)
+        if held == sequence:
+            SLOT_HEADER.pack_into(self.buf, offset, 0, 0)
+
+    def free_slots(self) -> int:
+        """how many slots are free"""
+        return sum(1 for slot in range(self.slots)
+                   if not SLOT_HEADER.unpack_from(self.buf,
+                                                  self._offset(slot, self.slot_size))[0])
+
+    def close(self) -> None:
+        """stop using the ring, and remove it if we made it"""
+        self.buf.release()
+        self._map.close()
+        if self.owner and os.getpid() == self._pid:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""Pipeline - a chain of stages, each on a worker thread of its own,
+joined by bounded queues. An item goes through the stages in order,
+the output of one stage is the input of the next. While the slowest
+stage is busy the queue in front of it fills up, and once it's full
+put() blocks (backpressure), so we never get further ahead than the
+queue depths allow.
+
+    pipeline = Pipeline([('download', download), ('encode', encode)], depth=2)
+    pipeline.put(item)
+    ...
+    failures = pipeline.close()  # waits for everything put to make it through
+
+An item a stage fails on goes no further, it's kept with the error
+(see failures()) so the caller can try it again. Each stage's latency, and the depth of the queue in front of it,
+are counted, see stats()"""
+import time
+import queue
+import threading
+
+_STOP = object()  # sent down the pipeline to stop the stages
+
+
+class DepthQueue(queue.Queue):
+    """a queue that remembers the most it has held"""
+
+    def _init(self, maxsize: int) -> None:
+        super()._init(maxsize)
+        self.max_depth = 0
+
+    def _put(self, item) -> None:
+        super()._put(item)
+        self.max_depth = max(self.max_depth, len(self.queue))
+
+
+class StageStats:
+    """counters for one stage"""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.busy = 0.0  # seconds spent working
+        self.max_latency = 0.0
+
+    def summary(self, inbox: DepthQueue) -> dict:
+        """the counters, times in milliseconds"""
+        return {'count': self.count,
+                'errors': self.errors,
+                'mean_ms': self.busy / self.count * 1000.0 if self.count else 0.0,
+                'max_ms': self.max_latency * 1000.0,
+                'depth': inbox.qsize(),
+                'max_depth': inbox.max_depth}
+
+
+class Stage(threading.Thread):
+    """does 'work(item)' to each item from its inbox and passes what
+    it returns on to the outbox (None drops the item). Items it fails
+    on go in 'failures' as (stage name, item, error). If 'work' has a
+    close() it's called on the stage's thread once the stage stops"""
+
+    def __init__(self, name: str, work, inbox: DepthQueue,  # pylint: disable-msg=too-many-arguments
+                 outbox: DepthQueue = None, failures: list = None) -> None:
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.failures = failures if failures is not None else []
+        self.stats = StageStats()
+
+    def run(self) -> None:
+        while True:
+            item = self.inbox.get()
+            try:
+                if item is _STOP:
+                    if self.outbox:
+                        self.outbox.put(_STOP)
+                    close = getattr(self.work, 'close', None)
+                    if close:
+                        close()
+                    return
+                start = time.monotonic()
+                try:
+                    result = self.work(item)
+                except Exception as err:  # pylint: disable=W0703
+                    print('{0} stage failed: {1}'.format(self.name, err))
+                    self.stats.errors += 1
+                    self.failures.append((self.name, item, err))
+                    continue
+                latency = time.monotonic() - start
+                self.stats.count += 1
+                self.stats.busy += latency
+                self.stats.max_latency = max(self.stats.max_latency, latency)
+                if self.outbox and result is not None:
+                    self.outbox.put(result)  # blocks while the next stage is backed up
+            finally:
+                self.inbox.task_done()
+
+
+class Pipeline:
+    """stages joined by queues holding at most 'depth' items"""
+
+    def __init__(self, stages: list, depth: int = 2) -> None:
+        self.queues = [DepthQueue(maxsize=depth) for _ in stages]
+        self._failures = []  # list.append is atomic, the stages share it
+        self.stages = []
+        for index, (name, work) in enumerate(stages):
+            outbox = self.queues[index + 1] if index + 1 < len(stages) else None
+            self.stages.append(Stage(name, work, self.queues[index], outbox,
+                                     self._failures))
+        for stage in self.stages:
+            stage.start()
+
+    def put(self, item) -> None:
+        """feed an item in, blocks while the first stage is backed up"""
+        self.queues[0].put(item)
+
+    def drain(self) -> list:
+        """wait until everything put so far has been through every
+        stage, returns the failures so far"""
+        for stage_queue in self.queues:
+            stage_queue.join()
+        return self.failures()
+
+    def close(self) -> list:
+        """finish what's been put & stop the stages, returns the failures"""
+        self.queues[0].put(_STOP)
+        for stage in self.stages:
+            stage.join()
+        return self.failures()
+
+    def failures(self) -> list:
+        """the items a stage failed on, (stage name, item, error)"""
+        return list(self._failures)
+
+    def stats(self) -> dict:
+        """each stage's counters, the depth is of the queue in front of it"""
+        return {stage.name: stage.stats.summary(stage.inbox) for stage in self.stages}
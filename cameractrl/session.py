@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""Session Manifest - the pictures a scan left on the camera's card,
+where they are and the pose they were taken at, so they can be
+downloaded later in one go. It's saved after every change so pictures
+taken before a crash or restart are still downloaded next time.
+
+Cameras reuse names, so a picture is known by its key, (session,
+folder, name). One that still hasn't been sent after MAX_ATTEMPTS
+downloads (it's gone from the card say) is given up on"""
+import time
+import threading
+import util
+
+
+class SessionManifest:
+    """the pictures on the camera's card we haven't sent on yet"""
+    MAX_ATTEMPTS = 3  # downloads of a picture before we give up on it
+
+    def __init__(self, path: str = None) -> None:
+        self.path = path if path else util.state_file('session.json')
+        self._lock = threading.Lock()  # the pipeline marks pictures sent
+        self.session = None
+        self.entries = []
+        self.load()
+
+    def load(self) -> None:
+        """read the manifest from disk"""
+        saved = util.load_json(self.path)
+        self.session = saved.get('session')
+        self.entries = saved.get('entries', [])
+
+    def save(self) -> None:
+        """write the manifest to disk"""
+        util.save_json(self.path, {'session': self.session, 'entries': self.entries})
+
+    @staticmethod
+    def key(entry: dict) -> tuple:
+        """what a picture is known by"""
+        return entry['session'], entry['folder'], entry['name']
+
+    def start(self) -> None:
+        """a new scan session, we keep any pictures not sent yet
+        unless we've given up on them"""
+        with self._lock:
+            self.session = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+            kept = []
+            for entry in self.entries:
+                if entry['sent']:
+                    continue
+                if entry.get('attempts', 0) >= self.MAX_ATTEMPTS:
+                    print('giving up on {0}, it could not be downloaded'.
+                          format(entry['file_name']))
+                    continue
+                kept.append(entry)
+            self.entries = kept
+            self.save()
+
+    def add(self, folder: str, name: str, file_name: str,
+            rotation: int, declination: int) -> tuple:
+        """a picture has been taken, it's on the card as folder/name
+        and will be sent on as 'file_name'. Returns its key"""
+        with self._lock:
+            self.entries.append({'folder': folder,
+                                 'name': name,
+                                 'file_name': file_name,
+                                 'rotation': rotation,
+                                 'declination': declination,
+                                 'session': self.session,
+                                 'attempts': 0,
+                                 'sent': False})
+            self.save()
+            return self.key(self.entries[-1])
+
+    def pending(self) -> list:
+        """the pictures still to be sent"""
+        with self._lock:
+            return [dict(entry) for entry in self.entries if not entry['sent']]
+
+    def attempted(self, keys: list) -> None:
+        """we're about to try downloading these pictures"""
+        keys = set(keys)
+        with self._lock:
+            for entry in self.entries:
+                if self.key(entry) in keys:
+                    entry['attempts'] = entry.get('attempts', 0) + 1
+            self.save()
+
+    def sent(self, key: tuple) -> None:
+        """a picture has been downloaded & sent on"""
+        key = tuple(key)
+        with self._lock:
+            for entry in self.entries:
+                if self.key(entry) == key:
+                    entry['sent'] = True
+            self.save()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Camera Settings - reading the camera's configuration is a full tree
+round trip over USB, and so is writing it, both slow. So we read the
+tree once and keep it, settings are looked up in our copy and only the
+ones that change are written back, all of them in one set_config.
+
+    config = CameraConfig(camera)
+    config.apply({'iso': '200', 'shutter': '1/60'})
+
+The copy is good for as long as the camera stays open (see
+camera.CameraManager), knobs turned on the camera meanwhile aren't seen"""
+import gphoto2 as gp  #pylint: disable=E0401
+
+# the settings a scan can make -> the widget names cameras use for them
+CAMERA_SETTINGS = {'iso': ('iso', 'isospeed'),
+                   'shutter': ('shutterspeed', 'shutterspeed2'),
+                   'aperture': ('aperture', 'f-number'),
+                   'image_format': ('imageformat', 'imagequality'),
+                   'capture_target': ('capturetarget',)}
+
+# widgets whose value has to be one of their choices
+CHOICE_WIDGETS = (gp.GP_WIDGET_RADIO, gp.GP_WIDGET_MENU)
+
+
+class CameraConfig:
+    """the camera's configuration tree, read the first time it's needed"""
+
+    def __init__(self, camera: gp.camera) -> None:
+        self.camera = camera
+        self._tree = None
+
+    def tree(self) -> gp.CameraWidget:
+        """our copy of the configuration tree"""
+        if self._tree is None:
+            self._tree = gp.check_result(gp.gp_camera_get_config(self.camera))
+        return self._tree
+
+    def invalidate(self) -> None:
+        """read the tree again next time"""
+        self._tree = None
+
+    def widget(self, setting: str) -> gp.CameraWidget:
+        """the widget for one of CAMERA_SETTINGS"""
+        if setting not in CAMERA_SETTINGS:
+            raise NameError('unknown camera setting {0}'.format(setting))
+        for name in CAMERA_SETTINGS[setting]:
+            error, widget = gp.gp_widget_get_child_by_name(self.tree(), name)
+            if error >= gp.GP_OK:
+                return widget
+        raise NameError('camera has no {0} setting'.format(setting))
+
+    def get(self, setting: str):
+        """the setting's value"""
+        return gp.check_result(gp.gp_widget_get_value(self.widget(setting)))
+
+    def choices(self, setting: str) -> list:
+        """the values a setting can have, [] if it's not a choice"""
+        widget = self.widget(setting)
+        if gp.check_result(gp.gp_widget_get_type(widget)) not in CHOICE_WIDGETS:
+            return []
+        return [gp.check_result(gp.gp_widget_get_choice(widget, index))
+                for index in range(gp.check_result(gp.gp_widget_count_choices(widget)))]
+
+    def settings(self) -> dict:
+        """all the settings this camera has, and their values"""
+        values = {}
+        for setting in CAMERA_SETTINGS:
+            try:
+                values[setting] = self.get(setting)
+            except NameError:
+                pass
+        return values
+
+    def apply(self, settings: dict) -> list:
+        """change the settings that aren't already what they should be,
+        in one go. Returns the settings that were changed. Every
+        setting is checked before our copy is touched, so a bad one
+        leaves the copy as it was"""
+        updates = []
+        for setting, value in settings.items():
+            widget = self.widget(setting)
+            value = self._coerce(setting, widget, value)
+            if gp.check_result(gp.gp_widget_get_value(widget)) != value:
+                updates.append((setting, widget, value))
+        if not updates:
+            return []
+
+        try:
+            for _, widget, value in updates:
+                gp.check_result(gp.gp_widget_set_value(widget, value))
+            gp.check_result(gp.gp_camera_set_config(self.camera, self.tree()))
+        except Exception:
+            self.invalidate()  # who knows what the camera has now
+            raise
+        return [setting for setting, _, _ in updates]
+
+    def _coerce(self, setting: str, widget: gp.CameraWidget, value):
+        """json values to what the widget holds"""
+        widget_type = gp.check_result(gp.gp_widget_get_type(widget))
+        if widget_type == gp.GP_WIDGET_RANGE:
+            return float(value)
+        if widget_type == gp.GP_WIDGET_TOGGLE:
+            return int(value)
+        value = str(value)
+        if widget_type in CHOICE_WIDGETS and value not in self.choices(setting):
+            raise ValueError('{0} cannot be {1}'.format(setting, value))
+        return value
@@ -1,22 +1,58 @@
 """Google Drive """
+import io
+import os
+import copy
 import json
 import time
+import random
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from oauth2client import client
-from httplib2 import Http
+from httplib2 import Http, HttpLib2Error
 from googleapiclient import discovery
-from googleapiclient.http import MediaInMemoryUpload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
 import beanstalkc as beanstalk
 from configuration import google_api  # our client id & secret
+from cloud_drive.spool import PhotoSpool
+import util
 
 GDRIVE_QUEUE = 'gdrive'  # "tube" for all Google Drive work
 STATUS_QUEUE = 'status'  # shared status tube
 
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+# the ids of our folders, so we don't have to search for them
+FOLDER_CACHE = 'drive_folders.json'
+
+CHUNK_UNIT = 256 * 1024  # the Drive wants chunks in multiples of this
+
+
+def upload_chunk_size(kilobytes: int) -> int:
+    """'kilobytes' in bytes, rounded down to a multiple of 256KB (but
+    at least 256KB)"""
+    return max(kilobytes * 1024 // CHUNK_UNIT, 1) * CHUNK_UNIT
+
+
+# uploads are sent in chunks of this size (RPIPG_UPLOAD_CHUNK_KB to
+# change), a failed upload picks up after the last chunk the Drive
+# acknowledged. Bigger is quicker on a good link, but a retry costs more
+UPLOAD_CHUNK_SIZE = upload_chunk_size(int(os.environ.get('RPIPG_UPLOAD_CHUNK_KB', '1024')))
+UPLOAD_RETRIES = 5  # goes at a chunk before we give up on the upload
+RETRY_DELAY = 1.0  # seconds, doubled each try
+
+# how many pictures are uploaded at once (RPIPG_UPLOAD_WORKERS to change)
+UPLOAD_WORKERS = int(os.environ.get('RPIPG_UPLOAD_WORKERS', '3'))
+# goes at a picture that fails in a way retrying won't fix (no folder,
+# the Drive refusing it) before it's left in the spool
+UPLOAD_ATTEMPTS = 3
+
 
 class GoogleDrive:
     """here's where we do all our Google Drive work"""
 
     drive_client = None
+    credentials = None
     sub_folder_id = None
     _queue = None
 
@@ -44,7 +80,7 @@ class GoogleDrive:
             expires_in = access_info['expires_in']
             token_type = access_info['token_type']  #pylint:disable-msg=unused-variable
 
-            credentials = client.GoogleCredentials(
+            self.credentials = client.GoogleCredentials(
                 access_token=access_token,
                 client_id=google_api.CLIENT_ID,
                 client_secret=google_api.CLIENT_SECRET,
@@ -53,12 +89,24 @@ class GoogleDrive:
                 token_uri="https://www.googleapis.com/oauth2/v4/token",
                 user_agent='my-user-agent/1.0')
 
-            google_http = credentials.authorize(Http())
-            google_drive = discovery.build('drive', 'v3', http=google_http)
-            self.drive_client = google_drive.files()  # pylint: disable=E1101
+            self.drive_client = self.build_client()
         except KeyError as key_error:
             self.post_status("Error with access info: {0}".format(key_error.__str__()))
 
+    def build_client(self):
+        """a drive files() client with an authorized Http of its own"""
+        google_http = self.credentials.authorize(Http())
+        google_drive = discovery.build('drive', 'v3', http=google_http)
+        return google_drive.files()  # pylint: disable=E1101
+
+    def clone(self) -> 'GoogleDrive':
+        """a copy with its own client, for another thread. It doesn't
+        post status, the beanstalk connection is ours"""
+        drive = copy.copy(self)
+        drive.queue = None
+        drive.drive_client = self.build_client()
+        return drive
+
     def post_status(self, message: str) -> None:
         """post a simple message to whomever is listening"""
         if self.queue:
@@ -66,15 +114,72 @@ class GoogleDrive:
             self.queue.put(status_json)
         print(message)
 
+    def find_folder(self, name: str, parent_id: str = None) -> str:
+        """the id of a folder called 'name' (in 'parent_id' if given),
+        the Drive does the searching. None if there isn't one"""
+        # backslashes first, or we'd escape the ones escaping the quotes
+        quoted = name.replace('\\', '\\\\').replace("'", "\\'")
+        query = "name = '{0}' and mimeType = '{1}' and trashed = false".\
+            format(quoted, FOLDER_MIME_TYPE)
+        if parent_id:
+            query += " and '{0}' in parents".format(parent_id)
+        page_token = None
+        while True:
+            # a page can come back empty with more to follow
+            response = self.drive_client.list(q=query, spaces='drive',
+                                              fields='nextPageToken, files(id)',
+                                              pageToken=page_token).execute()
+            if response.get('files'):
+                return response['files'][0]['id']
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return None
+
+    def folder_ok(self, folder_id: str) -> bool:
+        """is the folder still there (and not in the trash). If we
+        can't tell right now we say no, the caller searches instead"""
+        try:
+            folder = self.drive_client.get(fileId=folder_id,
+                                           fields='mimeType, trashed').execute()
+        except (HttpError, HttpLib2Error, OSError) as error:
+            if retryable(error) or error.resp.status == 404:
+                return False
+            raise
+        return folder.get('mimeType') == FOLDER_MIME_TYPE and not folder.get('trashed')
+
+    def cached_folder(self, key: str) -> str:
+        """a folder id we saved last time, if it's still good"""
+        folder_id = util.load_json(util.state_file(FOLDER_CACHE)).get(key)
+        if folder_id and self.folder_ok(folder_id):
+            return folder_id
+        return None
+
+    @staticmethod
+    def cache_folder(key: str, folder_id: str) -> None:
+        """save a folder id for next time"""
+        path = util.state_file(FOLDER_CACHE)
+        folders = util.load_json(path)
+        folders[key] = folder_id
+        util.save_json(path, folders)
+
+    def create_folder(self, name: str, parent_id: str = None) -> str:
+        """make a folder, returns its id"""
+        body = {'name': name, 'mimeType': FOLDER_MIME_TYPE}
+        if parent_id:
+            body['parents'] = [parent_id]
+        response = self.drive_client.create(body=body, fields='id').execute()
+        return response.get('id')  # this is the fileid
+
     def find_root_folder(self, root_name) -> str:
         """Search the google drive for a previously created
         root folder to write to. Return the parent id"""
         try:
-            folder_list = self.drive_client.list(q="trashed=false").execute()
-            for folder in folder_list['files']:
-                if folder['name'] == root_name and \
-                   folder['mimeType'] == 'application/vnd.google-apps.folder':
-                    return folder['id']
+            root_id = self.cached_folder(root_name)
+            if root_id is None:
+                root_id = self.find_folder(root_name)
+                if root_id:
+                    self.cache_folder(root_name, root_id)
+            return root_id
         except client.HttpAccessTokenRefreshError as token_error:
             self.post_status(message='Token is expired! {0}'.format(token_error.__str__()))
 
@@ -89,49 +194,71 @@ class GoogleDrive:
         try:
             root_id = self.find_root_folder(root_folder)
             if root_id is None:
-                folder_kwargs = {
-                    'body': {
-                        'name': root_folder,
-                        'mimeType': 'application/vnd.google-apps.folder'
-                    },
-                    'fields': 'id'
-                }
-                response = self.drive_client.create(**folder_kwargs).execute()
-                root_id = response.get('id')  # this is the fileid
+                root_id = self.create_folder(root_folder)
+                self.cache_folder(root_folder, root_id)
 
             # now create session folder
             session_folder = time.strftime("%Y%m%d%H%M%S_photos", time.gmtime())
-            sub_folder_kwargs = {
-                'body': {
-                    'name': session_folder,
-                    'mimeType': 'application/vnd.google-apps.folder',
-                    'parents': [root_id]
-                },
-                'fields': 'id'
-            }
-            response = self.drive_client.create(**sub_folder_kwargs).execute()
-            self.sub_folder_id = response.get('id')
+            self.sub_folder_id = self.create_folder(session_folder, root_id)
         except client.AccessTokenCredentialsError as access_error:
             error_string = access_error.__str__()  #pylint: disable=W0612
             return False
+        except (HttpError, HttpLib2Error, OSError) as error:
+            self.post_status('cannot make the session folder: {0}'.format(error))
+            return False
 
         return True
 
-    def write_file_bytes(self, filename: str, data: bytes) -> dict:
-        """Write the file to the google drive
-        These files are images, so they are big, about
-        4.5MB"""
+    def write_file_bytes(self, filename: str, data: bytes, folder_id: str = None) -> dict:
+        """Write the file to the google drive, in the session
+        folder unless told otherwise. These files are images,
+        so they are big, about 4.5MB"""
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype='application/octet-stream',
+                                  chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        return self.upload(filename, media, folder_id)
 
+    def write_file(self, filename: str, path: str, folder_id: str = None) -> dict:
+        """Write a file on disk to the google drive, a chunk
+        at a time so it's never all in memory"""
+        media = MediaFileUpload(path, mimetype='application/octet-stream',
+                                chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        return self.upload(filename, media, folder_id)
+
+    def upload(self, filename: str, media, folder_id: str = None) -> dict:
+        """a resumable upload, chunk by chunk. If a chunk fails we
+        try it again, the upload carrying on from the last byte the
+        Drive has, not from the start"""
         metadata = {'title': filename,
                     'name': filename,
-                    'parents': [self.sub_folder_id]
+                    'parents': [folder_id if folder_id else self.sub_folder_id]
                     }
-        media = MediaInMemoryUpload(body=data, mimetype='application/octet-stream')
-        results = self.drive_client.\
-            create(body=metadata, media_body=media).\
-            execute()
+        request = self.drive_client.create(body=metadata, media_body=media)
+        response = None
+        retries = 0
+        while response is None:
+            try:
+                progress, response = request.next_chunk()
+            except (HttpError, HttpLib2Error, OSError) as error:
+                if not retryable(error) or retries >= UPLOAD_RETRIES:
+                    raise
+                # back off, with some jitter so the workers don't all come back at once
+                time.sleep(RETRY_DELAY * 2 ** retries * random.uniform(0.5, 1.5))
+                retries += 1
+                continue
+            retries = 0
+            if progress:
+                self.post_status("uploading {0}: {1:.0%}".format(filename, progress.progress()))
+
+        return response
 
-        return results
+
+def retryable(error: Exception) -> bool:
+    """is it worth trying again, a dropped connection, the Drive
+    having a problem of its own (5xx) or telling us to slow down
+    (429) is"""
+    if isinstance(error, HttpError):
+        return error.resp.status >= 500 or error.resp.status == 429
+    return True
 
 
 def configure_drive_queue() -> beanstalk.Connection:
@@ -142,48 +269,165 @@ def configure_drive_queue() -> beanstalk.Connection:
     return queue
 
 
-def wait_for_work(queue: beanstalk.Connection) -> str:
-    """wait for work, return json"""
+def wait_for_work(queue: beanstalk.Connection, idle=None, idle_every: float = 30.0):
+    """wait for work, return the reserved job (the caller deletes it
+    once it's been dealt with). 'idle()' is called every 'idle_every'
+    seconds while there's nothing to do"""
+    idle_start = time.time()
     while True:
         job = queue.reserve(timeout=0)
         if job:
-            job_json = job.body
-            job.delete()  # remove from the queue
-            return json.loads(job_json)
+            return job
 
         time.sleep(0.01)  # sleep for 10 ms to share the computer
+        if idle and time.time() - idle_start > idle_every:
+            idle()
+            idle_start = time.time()
+
+
+def spool_photo_ref(ring, spool: PhotoSpool, job_dict: dict) -> bool:
+    """spool the picture a 'photo_ref' job refers to straight out of
+    the shared memory ring (no copy), then release its slot. False if
+    it's no longer there"""
+    if ring is None:
+        return False
+    view = ring.read(job_dict['slot'], job_dict['sequence'])
+    if view is None:
+        return False
+    try:
+        spool.add(job_dict['filename'], view)
+    finally:
+        view.release()
+        ring.release(job_dict['slot'], job_dict['sequence'])
+    return True
+
 
+class UploadPool:
+    """uploads spooled pictures on a few worker threads, in no
+    particular order (it's the spool's manifest that keeps track).
+    Each worker has a GoogleDrive of its own, an Http object can't
+    be shared between threads. A picture that fails for a reason
+    worth retrying is tried again every submit_pending(), any other
+    failure only UPLOAD_ATTEMPTS times (into the same folder)"""
 
-def process_photos():
+    def __init__(self, spool: PhotoSpool, workers: int = UPLOAD_WORKERS) -> None:
+        self.spool = spool
+        self.drive = None  # set once we're authorized
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._in_flight = set()  # (session, file name) being uploaded
+        self._failed = {}  # (session, file name, folder id) -> goes that failed for good
+
+    def _worker_drive(self) -> GoogleDrive:
+        """this worker's GoogleDrive, remade if we've been re-authorized"""
+        drive = self.drive
+        if getattr(self._local, 'source', None) is not drive:
+            self._local.source = drive
+            self._local.drive = drive.clone()
+        return self._local.drive
+
+    def submit_pending(self) -> int:
+        """queue up the spooled pictures that aren't already being
+        uploaded, returns how many"""
+        drive = self.drive
+        if drive is None or drive.drive_client is None:
+            return 0
+        count = 0
+        for session, file_name, folder_id in self.spool.pending():
+            if not folder_id:
+                # spooled before we had a folder, it goes in the current one
+                folder_id = drive.sub_folder_id
+                self.spool.set_folder(folder_id, session)
+            with self._lock:
+                if (session, file_name) in self._in_flight or \
+                        self._failed.get((session, file_name, folder_id), 0) >= UPLOAD_ATTEMPTS:
+                    continue
+                self._in_flight.add((session, file_name))
+            self._executor.submit(self._upload, session, file_name, folder_id)
+            count += 1
+        return count
+
+    def _upload(self, session: str, file_name: str, folder_id: str) -> None:
+        for_good = True  # failed in a way trying again won't fix
+        try:
+            if not folder_id:
+                print("no folder to upload {0} to".format(file_name))
+                return
+            self._worker_drive().write_file(file_name, self.spool.path(session, file_name),
+                                            folder_id)
+            self.spool.uploaded(session, file_name)
+            for_good = False
+        except FileNotFoundError:
+            print("spooled photo {0} is missing!".format(file_name))
+        except Exception as error:  # pylint: disable=W0703
+            # it stays in the spool, we'll try again later
+            print("upload of {0} failed: {1}".format(file_name, error))
+            for_good = not retryable(error)
+        finally:
+            with self._lock:
+                if for_good:
+                    failed = (session, file_name, folder_id)
+                    self._failed[failed] = self._failed.get(failed, 0) + 1
+                    if self._failed[failed] == UPLOAD_ATTEMPTS:
+                        print("giving up on uploading {0}".format(file_name))
+                self._in_flight.discard((session, file_name))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """stop the workers, after the uploads under way if 'wait'"""
+        self._executor.shutdown(wait=wait)
+
+
+def process_photos(ring=None):
     """This is a separate process that will
     receive photo information and upload to the
-    google drive"""
+    google drive. Pictures sent as 'photo_ref' are
+    in the shared memory 'ring'. Every picture is
+    spooled to disk before its job is deleted, and
+    only removed once it's been uploaded"""
     print("Process spawned => process_photos()")
     queue = configure_drive_queue()
+    spool = PhotoSpool()
+    if spool.pending():
+        print("process_photos: {0} photos waiting to upload".format(len(spool.pending())))
+    uploads = UploadPool(spool)
     drive = None
     while True:
-        job_dict = wait_for_work(queue)
+        job = wait_for_work(queue, idle=uploads.submit_pending)
+        job_dict = json.loads(job.body)
         task = job_dict['task']
 
         if task == 'token':  # oAuth2 credentials
+            job.delete()
             access_info = json.loads(job_dict['value'])
             print("process_photos: access_info = {0}".format(access_info))
             drive = GoogleDrive(access_info, queue)
             if drive:
                 drive.create_root_folder('rpipg')
-        elif task == 'photo':  # photo to write to Google Drive
+                spool.set_folder(drive.sub_folder_id)
+                uploads.drive = drive
+        elif task in ('photo', 'photo_ref'):  # photo to write to Google Drive
+            if task == 'photo':
+                spool.add(job_dict['filename'],
+                          base64.decodebytes(job_dict['data'].encode('utf-8')))
+            elif not spool_photo_ref(ring, spool, job_dict):  # photo in shared memory
+                print("photo {0} no longer in shared memory!".format(job_dict['filename']))
+            job.delete()  # it's safe on disk
             if drive:
                 drive.post_status(message="process_photos: .filename={0}".
                                   format(job_dict['filename']))
-                drive.post_status(message="... type(.data)={0}".format(type(job_dict['data'])))
-                decoded_bytes = base64.decodebytes(job_dict['data'].encode('utf-8'))
-                drive.write_file_bytes(job_dict['filename'], decoded_bytes)
             else:
-                print("Cannot save photo, no Google Drive authorized!")
+                print("Cannot upload photo yet, no Google Drive authorized!")
         elif task == 'session_start':  # start session, create subfolder
+            job.delete()
             if drive:
                 drive.post_status(message="starting scan session, create subfolder")
                 drive.create_root_folder('rpipg')
+            spool.start_session(drive.sub_folder_id if drive else None)
+        else:
+            job.delete()
+
+        uploads.submit_pending()
 
     print("process_photos(): exiting...")
     exit()
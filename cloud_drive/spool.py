@@ -0,0 +1,112 @@
+"""Photo Spool - pictures waiting to be uploaded to the Google Drive are
+kept on disk, so a crash, reboot or dropped connection doesn't lose
+them. Each scan session has a directory of its own:
+
+    spool/20240102030405/manifest.json
+    spool/20240102030405/P0102_IMG_0001.JPG
+
+the manifest has the session's Google Drive folder and the upload
+state of each picture ('pending' or 'uploaded'). A picture is written
+(atomically) before its beanstalk job is deleted, and its file only
+removed once the upload has been confirmed. Whatever's still pending
+when we start up is uploaded again"""
+import os
+import time
+import shutil
+import threading
+import util
+
+SPOOL_DIR = 'spool'
+MANIFEST = 'manifest.json'
+
+
+class PhotoSpool:
+    """the pictures on disk and each session's manifest, the upload
+    workers and the job loop share it"""
+
+    def __init__(self, directory: str = None) -> None:
+        self.directory = directory if directory else util.state_file(SPOOL_DIR)
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self.sessions = {}  # session -> its manifest
+        for session in sorted(os.listdir(self.directory)):
+            manifest = util.load_json(self._path(session, MANIFEST))
+            if manifest:
+                self.sessions[session] = manifest
+        # carry on with the last session until a new one starts
+        self.session = max(self.sessions) if self.sessions else None
+
+    def _path(self, session: str, file_name: str) -> str:
+        return os.path.join(self.directory, session, file_name)
+
+    def _save(self, session: str) -> None:
+        util.save_json(self._path(session, MANIFEST), self.sessions[session])
+
+    def start_session(self, folder_id: str = None) -> str:
+        """new pictures go in a new session, uploaded to 'folder_id'"""
+        with self._lock:
+            session = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+            while session in self.sessions:
+                session += '_'
+            os.makedirs(os.path.join(self.directory, session), exist_ok=True)
+            self.sessions[session] = {'folder_id': folder_id, 'files': {}}
+            previous, self.session = self.session, session
+            self._save(session)
+            if previous:
+                self._tidy(previous)
+            return session
+
+    def set_folder(self, folder_id: str, session: str = None) -> None:
+        """the Google Drive folder a session's pictures go to, if it
+        doesn't already have one"""
+        with self._lock:
+            session = session if session else self.session
+            if session and not self.sessions[session]['folder_id']:
+                self.sessions[session]['folder_id'] = folder_id
+                self._save(session)
+
+    def add(self, file_name: str, data: bytes) -> None:
+        """spool a picture for upload, 'data' can be any buffer"""
+        with self._lock:
+            if self.session is None:
+                self.start_session()
+            util.save_bytes(self._path(self.session, file_name), data)
+            self.sessions[self.session]['files'][file_name] = 'pending'
+            self._save(self.session)
+
+    def pending(self) -> list:
+        """(session, file name, folder id) of every picture still to
+        upload, oldest session first"""
+        with self._lock:
+            return [(session, file_name, manifest['folder_id'])
+                    for session, manifest in sorted(self.sessions.items())
+                    for file_name, state in manifest['files'].items()
+                    if state == 'pending']
+
+    def path(self, session: str, file_name: str) -> str:
+        """where a spooled picture is"""
+        return self._path(session, file_name)
+
+    def read(self, session: str, file_name: str) -> bytes:
+        """a spooled picture"""
+        with open(self._path(session, file_name), 'rb') as infile:
+            return infile.read()
+
+    def uploaded(self, session: str, file_name: str) -> None:
+        """the upload's been confirmed, the picture can go"""
+        with self._lock:
+            self.sessions[session]['files'][file_name] = 'uploaded'
+            self._save(session)
+            try:
+                os.remove(self._path(session, file_name))
+            except FileNotFoundError:
+                pass
+            self._tidy(session)
+
+    def _tidy(self, session: str) -> None:
+        """remove a past session once everything in it is uploaded"""
+        if session == self.session or \
+                'pending' in self.sessions[session]['files'].values():
+            return
+        shutil.rmtree(os.path.join(self.directory, session), ignore_errors=True)
+        del self.sessions[session]
@@ -78,14 +78,19 @@ def send_home_command(queue: beanstalk.Connection) -> int:
 def send_scan_command(queue: beanstalk.Connection,
                       declination_steps: int,
                       rotation_steps: int,
-                      start: int, stop: int) -> int:
+                      start: int, stop: int, capture: str = 'stream',
+                      settings: dict = None) -> int:
     """this is it - time to scan. send the # of steps for each axis
-    and return"""
+    and return. 'capture' is 'stream' to download each picture as it's
+    taken or 'card' to leave them on the camera's card until the end,
+    'settings' are camera settings for the scan ({'iso': '200'} say)"""
     queue.use(TASK_QUEUE)
     task_body = json.dumps({'task': 'scan',
                             'steps': {'declination': declination_steps,
                                       'rotation': rotation_steps},
-                            'offsets': {'start': start, 'stop': stop}
+                            'offsets': {'start': start, 'stop': stop},
+                            'capture': capture,
+                            'settings': settings if settings else {}
                             })
     return queue.put(task_body)
 
@@ -345,6 +350,15 @@ def scan():
               type: integer
               example: 18
               description: "The number or model rotation steps"
+            capture:
+              type: string
+              enum: [stream, card]
+              example: stream
+              description: "download each picture as it's taken (stream) or all at the end (card)"
+            settings:
+              type: object
+              example: {"iso": "200", "shutter": "1/60", "aperture": "8", "image_format": "Large Fine JPEG"}
+              description: "camera settings for the scan, any of iso, shutter, aperture, image_format"
     produces:
       - application/json
     responses:
@@ -369,6 +383,12 @@ def scan():
         rotation_steps = int(request.json['rotation_steps'])
         start = int(request.json['start'])
         stop = int(request.json['stop'])
+        capture = request.json.get('capture', 'stream')
+        if capture not in ('stream', 'card'):
+            raise ValueError("capture must be 'stream' or 'card'")
+        settings = request.json.get('settings', {})
+        if not isinstance(settings, dict):
+            raise ValueError('settings must be an object')
     except KeyError:
         return make_response(jsonify({'msg': 'No JSON'}),
                              status.HTTP_400_BAD_REQUEST)
@@ -388,7 +408,8 @@ def scan():
     try:
         # okay, kick off the scanning
         queue = configure_beanstalk()
-        job_id = send_scan_command(queue, declination_steps, rotation_steps, start, stop)
+        job_id = send_scan_command(queue, declination_steps, rotation_steps,
+                                   start, stop, capture, settings)
         return make_response(jsonify({'msg': 'scan started #{0}'.
                                              format(job_id)}), status.HTTP_200_OK)
     except Exception as error:
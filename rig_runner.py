@@ -6,36 +6,116 @@ Photogrammetry rig. Here we control:
     3. Camera USB - USB control of camera
     4. Camera Lighting - 'ring light' for taking pictures
 """
+import os
 import atexit
 import time
 import json
+import threading
 from multiprocessing import Process
 import beanstalkc as beanstalk
 from rpihat import limit_switch  # our limit switches
 from rpihat.Raspi_PWM_Servo_Driver import PWM
 from rpihat.pimotorhat import Raspi_MotorHAT
-from util import calculate_steps
+from rpihat.motion_profile import TrapezoidalProfile
+from rpihat.motion_process import MotionExecutor, RemoteMotorHAT
+from rpihat.motion_engine import MotionEngine
+from util import plan_scan
+from rig_state import TravelCalibration, PositionModel
 from cameractrl import camera
+from cameractrl.session import SessionManifest
+from cameractrl.photo_ring import PhotoRing
 from cloud_drive import google_drive
 import gphoto2 as gp  #pylint: disable=E0401
 
 
-CCW_MAX_SWITCH = limit_switch.LimitSwitch(18, 'CCW')  # furthest CCW rotation allowed
-CW_MAX_SWITCH = limit_switch.LimitSwitch(4, 'CW')  # furthest CW rotation allowed
+CCW_MAX_SWITCH = None  # furthest CCW rotation allowed
+CW_MAX_SWITCH = None  # furthest CW rotation allowed
 BEANSTALK = None
+CANCEL_LISTENER = None
+MOTION_ENGINE = None
+PHOTO_RING = None  # shared memory the pictures go to the drive process in
 CANCEL_QUEUE = 'cancel'
 STATUS_QUEUE = 'status'
 TASK_QUEUE = 'work'
 
+# set RPIPG_MOTION_PROCESS=1 to step in a process of our own (pinned
+# to this core), away from the queue & camera work
+MOTION_PROCESS = os.environ.get('RPIPG_MOTION_PROCESS', '0') == '1'
+MOTION_CPU = 3
+
+# long camera moves ramp up from the setSpeed() speed to this cruise
+# speed, faster than the motor could start at without stalling
+CAMERA_MOTION_PROFILE = TrapezoidalProfile(cruise_rpm=480, accel=960)
+
+# the camera is kept open between scans, and checked on every this
+# many seconds while we're idle (RPIPG_CAMERA_KEEPALIVE to change)
+CAMERA_KEEPALIVE = float(os.environ.get('RPIPG_CAMERA_KEEPALIVE', '60'))
+
+# microsteps per full step of each motor's MICROSTEP moves, 8, 16, 32
+# or 64 (RPIPG_CAMERA_MICROSTEPS & RPIPG_ROTATION_MICROSTEPS to change)
+CAMERA_MICROSTEPS = int(os.environ.get('RPIPG_CAMERA_MICROSTEPS', '8'))
+ROTATION_MICROSTEPS = int(os.environ.get('RPIPG_ROTATION_MICROSTEPS', '8'))
+
 
 def configure_beanstalk():
     """set up our beanstalk queue for inter-process
     messages"""
     queue = beanstalk.Connection(host='localhost', port=14711)
-    queue.watch(CANCEL_QUEUE) # tube that'll contain cancel requests
+    queue.watch(CANCEL_QUEUE) # so clear_all_queues() empties stale cancels
     return queue
 
 
+class CancelListener(threading.Thread):
+    """Listens for cancel requests so the stepping loop doesn't have
+    to poll beanstalk. We block on the cancel tube with our own
+    connection (a connection can't be shared between threads) and
+    latch any request into an Event the yield function checks"""
+    RESERVE_TIMEOUT = 1  # seconds, how long we block before rechecking
+
+    def __init__(self) -> None:
+        super().__init__(name='cancel-listener', daemon=True)
+        self.cancelled = threading.Event()
+        self.received_at = None
+        self.last_latency = None  # seconds between receiving & acting on a cancel
+        self._shutdown = threading.Event()
+
+    def run(self) -> None:
+        queue = None
+        while not self._shutdown.is_set():
+            try:
+                if queue is None:
+                    queue = beanstalk.Connection(host='localhost', port=14711)
+                    queue.watch(CANCEL_QUEUE)
+                    queue.ignore('default')
+                cancel_job = queue.reserve(timeout=self.RESERVE_TIMEOUT)
+                if cancel_job is not None:
+                    body = cancel_job.body
+                    cancel_job.delete()
+                    print('Cancel received: {0}'.format(body))
+                    self.received_at = time.monotonic()
+                    self.cancelled.set()
+            except beanstalk.CommandFailed:
+                pass
+            except beanstalk.DeadlineSoon:
+                # safe to ignore since it just means there's something pending
+                pass
+            except beanstalk.SocketError:
+                queue = None  # lost beanstalkd, try again shortly
+                time.sleep(self.RESERVE_TIMEOUT)
+
+    def consume(self) -> bool:
+        """true (once) for each cancel that has arrived"""
+        if not self.cancelled.is_set():
+            return False
+        self.cancelled.clear()
+        self.last_latency = time.monotonic() - self.received_at
+        return True
+
+    def stop(self) -> None:
+        """stop listening, takes effect within RESERVE_TIMEOUT"""
+        self._shutdown.set()
+
+
 def clear_all_queues(queue: beanstalk.Connection) -> None:
     """clear out all the currently known tubes"""
     for tube in [CANCEL_QUEUE, STATUS_QUEUE, TASK_QUEUE, google_drive.GDRIVE_QUEUE]:
@@ -57,6 +137,19 @@ def post_status(queue: beanstalk.Connection, message: str) -> None:
         queue.put(status_json)
 
 
+def rotation_yield_function(direction: int) -> dict:
+    """Called in the turntable's timing loops, it has no end stops
+    so only a cancel or an aborted move stops it"""
+    if CANCEL_LISTENER and CANCEL_LISTENER.consume():
+        print('Cancel acted on after {0:.1f}ms'.
+              format(CANCEL_LISTENER.last_latency * 1000))
+        return {'exit': 'cancel'}
+
+    if MOTION_ENGINE:
+        return MOTION_ENGINE.check_abort(direction)
+    return {}
+
+
 def yield_function(direction: int) -> dict:
     """Called in timing loops to perform checks
     to see if we need to breakout. We need the direction
@@ -65,45 +158,91 @@ def yield_function(direction: int) -> dict:
 
     There are several reasons to exit:
        - end stop switch hit
-       - user issues cancel (^C)"""
-    try:
-        if BEANSTALK:  # if we have a queue, check for user cancel
-            BEANSTALK.watch(CANCEL_QUEUE)
-            cancel_job = BEANSTALK.reserve(timeout=0) # don't wait
-            if cancel_job is not None:
-                body = cancel_job.body
-                cancel_job.delete()
-                print('Cancel received: {0}'.format(body))
-                return {'exit':'cancel'}
-
-    except beanstalk.CommandFailed:
-        pass
-    except beanstalk.DeadlineSoon:
-        # safe to ignore since it just means there's something pending
-        pass
+       - user issues cancel (^C)
+
+    This is called from the stepping loop so it must be cheap, a
+    cancel is picked up by the CancelListener thread and the limit
+    switches latch their presses, we only look at flags here"""
+    exit_dict = rotation_yield_function(direction)
+    if exit_dict:
+        return exit_dict
 
     if direction == Raspi_MotorHAT.FORWARD:
-        if CCW_MAX_SWITCH.is_pressed():
+        if CCW_MAX_SWITCH.tripped():
             return {'exit': 'ccw'}
         return {}
 
-    if CW_MAX_SWITCH.is_pressed():
+    if CW_MAX_SWITCH.tripped():
         return {'exit': 'cw'}
     return {}
 
 
+def setup_motion():
+    """create what the stepping loop checks, the limit switches and
+    the cancel listener. This is called in whichever process does the
+    stepping, returns the yield function"""
+    global CCW_MAX_SWITCH, CW_MAX_SWITCH, CANCEL_LISTENER  # pylint:disable=W0603
+    CCW_MAX_SWITCH = limit_switch.LimitSwitch(18, 'CCW')
+    CW_MAX_SWITCH = limit_switch.LimitSwitch(4, 'CW')
+
+    # print out status of end-stop switches
+    print(CCW_MAX_SWITCH.__str__())
+    print(CW_MAX_SWITCH.__str__())
+
+    # cancel requests are handled by a listener thread from here on
+    CANCEL_LISTENER = CancelListener()
+    CANCEL_LISTENER.start()
+    return yield_function
+
+
+def make_motor_controller(yield_func, rotation_yield_func=None,
+                          camera_microsteps: int = CAMERA_MICROSTEPS,
+                          rotation_microsteps: int = ROTATION_MICROSTEPS) -> Raspi_MotorHAT:
+    """configure the motor controller Pi Hat, each motor can microstep
+    at its own resolution"""
+    motor_hat_i2_c_addr = 0x6F
+    motor_hat_i2c_freq = 1600
+    motor_controller = Raspi_MotorHAT(pwm_obj=PWM(motor_hat_i2_c_addr),
+                                      yield_func=yield_func,
+                                      freq=motor_hat_i2c_freq,
+                                      debug=False,
+                                      camera_microsteps=camera_microsteps,
+                                      rotation_yield_func=rotation_yield_func,
+                                      rotation_microsteps=rotation_microsteps)
+
+    # set the stepper speed
+    camera_stepper_motor_speed = 240 # rpm
+    motor_controller.camera_stepper.setSpeed(camera_stepper_motor_speed)
+    motor_controller.rotation_stepper.setSpeed(camera_stepper_motor_speed)
+    return motor_controller
+
+
 def turn_off_motors(motor_controller: Raspi_MotorHAT):
     """disable motors. Typically this will be called
     'at exit' so motors don't overheat when idle and energized"""
     motor_controller.release_motors()
 
 
+class HomingError(Exception):
+    """homing stopped before the end stop was found, the forced exit
+    that stopped it is 'exit'"""
+
+    def __init__(self, forced_exit: dict) -> None:
+        super().__init__('homing stopped: {0}'.format(forced_exit.get('exit')))
+        self.exit = forced_exit
+
+
 class CameraControl:
     """Control the movement of the camera (declination)"""
     STEP_CAMERA_CCW = Raspi_MotorHAT.FORWARD
     STEP_CAMERA_CW = Raspi_MotorHAT.BACKWARD
     STEP_MODEL_CCW = Raspi_MotorHAT.FORWARD
     STEP_MODEL_CW = Raspi_MotorHAT.BACKWARD
+    HOMING_BACKOFF_STEPS = 50  # back off an end stop this far...
+    HOMING_SLOW_RPM = 30  # ...then come back to it this slowly
+    HOMING_TRAVEL_MARGIN = 1.5  # give up looking for an end stop after this much of the travel
+    HOMING_MAX_STEPS = 6000  # ...or this many steps if we've no calibrated travel
+    START_ROTATION = 0  # turntable angle the scans start at
 
     _controller = None
 
@@ -129,34 +268,188 @@ class CameraControl:
         """set the queue we are to use"""
         self._queue = value
 
-    def __init__(self, motor_controller: Raspi_MotorHAT, queue: beanstalk.Connection):
+    def __init__(self, motor_controller: Raspi_MotorHAT, queue: beanstalk.Connection,
+                 calibration: TravelCalibration = None,
+                 position: PositionModel = None,
+                 motion: MotionEngine = None,
+                 cameras: camera.CameraManager = None):
         self.motor_controller = motor_controller
         self.queue = queue
+        self.motion = motion if motion else MotionEngine()
+        self.cameras = cameras if cameras else camera.CameraManager(CAMERA_KEEPALIVE)
+        self.calibration = calibration if calibration else TravelCalibration()
+        self.position = position if position else PositionModel()
+
+    @staticmethod
+    def rearm_switches() -> None:
+        """clear the limit switch latches before a camera move, a
+        switch that is still pressed stays tripped. With a motion
+        process the switches are there, and it rearms them for us"""
+        if CCW_MAX_SWITCH:
+            CCW_MAX_SWITCH.rearm()
+        if CW_MAX_SWITCH:
+            CW_MAX_SWITCH.rearm()
+
+    def step_camera(self, steps: int, step_dir: int,
+                    profile: TrapezoidalProfile = None) -> dict:
+        """move the camera, keeping track of where it is"""
+        camera_stepper = self.motor_controller.camera_stepper
+        starting_stepper_pos = camera_stepper.stepping_counter
+        self.rearm_switches()
+        self.position.begin_move()
+        try:
+            return camera_stepper.step(steps, step_dir, Raspi_MotorHAT.DOUBLE, profile)
+        finally:
+            self.position.end_move(declination_steps=camera_stepper.stepping_counter -
+                                   starting_stepper_pos)
+
+    def step_model(self, steps: int, step_dir: int) -> dict:
+        """rotate the model, keeping track of the turntable angle"""
+        rotation_stepper = self.motor_controller.rotation_stepper
+        starting_stepper_pos = rotation_stepper.stepping_counter
+        self.position.begin_move(camera=False)
+        try:
+            return rotation_stepper.step(steps, step_dir, Raspi_MotorHAT.DOUBLE)
+        finally:
+            self.position.end_move(rotation_steps=rotation_stepper.stepping_counter -
+                                   starting_stepper_pos)
+
+    def move_both(self, rotation_steps: int, declination_steps: int) -> dict:
+        """rotate the model and move the camera at the same time,
+        positive steps are CCW. If the camera stops at an end stop we
+        finish the rotation on its own"""
+        hat = self.motor_controller
+        rotation_stepper = hat.rotation_stepper
+        camera_stepper = hat.camera_stepper
+        rotation_start = rotation_stepper.stepping_counter
+        camera_start = camera_stepper.stepping_counter
+        rotation_dir = self.STEP_MODEL_CCW if rotation_steps > 0 else self.STEP_MODEL_CW
+        camera_dir = self.STEP_CAMERA_CCW if declination_steps > 0 else self.STEP_CAMERA_CW
+
+        # the profile is for the camera stepper, only use it when the camera sets the pace
+        profile = CAMERA_MOTION_PROFILE \
+            if abs(declination_steps) > abs(rotation_steps) else None
+        self.rearm_switches()
+        self.position.begin_move()
+        try:
+            forced_exit = hat.move_both(abs(rotation_steps), rotation_dir,
+                                        abs(declination_steps), camera_dir,
+                                        Raspi_MotorHAT.DOUBLE, profile)
+        finally:
+            self.position.end_move(
+                declination_steps=camera_stepper.stepping_counter - camera_start,
+                rotation_steps=rotation_stepper.stepping_counter - rotation_start)
+
+        if forced_exit and forced_exit['exit'] in ('ccw', 'cw'):
+            remaining_steps = rotation_steps - \
+                (rotation_stepper.stepping_counter - rotation_start)
+            if remaining_steps:
+                rotation_exit = self.step_model(abs(remaining_steps), rotation_dir)
+                if rotation_exit:
+                    return rotation_exit
+        return forced_exit
+
+    def move_by(self, rotation_steps: int, declination_steps: int) -> dict:
+        """make a move, positive steps are CCW. When both axes move they
+        move together"""
+        if rotation_steps and declination_steps:
+            return self.move_both(rotation_steps, declination_steps)
+        if rotation_steps:
+            return self.step_model(abs(rotation_steps),
+                                   self.STEP_MODEL_CCW if rotation_steps > 0
+                                   else self.STEP_MODEL_CW)
+        if declination_steps:
+            return self.step_camera(abs(declination_steps),
+                                    self.STEP_CAMERA_CCW if declination_steps > 0
+                                    else self.STEP_CAMERA_CW,
+                                    CAMERA_MOTION_PROFILE)
+        return {}
+
+    def move_to_pose(self, declination: int, rotation: int = None) -> dict:
+        """take the shortest route to a pose, the declination in steps
+        CCW of the CW end stop and the turntable angle in steps. The
+        camera's position must be known"""
+        if not self.position.is_known:
+            post_status(self.queue, 'camera position unknown, cannot move to pose')
+            return {'exit': 'position'}
+
+        rotation_steps = 0
+        if rotation is not None:
+            rotation_steps = self.position.rotation_move(rotation)
+        return self.move_by(rotation_steps, self.position.declination_move(declination))
+
+    def homing_max_steps(self) -> int:
+        """the furthest we go looking for an end stop"""
+        if self.calibration.travel_steps:
+            return int(self.calibration.travel_steps * self.HOMING_TRAVEL_MARGIN)
+        return self.HOMING_MAX_STEPS
+
+    def approach_end_stop(self, step_dir: int,
+                          profile: TrapezoidalProfile = None) -> None:
+        """move the camera in a direction until that direction's limit
+        switch trips (the yield function stops us with its exit).
+        Raises HomingError if anything else stops us (a cancel say), or
+        we've gone further than the travel without finding the switch"""
+        camera_stepper = self.motor_controller.camera_stepper
+        end_stop = 'ccw' if step_dir == self.STEP_CAMERA_CCW else 'cw'
+        self.rearm_switches()
+        remaining_steps = self.homing_max_steps()
+        while remaining_steps > 0:
+            burst = min(1000, remaining_steps)
+            forced_exit = camera_stepper.step(burst, step_dir, Raspi_MotorHAT.DOUBLE, profile)
+            if forced_exit:
+                if forced_exit.get('exit') != end_stop:
+                    raise HomingError(forced_exit)
+                return
+            remaining_steps -= burst
+        raise HomingError({'exit': 'travel'})
 
-    def move_camera(self, step_dir: int,
-                    switch: limit_switch.LimitSwitch) -> int:
+    def move_camera(self, step_dir: int) -> int:
         """home the camera. This means moving in a direction and checking
-        for that direction's limit switch"""
+        for that direction's limit switch. We get there fast, back off
+        and then slowly come back to find the switch's edge precisely"""
         camera_stepper = self.motor_controller.camera_stepper
         starting_stepper_pos = camera_stepper.stepping_counter
-        while not switch.is_pressed():
-            camera_stepper.step(1000, step_dir, Raspi_MotorHAT.DOUBLE)
+        self.position.begin_move()
+        try:
+            self.approach_end_stop(step_dir, CAMERA_MOTION_PROFILE)
+
+            back_off_dir = self.STEP_CAMERA_CW \
+                if step_dir == self.STEP_CAMERA_CCW else self.STEP_CAMERA_CCW
+            forced_exit = camera_stepper.step(self.HOMING_BACKOFF_STEPS, back_off_dir,
+                                              Raspi_MotorHAT.DOUBLE)
+            if forced_exit:
+                raise HomingError(forced_exit)  # a cancel say, nothing should stop a back off
+
+            # not setSpeed(), that would reset the stepping counter
+            sec_per_step = camera_stepper.sec_per_step
+            camera_stepper.sec_per_step = 60.0 / (camera_stepper.revsteps * self.HOMING_SLOW_RPM)
+            try:
+                self.approach_end_stop(step_dir)
+            finally:
+                camera_stepper.sec_per_step = sec_per_step
+        except HomingError:
+            # we don't know where we are
+            self.position.end_move()
+            self.position.set_declination(None)
+            raise
 
         traveled_steps = camera_stepper.stepping_counter - starting_stepper_pos
         if step_dir == self.STEP_CAMERA_CCW:
             camera_stepper.stepping_counter = 0
 
+        self.position.end_move(declination_steps=traveled_steps)
         return traveled_steps
 
     def ccw_camera_home(self) -> int:
         """home the camera in the counter-clockwise direction"""
         post_status(self.queue, "CCW homing")
-        return self.move_camera(self.STEP_CAMERA_CCW, CCW_MAX_SWITCH)
+        return self.move_camera(self.STEP_CAMERA_CCW)
 
     def cw_camera_home(self) -> int:
         """home the camera in the clockwise direction"""
         post_status(self.queue, "CW homing")
-        return self.move_camera(self.STEP_CAMERA_CW, CW_MAX_SWITCH)
+        return self.move_camera(self.STEP_CAMERA_CW)
 
     def home_camera(self) -> int:
         """home the camera. This will move the camera to the two
@@ -164,41 +457,78 @@ class CameraControl:
         span the extremes"""
         self.ccw_camera_home()
         travel = abs(self.cw_camera_home())
+        self.position.set_declination(0)
+        self.calibration.measured(travel)
         post_status(self.queue, 'homing complete, {0} steps'.format(travel))
         return travel
 
+    def ensure_homed(self) -> int:
+        """make sure we know where the camera is and return the
+        declination travel. If we know where the camera is, and have
+        checked recently, there's nothing to do. If our saved
+        calibration is good we only need to find the CW end stop,
+        otherwise (or if it wasn't where we expected) we home both ends"""
+        if not self.calibration.is_valid():
+            return self.home_camera()
+
+        travel = self.calibration.travel_steps
+        if self.position.is_known and not self.calibration.needs_verify():
+            post_status(self.queue, 'camera position known, no homing needed')
+            return travel
+
+        expected_steps = None
+        if self.position.is_known:
+            expected_steps = -self.position.declination
+
+        traveled_steps = self.cw_camera_home()
+        self.position.set_declination(0)
+        drift = None if expected_steps is None else traveled_steps - expected_steps
+        if not self.calibration.verified(drift):
+            post_status(self.queue, 'end stop {0} steps off, re-homing'.format(drift))
+            return self.home_camera()
+
+        post_status(self.queue, 'home verified, {0} steps'.format(travel))
+        return travel
+
     def move_to_start(self, declination_start: int) -> dict:
-        """move the camera to it's starting position if required"""
-        if declination_start == 0:
+        """move the camera to it's starting position if required, and
+        turn the turntable back to where the scans start (so the shots'
+        rotations are the same angles every scan). Both move together,
+        by the shortest route from wherever they are"""
+        if self.position.declination == declination_start and \
+                self.position.rotation == self.START_ROTATION:
             return {}
         post_status(self.queue,
                     'move to declination start {0}'.
                     format(declination_start))
-        camera_stepper = self.motor_controller.camera_stepper
-        forced_exit = camera_stepper.step(declination_start,
-                                          self.STEP_CAMERA_CCW,
-                                          Raspi_MotorHAT.DOUBLE)
-        return forced_exit
+        return self.move_to_pose(declination_start, self.START_ROTATION)
 
-    def take_picture(self, my_camera: gp.camera,
-                     rotation: int, declination: int) -> None:
-        """take the picture"""
+    def capture_picture(self, my_camera: gp.camera, camera_lock: threading.Lock,
+                        shot: dict) -> gp.CameraFilePath:
+        """take the picture, it's left on the camera"""
         post_status(self.queue, "taking picture R{0}:D{1}".
-                    format(rotation, declination))
-        file_name = camera.take_picture(my_camera, rotation, declination, self.queue)
-        post_status(self.queue, "Filename={0}".format(file_name))
+                    format(shot['rotation'], shot['declination']))
+        with camera_lock:
+            return camera.capture(my_camera)
 
-    def photograph_model(self,  # pylint: disable-msg=too-many-arguments
-                         declination_divisions: int,
-                         rotation_divisions: int,
-                         remaining_declination_steps: int,
-                         steps_per_declination: int,
-                         steps_per_rotation: int) -> None:
+    def submit_move(self, shot: dict):
+        """start the move to a shot on the motion thread"""
+        return self.motion.submit(self.move_by, shot['rotation_steps'], shot['declination_steps'])
 
+    def photograph_model(self, plan: dict, capture: str = 'stream',
+                         settings: dict = None) -> None:
         """here's where we rotate the model, declinate the camera
-        and take pictures"""
+        and take pictures, in the order util.plan_scan() worked out.
+        As soon as the shutter closes we start the next move, the
+        picture is downloaded, encoded & queued for upload by the photo
+        pipeline's stages while the rig moves. With capture='card' the
+        pictures stay on the camera's card and are all downloaded after
+        the last one. Those are noted in the session manifest until
+        they're sent on, streamed pictures were never on the card so
+        aren't. 'settings' are the camera settings for the scan, see
+        cameractrl.settings"""
         try:
-            rig_camera = camera.init_camera()
+            rig_camera = self.cameras.acquire()
             if not rig_camera:
                 post_status(self.queue, "Did not get camera object!")
                 return
@@ -206,56 +536,93 @@ class CameraControl:
             post_status(self.queue, 'Camera is off!')
             return
 
+        # the camera stays open between scans, so set where the pictures
+        # go every time, along with the scan's settings. Only the ones
+        # that aren't already right are sent to the camera
+        settings = dict(settings) if settings else {}
+        target = camera.capture_target(self.cameras.config, card=capture == 'card')
+        if capture == 'card' and not target:
+            post_status(self.queue, 'cannot capture to card, downloading as we go')
+            capture = 'stream'
+            target = camera.capture_target(self.cameras.config, card=False)
+        if target:
+            settings['capture_target'] = target
         try:
-            for declination in range(0, declination_divisions):
-                post_status(self.queue, "rotating model")
-                for rotation in range(0, rotation_divisions):
-
-                    self.take_picture(my_camera=rig_camera,
-                                      rotation=rotation,
-                                      declination=declination)
-
-                    forced_exit = self.\
-                        motor_controller.\
-                        rotation_stepper.\
-                        step(steps_per_rotation, self.STEP_MODEL_CCW,
-                             Raspi_MotorHAT.DOUBLE)
-                    if forced_exit and forced_exit['exit'] == 'cancel':
-                        return  # forced exit
+            changed = self.cameras.config.apply(settings)
+            if changed:
+                print('camera settings changed: {0}'.format(', '.join(changed)))
+        except (NameError, ValueError, camera.gp.GPhoto2Error) as error:
+            post_status(self.queue, 'camera settings failed: {0}'.format(error))
+            self.cameras.release()
+            return
+
+        manifest = SessionManifest()
+        manifest.start()
+
+        shots = plan['shots']
+        camera_lock = self.cameras.lock
+        pipeline = camera.photo_pipeline(rig_camera, camera_lock, ring=PHOTO_RING) \
+            if capture == 'stream' else None
+        move = None
+        try:
+            move = self.submit_move(shots[0]) if shots else None
+            for index, shot in enumerate(shots):
+                if not shot['rotation_steps']:  # starting a ring
+                    post_status(self.queue, "rotating model")
 
-                # if we hit an exit condition while rotating, or there are no more
-                # steps, then bale out
-                if steps_per_declination == 0:
-                    return
-
-                # okay, we have work to do, position the camera
-                forced_exit = self.\
-                    motor_controller.\
-                    camera_stepper.\
-                    step(steps_per_declination, self.STEP_CAMERA_CCW,
-                         Raspi_MotorHAT.DOUBLE)
+                forced_exit = move.wait()
                 if forced_exit:
+                    if forced_exit['exit'] not in ('ccw', 'cw'):
+                        return  # forced exit
+
                     # if this is the last position, we expect to hit the end-stop
-                    if remaining_declination_steps != steps_per_declination:
-                        print("...end stop hit! {0}/{1}".
-                              format(remaining_declination_steps,
-                                     steps_per_declination))
+                    if not shot['end_stop']:
+                        print("...end stop hit! {0}".format(shot))
+                        self.calibration.invalidate()
+                        self.position.set_declination(None)
                         return
                     if forced_exit['exit'] != 'ccw':
                         return
 
-                # the declination motion may not be perfect fit so don't overstep
-                remaining_declination_steps -= steps_per_declination
-                if remaining_declination_steps < steps_per_declination:
-                    steps_per_declination = remaining_declination_steps
+                file_path = self.capture_picture(rig_camera, camera_lock, shot)
+                if index + 1 < len(shots):
+                    move = self.submit_move(shots[index + 1])
+                if pipeline:
+                    # waits here if the pipeline is backed up
+                    pipeline.put((file_path, shot['rotation'], shot['declination']))
+                else:
+                    camera.record_capture(manifest, file_path,
+                                          shot['rotation'], shot['declination'])
 
         finally:
-            # no matter how we exit, free up the camera!
-            camera.exit_camera(rig_camera)
-
-
-def wait_for_work(queue: beanstalk.Connection, motor_controller: Raspi_MotorHAT) -> dict:
-    """wait for work, return json"""
+            # don't leave the rig moving
+            if move:
+                move.cancel()
+                move.wait()
+            self.position.save()  # where the turntable ended up
+            # the pictures we took still need to come off the camera
+            if pipeline:
+                failures = pipeline.close()
+                print('photo pipeline: {0}'.format(json.dumps(pipeline.stats())))
+                if failures:
+                    post_status(self.queue, '{0} pictures failed in the photo pipeline'.
+                                format(len(failures)))
+            # along with any left on the card, by this scan or one that
+            # didn't get to download them
+            pending = len(manifest.pending())
+            if pending:
+                post_status(self.queue, 'downloading {0} pictures from card'.format(pending))
+                sent = camera.bulk_download(rig_camera, manifest, camera_lock,
+                                            ring=PHOTO_RING)
+                post_status(self.queue, 'downloaded {0} of {1}'.format(sent, pending))
+            # the camera stays open for the next scan
+            self.cameras.release()
+
+
+def wait_for_work(queue: beanstalk.Connection, motor_controller: Raspi_MotorHAT,
+                  cameras: camera.CameraManager = None) -> dict:
+    """wait for work, return json. While we wait the camera is kept
+    alive (and checked on)"""
     idle_start = time.time()
     while True:
         queue.watch(TASK_QUEUE)
@@ -267,6 +634,9 @@ def wait_for_work(queue: beanstalk.Connection, motor_controller: Raspi_MotorHAT)
 
         time.sleep(0.01) # sleep for 10 ms to share the computer
 
+        if cameras:
+            cameras.idle()
+
         # if we have been idle for too long
         # release the stepper motors so they
         # don't overheat
@@ -282,11 +652,12 @@ def forward_authorization(queue: beanstalk.Connection, job: dict):
     queue.put(json.dumps(job))
 
 
-def start_drive_process():
+def start_drive_process(ring: PhotoRing = None):
     """Start the process that will upload photos to the
     google drive. This process will 'listen' to the
-    Google Drive tube for work"""
-    drive_process = Process(target=google_drive.process_photos, args=())
+    Google Drive tube for work, and read the pictures out
+    of 'ring' if they're in it"""
+    drive_process = Process(target=google_drive.process_photos, args=(ring,))
     drive_process.start()
 
 
@@ -312,6 +683,12 @@ def process_scan_command(job_dict: dict,
         rotation_divisions = int(job_dict['steps']['rotation'])
         start = int(job_dict['offsets']['start'])
         stop = int(job_dict['offsets']['stop'])
+        capture = job_dict.get('capture', 'stream')
+        if capture not in ('stream', 'card'):
+            raise ValueError("capture must be 'stream' or 'card'")
+        settings = job_dict.get('settings', {})
+        if not isinstance(settings, dict):
+            raise ValueError('settings must be an object')
 
         max_pictures = 200  # maximum # of pictures we can take (sanity check)
         if (declination_divisions * rotation_divisions) > max_pictures:
@@ -338,17 +715,20 @@ def process_scan_command(job_dict: dict,
 
     if declination_travel_steps == 0:
         post_status(camera_controller.queue, 'homing system prior to scan...')
-        declination_travel_steps = camera_controller.home_camera()
+        try:
+            declination_travel_steps = camera_controller.ensure_homed()
+        except HomingError as error:
+            post_status(camera_controller.queue, str(error))
+            return 0
 
     # okay we have valid parameters, time to scan the object
-    steps_per_declination, \
-        steps_per_rotation, \
-        declination_start = calculate_steps(declination_divisions,
-                                            rotation_divisions,
-                                            declination_travel_steps,
-                                            200,  # number steps in one rotation
-                                            start,
-                                            stop)
+    plan = plan_scan(declination_divisions,
+                     rotation_divisions,
+                     declination_travel_steps,
+                     200,  # number steps in one rotation
+                     start,
+                     stop)
+    declination_start = plan['declination_start']
 
     print('declination_divisions={0}\nrotation_divisions={1}'
           '\ntravel={2}\nstart={3}\nstop={4}'.
@@ -356,19 +736,16 @@ def process_scan_command(job_dict: dict,
                  rotation_divisions, declination_travel_steps,
                  start, stop))
     print('... {0} declination steps, {1} rotation steps, declination start {2}'.
-          format(steps_per_declination,
-                 steps_per_rotation,
+          format(plan['steps_per_declination'],
+                 plan['steps_per_rotation'],
                  declination_start))
+    print('... {0} shots, {1} steps in all'.
+          format(len(plan['shots']), plan['total_steps']))
 
     # move camera to starting position for pictures
     forced_exit = camera_controller.move_to_start(declination_start)
     if not forced_exit:
-        camera_controller.\
-            photograph_model(declination_divisions,
-                             rotation_divisions,
-                             declination_travel_steps - declination_start,
-                             steps_per_declination,
-                             steps_per_rotation)
+        camera_controller.photograph_model(plan, capture, settings)
 
     return 0  # this basically makes us "un-homed'
 
@@ -378,37 +755,54 @@ def main():
 
     # perform our setup & initialization
 
-    # on exit, turn off stepper motors
-    atexit.register(turn_off_motors)
-
     # setup a queue to exchange messages
     global BEANSTALK  # pylint:disable=W0603
     BEANSTALK = configure_beanstalk()
     clear_all_queues(BEANSTALK)
 
-    # configure the motor controller Pi Hat
-    motor_hat_i2_c_addr = 0x6F
-    motor_hat_i2c_freq = 1600
-    motor_controller = Raspi_MotorHAT(pwm_obj=PWM(motor_hat_i2_c_addr),
-                                      yield_func=yield_function,
-                                      freq=motor_hat_i2c_freq,
-                                      debug=False)
+    # the stepping, and the checks the stepping loop makes, are either
+    # in a motion process or here
+    BEANSTALK.ignore(CANCEL_QUEUE)
+    abort_event = None
+    if MOTION_PROCESS:
+        executor = MotionExecutor(make_motor_controller,
+                                  setup=setup_motion,
+                                  before_move=CameraControl.rearm_switches,
+                                  cpu=MOTION_CPU,
+                                  rotation_yield=rotation_yield_function)
+        executor.start()
+        motor_controller = RemoteMotorHAT(executor)
+        abort_event = executor.abort  # cancelled moves are stopped over there
+    else:
+        motor_controller = make_motor_controller(setup_motion(), rotation_yield_function)
 
-    # set the stepper speed
-    camera_stepper_motor_speed = 240 # rpm
-    motor_controller.camera_stepper.setSpeed(camera_stepper_motor_speed)
-    motor_controller.rotation_stepper.setSpeed(camera_stepper_motor_speed)
+    # on exit, turn off stepper motors
+    atexit.register(turn_off_motors, motor_controller)
+
+    # moves are made on a motion thread so they can overlap taking pictures
+    global MOTION_ENGINE  # pylint:disable=W0603
+    MOTION_ENGINE = MotionEngine(abort_event=abort_event)
+
+    # the camera is opened for the first scan & kept open
+    cameras = camera.CameraManager(CAMERA_KEEPALIVE)
+    atexit.register(cameras.close)
 
     # our main object to control camera/rig functions
-    camera_controller = CameraControl(motor_controller, BEANSTALK)
+    camera_controller = CameraControl(motor_controller, BEANSTALK,
+                                      motion=MOTION_ENGINE, cameras=cameras)
+
+    # pictures go to the Google Drive process in shared memory, which
+    # it inherits. If we can't have any they go through beanstalk
+    global PHOTO_RING  # pylint:disable=W0603
+    try:
+        PHOTO_RING = PhotoRing.create()
+        atexit.register(PHOTO_RING.close)
+    except (OSError, ValueError) as error:
+        print('no shared memory for pictures: {0}'.format(error))
 
     # startup the Google Drive process. This listens
     # for credentials and photos
-    start_drive_process()
-
-    # print out status of end-stop switches
-    print(CCW_MAX_SWITCH.__str__())
-    print(CW_MAX_SWITCH.__str__())
+    start_drive_process(PHOTO_RING)
 
     print("\n")
     print("**********************\n")
@@ -417,9 +811,12 @@ def main():
 
     declination_travel_steps = 0  # if non-zero, we are "homed"
     while True:
-        job_dict = wait_for_work(camera_controller.queue, motor_controller)
+        job_dict = wait_for_work(camera_controller.queue, motor_controller, cameras)
         if job_dict['task'] == 'home' and declination_travel_steps == 0:
-            declination_travel_steps = camera_controller.home_camera()
+            try:
+                declination_travel_steps = camera_controller.home_camera()
+            except HomingError as error:
+                post_status(camera_controller.queue, str(error))
 
         if job_dict['task'] == 'token':
             forward_authorization(camera_controller.queue, job_dict)
@@ -0,0 +1,148 @@
+"""Rig State - what we know about the rig that's worth keeping
+across scans and restarts, saved in the util.STATE_DIR directory"""
+import time
+import util
+
+
+class TravelCalibration:
+    """The declination travel, the number of steps between the two
+    camera end stops, as measured by a full homing. Later scans can
+    trust it and only verify one end stop while our confidence in it
+    stays up"""
+    MAX_AGE = 7 * 24 * 3600  # seconds, re-measure at least weekly
+    MIN_CONFIDENCE = 0.5  # below this we re-measure
+    DRIFT_THRESHOLD = 20  # steps, verification drift we tolerate
+    VERIFY_INTERVAL = 3600  # seconds we trust a known position without re-checking
+    UNVERIFIED_DECAY = 0.9  # confidence lost verifying without a drift check
+
+    def __init__(self, path: str = None) -> None:
+        self.path = path if path else util.state_file('calibration.json')
+        self.travel_steps = 0
+        self.timestamp = 0.0  # time.time() the travel was measured
+        self.verified_at = 0.0  # ...and last confirmed
+        self.confidence = 0.0
+        self.load()
+
+    def load(self) -> None:
+        """read our calibration from disk"""
+        saved = util.load_json(self.path)
+        self.travel_steps = int(saved.get('travel_steps', 0))
+        self.timestamp = float(saved.get('timestamp', 0.0))
+        self.verified_at = float(saved.get('verified_at', self.timestamp))
+        self.confidence = float(saved.get('confidence', 0.0))
+
+    def save(self) -> None:
+        """write our calibration to disk"""
+        util.save_json(self.path, {'travel_steps': self.travel_steps,
+                                   'timestamp': self.timestamp,
+                                   'verified_at': self.verified_at,
+                                   'confidence': self.confidence})
+
+    def is_valid(self) -> bool:
+        """can we skip measuring the travel"""
+        return self.travel_steps > 0 and \
+            self.confidence >= self.MIN_CONFIDENCE and \
+            (time.time() - self.timestamp) < self.MAX_AGE
+
+    def needs_verify(self) -> bool:
+        """has it been a while since we last found an end stop"""
+        return (time.time() - self.verified_at) >= self.VERIFY_INTERVAL
+
+    def measured(self, travel_steps: int) -> None:
+        """we've just homed both end stops"""
+        self.travel_steps = travel_steps
+        self.timestamp = self.verified_at = time.time()
+        self.confidence = 1.0
+        self.save()
+
+    def verified(self, drift: int = None) -> bool:
+        """we've homed one end stop, 'drift' is how many steps off
+        from where we expected it we found it (None if we didn't know
+        where the camera was). Returns False if the drift is too much"""
+        if drift is None:
+            self.confidence *= self.UNVERIFIED_DECAY
+        else:
+            self.confidence = max(0.0, 1.0 - abs(drift) / self.DRIFT_THRESHOLD)
+        self.verified_at = time.time()
+        self.save()
+        return abs(drift or 0) <= self.DRIFT_THRESHOLD
+
+    def invalidate(self) -> None:
+        """something unexpected happened (like hitting an end stop
+        mid scan), the next scan must home fully"""
+        self.confidence = 0.0
+        self.save()
+
+
+class PositionModel:
+    """Where the rig is. The camera declination is in steps CCW of the
+    CW end stop (None when we don't know), the turntable angle is in
+    steps CCW of wherever it was when we started tracking it.
+
+    Every camera move is journalled, we note a move is under way before
+    we step and where we ended up afterwards. If we restart and find a
+    move under way we can't trust the declination any more. Turntable
+    moves can't lose the declination, so they aren't journalled (that's
+    two synced writes a picture saved), where they leave the turntable
+    is saved with the next camera move or save()"""
+
+    def __init__(self, rotation_steps: int = 200, path: str = None) -> None:
+        self.path = path if path else util.state_file('position.json')
+        self.rotation_steps = rotation_steps
+        self.declination = None
+        self.rotation = 0
+        self.moving = False
+        self.load()
+
+    def load(self) -> None:
+        """read the journal"""
+        saved = util.load_json(self.path)
+        self.declination = saved.get('declination')
+        self.rotation = int(saved.get('rotation', 0)) % self.rotation_steps
+        if saved.get('moving', False):
+            self.declination = None  # we died mid move
+        self.moving = False
+
+    def save(self) -> None:
+        """write the journal"""
+        util.save_json(self.path, {'declination': self.declination,
+                                   'rotation': self.rotation,
+                                   'moving': self.moving})
+
+    @property
+    def is_known(self) -> bool:
+        """do we know where the camera is"""
+        return self.declination is not None
+
+    def begin_move(self, camera: bool = True) -> None:
+        """about to step, until end_move() our position is uncertain.
+        Only journalled if the 'camera' moves"""
+        if camera:
+            self.moving = True
+            self.save()
+
+    def end_move(self, declination_steps: int = 0, rotation_steps: int = 0) -> None:
+        """a move finished (or was interrupted) having taken these
+        many steps, positive is CCW"""
+        if self.declination is not None:
+            self.declination += declination_steps
+        self.rotation = (self.rotation + rotation_steps) % self.rotation_steps
+        if self.moving:
+            self.moving = False
+            self.save()
+
+    def set_declination(self, declination: int = None) -> None:
+        """we've found where the camera is (an end stop), or lost it (None)"""
+        self.declination = declination
+        self.save()
+
+    def declination_move(self, target: int) -> int:
+        """steps to get the camera to a declination, positive is CCW"""
+        return target - self.declination
+
+    def rotation_move(self, target: int) -> int:
+        """the shortest way round to a turntable angle, positive is CCW"""
+        steps = (target - self.rotation) % self.rotation_steps
+        if steps > self.rotation_steps // 2:
+            steps -= self.rotation_steps
+        return steps
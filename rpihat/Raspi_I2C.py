@@ -1,7 +1,10 @@
 #!/usr/bin/python
 """Raspi I2C"""
 import re
-import smbus2 as smbus
+try:
+    import smbus2 as smbus
+except ImportError:  # not on a Pi, only the simulated bus will work
+    smbus = None
 
 # ===========================================================================
 # Raspi_I2C Class
@@ -41,6 +44,8 @@ class Raspi_I2C(object):
 
     def __init__(self, address, busnum=-1, debug=False):
         self.address = address
+        if smbus is None:
+            raise ImportError('smbus2 is needed to use the I2C bus')
         # By default, the correct I2C bus is auto-detected using /proc/cpuinfo
         # Alternatively, you can hard-code the bus version below:
         # self.bus = smbus.SMBus(0); # Force I2C0 (early 256MB Pi's)
@@ -75,8 +80,7 @@ class Raspi_I2C(object):
             if self.debug:
                 print("I2C: Wrote 0x%02X to register 0x%02X" % (value, reg))
         except IOError as err:
-            self.errMsg(err)
-            return
+            return self.errMsg(err)
 
     def write16(self, reg, value):
         """Writes a 16-bit value to the specified register/address pair"""
@@ -86,8 +90,7 @@ class Raspi_I2C(object):
                 print(("I2C: Wrote 0x%02X to register pair 0x%02X,0x%02X" %
                        (value, reg, reg+1)))
         except IOError as err:
-            self.errMsg(err)
-            return
+            return self.errMsg(err)
 
     def writeRaw8(self, value):
         """Writes an 8-bit value on the bus"""
@@ -96,19 +99,17 @@ class Raspi_I2C(object):
             if self.debug:
                 print("I2C: Wrote 0x%02X" % value)
         except IOError as err:
-            self.errMsg(err)
-            return
+            return self.errMsg(err)
 
-    def writeList(self, reg, byte_list) -> None:
-        """Writes an array of bytes using I2C format"""
+    def writeList(self, reg, byte_list) -> int:
+        """Writes an array of bytes using I2C format, -1 on error"""
         try:
             if self.debug:
                 print("I2C: Writing list to register 0x%02X:" % reg)
                 print(byte_list)
             self.bus.write_i2c_block_data(self.address, reg, byte_list)
         except IOError as err:
-            self.errMsg(err)
-            return
+            return self.errMsg(err)
 
     def readList(self, reg, length) -> list:
         """Read a list of bytes from the I2C device"""
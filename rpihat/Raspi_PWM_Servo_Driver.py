@@ -1,10 +1,12 @@
 #!/usr/bin/python
 """Raspi PCA9685 16-channel PWM server driver"""
 
-import time
 import math
+import weakref
+import threading
 from rpihat.Raspi_I2C import Raspi_I2C
 from rpihat.basis import PWMInterface
+from rpihat.clock import SystemClock
 
 # pylint:disable=C0103
 
@@ -30,36 +32,64 @@ class PWM(PWMInterface):
     __ALL_LED_OFF_L = 0xFC
     __ALL_LED_OFF_H = 0xFD
 
+    # an I2C block write carries at most 32 bytes
+    __MAX_BLOCK_BYTES = 32
+    # re-sending up to this many unchanged registers is cheaper than
+    # starting a new I2C transaction (start/stop, address & register
+    # bytes and another trip through the smbus driver)
+    __MAX_BLOCK_GAP = 6
+    __LED_REGISTERS = 64        # 16 channels, ON_L/ON_H/OFF_L/OFF_H
+
     # Bits
     __RESTART = 0x80
     __SLEEP = 0x10
+    __AI = 0x20                 # register auto-increment
     __ALLCALL = 0x01
     __INVRT = 0x10
     __OUTDRV = 0x04
 
-    general_call_i2c = Raspi_I2C(0x00)
+    general_call_i2c = None  # opened on first reset
+    _instances = weakref.WeakSet()  # so a reset can invalidate every shadow
 
     @classmethod
-    def softwareReset(cls):
-        "Sends a software reset (SWRST) command to all the servo drivers on the bus"
-        cls.general_call_i2c.writeRaw8(0x06)        # SWRST
-
-    def __init__(self, address=0x40, debug=False):
-
-        self.i2c = Raspi_I2C(address, busnum=-1, debug=debug)
+    def softwareReset(cls, general_call_i2c=None):
+        """Sends a software reset (SWRST) command to all the servo drivers
+        on the bus, 'general_call_i2c' talks to address 0x00 (a
+        SimulatedI2C say), by default the Pi's bus is opened for it"""
+        if general_call_i2c is None:
+            if cls.general_call_i2c is None:
+                cls.general_call_i2c = Raspi_I2C(0x00)
+            general_call_i2c = cls.general_call_i2c
+        general_call_i2c.writeRaw8(0x06)        # SWRST
+        for pwm in cls._instances:
+            pwm.invalidate_shadow()
+
+    def __init__(self, address=0x40, debug=False, i2c=None, clock=None):
+
+        # anything with Raspi_I2C's methods will do, like a SimulatedI2C,
+        # the oscillator waits use its bus's clock unless given one
+        self.i2c = i2c if i2c else Raspi_I2C(address, busnum=-1, debug=debug)
+        if clock is None:
+            clock = getattr(self.i2c, 'clock', None)
+        self.clock = clock if clock else SystemClock()
         self.address = address
         self.debug = debug
+        # our copy of the LED registers, None where we don't know the value.
+        # Both steppers write through it, so it's only touched under the lock
+        self._shadow = [None] * self.__LED_REGISTERS
+        self._lock = threading.RLock()
+        self._instances.add(self)
         if self.debug:
             print("Resetting PCA9685 MODE1 (without SLEEP) and MODE2")
         self.setAllPWM(0, 0)
         self.i2c.write8(self.__MODE2, self.__OUTDRV)
-        self.i2c.write8(self.__MODE1, self.__ALLCALL)
-        time.sleep(0.005)                                       # wait for oscillator
+        self.i2c.write8(self.__MODE1, self.__ALLCALL | self.__AI)
+        self.clock.sleep(0.005)                                 # wait for oscillator
 
         mode1 = self.i2c.readU8(self.__MODE1)
         mode1 = mode1 & ~self.__SLEEP                 # wake up (reset sleep)
         self.i2c.write8(self.__MODE1, mode1)
-        time.sleep(0.005)                             # wait for oscillator
+        self.clock.sleep(0.005)                       # wait for oscillator
 
     def setPWMFreq(self, freq):
         """Sets the PWM frequency"""
@@ -79,22 +109,80 @@ class PWM(PWMInterface):
         self.i2c.write8(self.__MODE1, newmode)        # go to sleep
         self.i2c.write8(self.__PRESCALE, int(math.floor(prescale)))
         self.i2c.write8(self.__MODE1, oldmode)
-        time.sleep(0.005)
+        self.clock.sleep(0.005)
         self.i2c.write8(self.__MODE1, oldmode | 0x80)
 
+    def invalidate_shadow(self) -> None:
+        """forget what we think is in the LED registers, the next
+        write of every channel will go out to the device. Use this
+        after a reset or whenever the device state is in doubt"""
+        with self._lock:
+            self._shadow[:] = [None] * self.__LED_REGISTERS
+
     def setPWM(self, channel, on, off):
         """Sets a single PWM channel"""
-        self.i2c.write8(self.__LED0_ON_L+4*channel, on & 0xFF)
-        self.i2c.write8(self.__LED0_ON_H+4*channel, on >> 8)
-        self.i2c.write8(self.__LED0_OFF_L+4*channel, off & 0xFF)
-        self.i2c.write8(self.__LED0_OFF_H+4*channel, off >> 8)
+        self.set_frame({channel: (on, off)})
+
+    def set_frame(self, frame: dict) -> bool:
+        """Sets several PWM channels, 'frame' maps channel -> (on, off).
+        Only registers that differ from our shadow copy are written,
+        runs of them go out as single block writes relying on the
+        MODE1 auto-increment bit set in __init__(). If a block write
+        fails we carry on with the rest of the frame (the next frame
+        rewrites everything) and return False. Safe to call from more
+        than one thread, a frame goes out whole"""
+        with self._lock:
+            return self.__write_frame(frame)
+
+    def __write_frame(self, frame: dict) -> bool:
+        """set_frame(), with the lock held"""
+        shadow = self._shadow
+        changed = {}
+        for channel, (on, off) in frame.items():
+            index = 4*channel
+            for value in (on & 0xFF, on >> 8, off & 0xFF, off >> 8):
+                if shadow[index] != value:
+                    changed[index] = value
+                index += 1
+        if not changed:
+            return True
+
+        # once a write fails the shadow is gone, so the blocks after it
+        # can't span a gap and just hold the changed registers
+        written = True
+        indexes = sorted(changed)
+        start = last = indexes[0]
+        for index in indexes[1:]:
+            gap_known = None not in shadow[last+1:index]
+            if index - last - 1 > self.__MAX_BLOCK_GAP or not gap_known or \
+               index - start >= self.__MAX_BLOCK_BYTES:
+                written = self.__write_block(start, last, changed) and written
+                start = index
+            last = index
+        return self.__write_block(start, last, changed) and written
+
+    def __write_block(self, first: int, last: int, changed: dict) -> bool:
+        """write the LED registers first..last in one transaction, filling
+        in any unchanged registers in between from the shadow"""
+        shadow = self._shadow
+        data = [changed.get(index, shadow[index]) for index in range(first, last+1)]
+        if self.i2c.writeList(self.__LED0_ON_L+first, data) == -1:
+            self.invalidate_shadow()  # no idea what made it to the device
+            return False
+        shadow[first:last+1] = data
+        return True
 
     def setAllPWM(self, on, off):
         """Sets a all PWM channels"""
-        self.i2c.write8(self.__ALL_LED_ON_L, on & 0xFF)
-        self.i2c.write8(self.__ALL_LED_ON_H, on >> 8)
-        self.i2c.write8(self.__ALL_LED_OFF_L, off & 0xFF)
-        self.i2c.write8(self.__ALL_LED_OFF_H, off >> 8)
+        with self._lock:
+            results = [self.i2c.write8(self.__ALL_LED_ON_L, on & 0xFF),
+                       self.i2c.write8(self.__ALL_LED_ON_H, on >> 8),
+                       self.i2c.write8(self.__ALL_LED_OFF_L, off & 0xFF),
+                       self.i2c.write8(self.__ALL_LED_OFF_H, off >> 8)]
+            if -1 in results:
+                self.invalidate_shadow()
+            else:
+                self._shadow[:] = [on & 0xFF, on >> 8, off & 0xFF, off >> 8] * 16
 
     def set_pin(self, pin: int, value: int) -> None:
         """set the pin"""
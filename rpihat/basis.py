@@ -10,7 +10,7 @@ class PWMInterface(abc.ABC):
 
     @classmethod
     @abc.abstractmethod
-    def softwareReset(cls):
+    def softwareReset(cls, general_call_i2c=None):
         pass
 
     @abc.abstractmethod
@@ -33,3 +33,12 @@ class PWMInterface(abc.ABC):
     @abc.abstractmethod
     def set_pin(self, pin: int, value: int) -> None:
         pass
+
+    def set_frame(self, frame: dict) -> bool:
+        """Sets several PWM channels at once, 'frame' maps
+        channel -> (on, off). Drivers that can batch the
+        register writes should override this. False if
+        some of it didn't make it to the device"""
+        for channel, (on, off) in frame.items():
+            self.setPWM(channel, on, off)
+        return True
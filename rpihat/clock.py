@@ -0,0 +1,52 @@
+#!/usr/bin/python
+"""Clocks - where the step scheduler gets the time from. The system
+clock is the real thing, the virtual clock only moves when something
+sleeps (or the simulated I2C bus is busy) so a whole move can be
+stepped through at full speed off the Pi"""
+import time
+
+
+class SystemClock:
+    """the monotonic clock, for stepping real motors"""
+
+    @staticmethod
+    def now_ns() -> int:
+        """the time in nanoseconds"""
+        return time.monotonic_ns()
+
+    @staticmethod
+    def sleep(seconds: float) -> None:
+        """give up the CPU for a while"""
+        time.sleep(seconds)
+
+    @staticmethod
+    def spin_until(deadline_ns: int) -> int:
+        """busy wait until the deadline, returns the time we stopped"""
+        now = time.monotonic_ns()
+        while now < deadline_ns:
+            now = time.monotonic_ns()
+        return now
+
+
+class VirtualClock:
+    """a clock that's only moved by sleeping, or by advance()"""
+
+    def __init__(self, start_ns: int = 0) -> None:
+        self.now = start_ns
+
+    def now_ns(self) -> int:
+        """the time in nanoseconds"""
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """time passes instantly"""
+        self.advance(int(seconds * 10**9))
+
+    def spin_until(self, deadline_ns: int) -> int:
+        """jump to the deadline, unless we're already past it"""
+        self.now = max(self.now, deadline_ns)
+        return self.now
+
+    def advance(self, nanoseconds: int) -> None:
+        """something took this long (an I2C transaction say)"""
+        self.now += nanoseconds
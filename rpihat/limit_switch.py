@@ -1,14 +1,45 @@
+import threading
+import time
 from gpiozero import Button    # a GPIO library
 
 
 class LimitSwitch:
-    """object to wrap our input limit switches"""
+    """object to wrap our input limit switches. A press is latched by
+    the GPIO edge callback, so checking for it (tripped()) is just a
+    flag test rather than a read of the pin"""
     switch = None
     name = None
 
     def __init__(self, pin: int, name: str) -> None:
         self.switch = Button(pin, pull_up=False, bounce_time=None)
         self.name = name
+        self.tripped_at = None  # time.monotonic() of the latest press
+        self.released_at = None  # ...and release
+        self._tripped = threading.Event()
+        self.switch.when_pressed = self._on_pressed
+        self.switch.when_released = self._on_released
+        if self.switch.is_pressed:
+            self._on_pressed()
+
+    def _on_pressed(self) -> None:
+        """edge callback (gpiozero thread), latch the press"""
+        self.tripped_at = time.monotonic()
+        self._tripped.set()
+
+    def _on_released(self) -> None:
+        """edge callback (gpiozero thread)"""
+        self.released_at = time.monotonic()
+
+    def tripped(self) -> bool:
+        """has the switch been pressed since we were last rearmed"""
+        return self._tripped.is_set()
+
+    def rearm(self) -> None:
+        """clear the latch. If the switch is still pressed we stay
+        tripped, there won't be another edge to tell us"""
+        self._tripped.clear()
+        if self.switch.is_pressed:
+            self._on_pressed()
 
     def is_pressed(self) -> bool:
         return self.switch.is_pressed
@@ -17,4 +48,4 @@ class LimitSwitch:
         if self.is_pressed():
             return "{0} is closed".format(self.name)
         else:
-            return "{0} is open".format(self.name)
\ No newline at end of file
+            return "{0} is open".format(self.name)
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+"""Motion Engine - makes moves on a motion thread so the caller can get
+on with something else (downloading the last picture say) while the
+rig moves. Moves run one at a time, in the order they're submitted.
+
+    engine = MotionEngine()
+    handle = engine.submit(stepper.step, 400, Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.DOUBLE)
+    ...
+    forced_exit = handle.wait()
+
+To be able to cancel a move that's under way, the yield function of
+the stepper making it has to call check_abort() (or be wrapped with
+guard()), a move that hasn't started yet can always be cancelled.
+When the steps are made in a motion process 'abort_event' (the
+MotionExecutor's) is set as well, the motion process's yield
+functions check that"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+
+class MoveHandle:
+    """a move that has been submitted, poll it with done(), get the
+    move's exit dict with wait() or stop it with cancel()"""
+
+    def __init__(self, abort_event=None) -> None:
+        self.future = None
+        self.aborted = threading.Event()
+        self._abort_event = abort_event
+
+    def done(self) -> bool:
+        """has the move finished (or been cancelled)"""
+        return self.future.done()
+
+    def wait(self, timeout: float = None) -> dict:
+        """wait for the move to finish, returns its exit dict. A
+        cancelled move that never started returns {'exit': 'abort'}"""
+        try:
+            return self.future.result(timeout)
+        except CancelledError:
+            return {'exit': 'abort'}
+
+    def cancel(self) -> None:
+        """don't start the move, or stop it if it's under way"""
+        if not self.future.cancel():
+            self.aborted.set()
+            if self._abort_event and not self.future.done():
+                self._abort_event.set()
+
+
+class MotionEngine:
+    """runs moves on a single motion thread"""
+
+    def __init__(self, abort_event=None) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='motion')
+        self._current = None  # handle of the move under way
+        self._abort_event = abort_event  # to stop a move in another process
+
+    def submit(self, move, *args) -> MoveHandle:
+        """queue up a move, 'move(*args)' is called on the motion
+        thread and should return an exit dict like step() does"""
+        handle = MoveHandle(self._abort_event)
+        handle.future = self._executor.submit(self._run, handle, move, args)
+        return handle
+
+    def _run(self, handle: MoveHandle, move, args: tuple) -> dict:
+        self._current = handle
+        if self._abort_event:
+            self._abort_event.clear()  # it may be left over from a move that had finished
+        try:
+            if handle.aborted.is_set():
+                return {'exit': 'abort'}
+            return move(*args)
+        finally:
+            self._current = None
+
+    def check_abort(self, direction: int = 0) -> dict:  # pylint: disable=W0613
+        """call from a yield function, returns an exit dict if the
+        move under way has been cancelled"""
+        handle = self._current
+        if handle and handle.aborted.is_set():
+            return {'exit': 'abort'}
+        return {}
+
+    def guard(self, yield_function=None):
+        """a yield function that checks for cancelled moves, then
+        calls 'yield_function'"""
+        def guarded(direction: int) -> dict:
+            exit_dict = self.check_abort(direction)
+            if not exit_dict and yield_function:
+                exit_dict = yield_function(direction)
+            return exit_dict
+        return guarded
+
+    def busy(self) -> bool:
+        """is a move under way"""
+        return self._current is not None
+
+    def shutdown(self, wait: bool = True) -> None:
+        """stop the motion thread, after the queued moves if 'wait'"""
+        self._executor.shutdown(wait=wait)
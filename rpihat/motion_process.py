@@ -0,0 +1,263 @@
+#!/usr/bin/python
+"""Motion Process - runs the motor HAT in a process of its own, away
+from the beanstalk polling, status posting and camera work of the rig
+runner. The motion process can pin itself to a core, run with the
+SCHED_FIFO real-time policy and hold off the garbage collector while a
+move is under way, all of which keep the step timing tight.
+
+    executor = MotionExecutor(hat_factory, setup=setup, cpu=3)
+    executor.start()
+    hat = RemoteMotorHAT(executor)
+    hat.camera_stepper.step(400, Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.DOUBLE)
+
+Anything the stepping loop checks (limit switches, a cancel listener)
+has to live in the motion process, 'setup' is called there to create
+them and returns the yield function the HAT is built with. A move under
+way is stopped by setting 'abort', MotionEngine(abort_event=executor.abort)
+does that when a move is cancelled. Moves are
+sent over a pipe and block until they're done, the result comes back
+with the steppers' counters and the move's step timing stats"""
+import gc
+import os
+import threading
+import multiprocessing
+from rpihat.scheduler import StepTimingStats
+
+# pylint:disable=C0103
+
+MOTORS = ('camera', 'rotation')
+
+
+class MotionExecutor(multiprocessing.Process):
+    """the motion process. 'hat_factory(yield_func, rotation_yield_func)'
+    makes the Raspi_MotorHAT, 'setup()' returns the yield function,
+    'rotation_yield(direction)' is the turntable's and 'before_move()' is
+    called before every move (to rearm the limit switches say). These
+    are called in the motion process"""
+    FIFO_PRIORITY = 50  # middle of the real-time priorities
+
+    def __init__(self, hat_factory, setup=None, before_move=None,  # pylint: disable-msg=too-many-arguments
+                 cpu: int = None, realtime: bool = True, rotation_yield=None) -> None:
+        super().__init__(name='motion', daemon=True)
+        self.hat_factory = hat_factory
+        self.setup = setup
+        self.before_move = before_move
+        self.rotation_yield = rotation_yield
+        self.abort = multiprocessing.Event()  # set to stop the move under way
+        self.cpu = cpu
+        self.realtime = realtime
+        self._conn, self._child_conn = multiprocessing.Pipe()
+        self._lock = threading.Lock()  # one command at a time
+        self.state = {}  # the steppers as of the last reply
+
+    # --- the caller's side ---
+
+    def request(self, command: str, *args) -> dict:
+        """run a command in the motion process, wait for the reply"""
+        with self._lock:
+            self._conn.send((command, args))
+            reply = self._conn.recv()
+            self.state = reply['state']
+        if 'error' in reply:
+            raise RuntimeError('motion process: {0}'.format(reply['error']))
+        return reply
+
+    def call(self, command: str, *args):
+        """run a command, returns its result"""
+        return self.request(command, *args)['result']
+
+    def call_move(self, command: str, *args) -> tuple:
+        """make a move, returns (result, step timing stats)"""
+        reply = self.request(command, *args)
+        return reply['result'], reply['stats']
+
+    def shutdown(self) -> None:
+        """release the motors and stop the motion process"""
+        self.call('stop')
+        self.join()
+
+    # --- the motion process ---
+
+    def configure(self) -> None:
+        """pin ourselves to a core and ask for real-time scheduling,
+        carry on (with a warning) if we're not allowed"""
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, {self.cpu})
+            except (AttributeError, OSError) as err:
+                print('motion process not pinned to cpu {0}: {1}'.format(self.cpu, err))
+        if self.realtime:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.FIFO_PRIORITY))
+            except (AttributeError, OSError) as err:
+                print('motion process not real-time: {0}'.format(err))
+
+    def guard(self, yield_function=None):
+        """a yield function that checks 'abort', then calls 'yield_function'"""
+        def guarded(direction: int) -> dict:
+            if self.abort.is_set():
+                return {'exit': 'abort'}
+            return yield_function(direction) if yield_function else {}
+        return guarded
+
+    def run(self) -> None:
+        yield_func = self.setup() if self.setup else None
+        hat = self.hat_factory(self.guard(yield_func), self.guard(self.rotation_yield))
+        # threads setup() started keep the normal scheduling policy,
+        # only the stepping thread is pinned & real-time
+        self.configure()
+
+        # everything made so far lives as long as we do, keep it out of
+        # the collector's way
+        gc.collect()
+        gc.freeze()
+
+        try:
+            while True:
+                command, args = self._child_conn.recv()
+                if command == 'stop':
+                    hat.release_motors()
+                    self._child_conn.send({'result': None, 'state': self.hat_state(hat)})
+                    return
+                try:
+                    result, stats = self.execute(hat, command, args)
+                    reply = {'result': result, 'stats': stats}
+                except Exception as err:  # pylint: disable=W0703
+                    reply = {'error': repr(err)}
+                reply['state'] = self.hat_state(hat)
+                self._child_conn.send(reply)
+        except (KeyboardInterrupt, EOFError):  # ^C, or the rig runner has gone
+            hat.release_motors()
+
+    def execute(self, hat, command: str, args: tuple) -> tuple:
+        """run a command, returns (result, step timing stats)"""
+        if command == 'step':
+            motor, steps, direction, style, profile = args
+            stepper = self.stepper(hat, motor)
+            result = self.run_move(stepper.step, steps, direction, style, profile)
+            return result, stepper.timing_stats
+        if command == 'move_both':
+            result = self.run_move(hat.move_both, *args)
+            return result, hat.scheduler.stats
+        if command == 'set':
+            motor, name, value = args
+            setattr(self.stepper(hat, motor), name, value)
+        elif command == 'setSpeed':
+            motor, rpm = args
+            self.stepper(hat, motor).setSpeed(rpm)
+        elif command == 'hold':
+            self.stepper(hat, args[0]).hold()
+        elif command == 'release_motors':
+            hat.release_motors()
+        elif command != 'state':
+            raise NameError('unknown motion command {0}'.format(command))
+        return None, None
+
+    def run_move(self, move_function, *args) -> dict:
+        """make a move with the garbage collector off"""
+        if self.before_move:
+            self.before_move()
+        gc.disable()
+        try:
+            return move_function(*args)
+        finally:
+            gc.enable()
+
+    @staticmethod
+    def stepper(hat, motor: str):
+        """a stepper by name"""
+        if motor not in MOTORS:
+            raise NameError('motor must be one of {0}'.format(MOTORS))
+        return hat.camera_stepper if motor == 'camera' else hat.rotation_stepper
+
+    @staticmethod
+    def hat_state(hat) -> dict:
+        """what the proxies need to know about the HAT"""
+        state = {'active': hat.is_active}
+        for motor in MOTORS:
+            stepper = MotionExecutor.stepper(hat, motor)
+            state[motor] = {'stepping_counter': stepper.stepping_counter,
+                            'sec_per_step': stepper.sec_per_step,
+                            'current_step': stepper.current_step,
+                            'revsteps': stepper.revsteps,
+                            'MICROSTEPS': stepper.MICROSTEPS}
+        return state
+
+
+class RemoteStepper:
+    """looks enough like a RaspiStepperMotor for the rig runner, the
+    steps are made in the motion process"""
+
+    def __init__(self, executor: MotionExecutor, motor: str) -> None:
+        self._executor = executor
+        self._motor = motor
+        self.timing_stats = StepTimingStats()
+
+    def _state(self, name: str):
+        return self._executor.state[self._motor][name]
+
+    @property
+    def stepping_counter(self) -> int:
+        return self._state('stepping_counter')
+
+    @stepping_counter.setter
+    def stepping_counter(self, value: int) -> None:
+        self._executor.call('set', self._motor, 'stepping_counter', value)
+
+    @property
+    def sec_per_step(self) -> float:
+        return self._state('sec_per_step')
+
+    @sec_per_step.setter
+    def sec_per_step(self, value: float) -> None:
+        self._executor.call('set', self._motor, 'sec_per_step', value)
+
+    @property
+    def current_step(self) -> int:
+        return self._state('current_step')
+
+    @property
+    def revsteps(self) -> int:
+        return self._state('revsteps')
+
+    @property
+    def MICROSTEPS(self) -> int:
+        return self._state('MICROSTEPS')
+
+    def setSpeed(self, rpm: int) -> None:
+        """set speed of stepper"""
+        self._executor.call('setSpeed', self._motor, rpm)
+
+    def hold(self) -> None:
+        """use single step to hold current position"""
+        self._executor.call('hold', self._motor)
+
+    def step(self, steps: int, direction: int, step_style: int, profile=None) -> dict:
+        """step the motor, returns a dict if interrupted"""
+        result, self.timing_stats = self._executor.call_move('step', self._motor, steps,
+                                                            direction, step_style, profile)
+        return result
+
+
+class RemoteMotorHAT:
+    """looks enough like a Raspi_MotorHAT for the rig runner"""
+
+    def __init__(self, executor: MotionExecutor) -> None:
+        self._executor = executor
+        self.camera_stepper = RemoteStepper(executor, 'camera')
+        self.rotation_stepper = RemoteStepper(executor, 'rotation')
+        self.timing_stats = StepTimingStats()
+        executor.call('state')
+
+    @property
+    def is_active(self) -> bool:
+        return self._executor.state['active']
+
+    def move_both(self, *args) -> dict:  # pylint: disable-msg=too-many-arguments
+        """move both steppers at the same time, see Raspi_MotorHAT.move_both()"""
+        result, self.timing_stats = self._executor.call_move('move_both', *args)
+        return result
+
+    def release_motors(self) -> None:
+        """release all motors"""
+        self._executor.call('release_motors')
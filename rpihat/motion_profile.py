@@ -0,0 +1,105 @@
+#!/usr/bin/python
+"""Motion profiles - rather than stepping at one constant speed (which
+has to be one the motor can reach from a standstill) we ramp up to a
+cruise speed and back down again. A profile turns a move into the time
+between each of its steps."""
+import abc
+import math
+
+
+class MotionProfile(abc.ABC):
+    """ramp from the start speed up to cruise_rpm and back down.
+    Acceleration/deceleration are in rpm per second"""
+
+    def __init__(self, cruise_rpm: float, accel: float, decel: float = None) -> None:
+        if cruise_rpm <= 0 or accel <= 0 or (decel is not None and decel <= 0):
+            raise ValueError('cruise speed & acceleration must be positive')
+        self.cruise_rpm = cruise_rpm
+        self.accel = accel
+        self.decel = accel if decel is None else decel
+
+    @abc.abstractmethod
+    def ramp(self, start_rate: float, cruise_rate: float,
+             accel: float, rate_scale: float, steps: int) -> list:
+        """the speed (steps/second) at each of the first 'steps' steps
+        when accelerating at 'accel' rpm/second from start_rate, capped
+        at cruise_rate. 'rate_scale' is steps/second per rpm"""
+
+    def step_intervals(self, steps: int, steps_per_rev: int, start_rate: float) -> list:
+        """seconds to wait after each of 'steps' steps. 'start_rate' is the
+        speed (steps/second) the motor can start & stop at, 'steps_per_rev'
+        converts our rpm figures to steps"""
+        cruise_rate = self.cruise_rpm * steps_per_rev / 60.0
+        if cruise_rate <= start_rate:
+            return [1.0 / start_rate] * steps
+
+        rate_scale = steps_per_rev / 60.0
+        speed_up = self.ramp(start_rate, cruise_rate, self.accel, rate_scale, steps)
+        if self.decel == self.accel:
+            slow_down = speed_up
+        else:
+            slow_down = self.ramp(start_rate, cruise_rate, self.decel, rate_scale, steps)
+
+        # a short move never reaches cruise, it speeds up until it
+        # meets the slow down ramp
+        last = steps - 1
+        return [1.0 / min(speed_up[step], slow_down[last - step])
+                for step in range(steps)]
+
+
+class TrapezoidalProfile(MotionProfile):
+    """constant acceleration to the cruise speed, cruise, then
+    constant deceleration"""
+
+    def ramp(self, start_rate: float, cruise_rate: float,
+             accel: float, rate_scale: float, steps: int) -> list:
+        # v^2 = u^2 + 2as, with s in steps
+        accel_rate = accel * rate_scale
+        start_squared = start_rate * start_rate
+        return [min(cruise_rate, math.sqrt(start_squared + 2.0 * accel_rate * step))
+                for step in range(steps)]
+
+
+class SCurveProfile(MotionProfile):
+    """jerk limited (S-curve) acceleration, the acceleration itself ramps
+    up and down at 'jerk' rpm/second^2 so the motor isn't kicked at the
+    start & end of each ramp. Short moves that never reach cruise switch
+    straight from speeding up to slowing down."""
+
+    TIME_STEP = 0.0001  # seconds, resolution we integrate the ramp at
+
+    def __init__(self, cruise_rpm: float, accel: float,
+                 jerk: float, decel: float = None) -> None:
+        super().__init__(cruise_rpm, accel, decel)
+        if jerk <= 0:
+            raise ValueError('jerk must be positive')
+        self.jerk = jerk
+
+    def ramp(self, start_rate: float, cruise_rate: float,
+             accel: float, rate_scale: float, steps: int) -> list:
+        accel_rate = accel * rate_scale
+        jerk_rate = self.jerk * rate_scale
+        min_accel = accel_rate * 0.01  # so we never stall just short of cruise
+        time_step = self.TIME_STEP
+
+        rates = []
+        current_accel = 0.0
+        rate = start_rate
+        position = 0.0
+        while len(rates) < steps:
+            while position >= len(rates) and len(rates) < steps:
+                rates.append(rate)
+            if rate >= cruise_rate:
+                break
+
+            # start easing off the acceleration in time to arrive
+            # at cruise with no acceleration left
+            if cruise_rate - rate <= current_accel * current_accel / (2.0 * jerk_rate):
+                current_accel = max(current_accel - jerk_rate * time_step, min_accel)
+            else:
+                current_accel = min(current_accel + jerk_rate * time_step, accel_rate)
+            rate = min(rate + current_accel * time_step, cruise_rate)
+            position += rate * time_step
+
+        rates += [cruise_rate] * (steps - len(rates))
+        return rates
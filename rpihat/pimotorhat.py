@@ -1,24 +1,37 @@
 #!/usr/bin/python
 """ Raspberry Pi Motor HAT"""
-import sys
-import time
-import traceback
+import math
+import itertools
 from rpihat.basis import PWMInterface
+from rpihat.motion_profile import MotionProfile
+from rpihat.scheduler import StepScheduler, StepTimingStats
 
 #pylint:disable=C0103
 
 
 class RaspiStepperMotor:
     """control stepper motor stepping"""
-    MICROSTEPS = 8
-    MICROSTEP_CURVE = [0, 50, 98, 142, 180, 212, 236, 250, 255]
-    # MICROSTEPS = 16
-    # a sinusoidal curve NOT LINEAR!
-    # MICROSTEP_CURVE = [0, 25, 50, 74, 98, 120, 141, 162, 180,\
-    #                    197, 212, 225, 236, 244, 250, 253, 255]
+    MICROSTEPS = 8  # the default, each motor can have its own
+    MICROSTEP_RESOLUTIONS = (8, 16, 32, 64)
+
+    # coils (AIN2, BIN1, AIN1, BIN2) for each half step...
+    STEP_COILS = [(1, 0, 0, 0),
+                  (1, 1, 0, 0),
+                  (0, 1, 0, 0),
+                  (0, 1, 1, 0),
+                  (0, 0, 1, 0),
+                  (0, 0, 1, 1),
+                  (0, 0, 0, 1),
+                  (1, 0, 0, 1)]
+    # ...and for each quadrant when microstepping
+    MICROSTEP_COILS = [(1, 1, 0, 0),
+                       (0, 1, 1, 0),
+                       (0, 0, 1, 1),
+                       (1, 0, 0, 1)]
 
     _yield_func = None
     _pwm = None
+    _motor_active = False
 
     @property
     def yield_func(self):
@@ -41,7 +54,8 @@ class RaspiStepperMotor:
 
     def __init__(self, pwm: PWMInterface,
                  num: int, steps=200,
-                 yield_function=None) -> None:
+                 yield_function=None, clock=None,
+                 microsteps: int = MICROSTEPS) -> None:
 
         self.yield_function = yield_function
         self.pwm = pwm
@@ -50,6 +64,12 @@ class RaspiStepperMotor:
         self.sec_per_step = 0.1
         self.stepping_counter = 0
         self.current_step = 0
+        self.scheduler = StepScheduler(clock)
+
+        if microsteps not in self.MICROSTEP_RESOLUTIONS:
+            raise NameError('MotorHAT Stepper microsteps must be 8, 16, 32 or 64')
+        self.MICROSTEPS = microsteps
+        self.MICROSTEP_CURVE = self.microstep_curve(microsteps)
 
         if num == 1:
             self.PWMA = 8
@@ -68,6 +88,9 @@ class RaspiStepperMotor:
         else:
             raise NameError('MotorHAT Stepper must be either 1 or 2')
 
+        # all the phase arithmetic is done up front, off the step loop
+        self._phase_tables = self.build_phase_tables()
+
     def is_yielding(self, direction: int) -> dict:
         """if we have yield function check to see if
         an exit condition has arisen"""
@@ -76,172 +99,147 @@ class RaspiStepperMotor:
         return self.yield_function(direction)
 
     def my_timer(self, sleep_time: float, direction: int) -> dict:
-        """implement a sleep() timer but in a loop
-        if the yield function exists and returns a dict,
-        then we break out of the loop"""
-        current_time_microseconds = time.time() * 10**6
-        end_time_microseconds = current_time_microseconds + int(sleep_time * 10**6)
-
-        # this is where we "wait" until it's time to process the
-        # next step pulse. We will call the yield_function() to
-        # see if anyone wants to interrupt us
-        while current_time_microseconds < end_time_microseconds:
-
-            # if we have a "yield function" we call this to process
-            # external events we want to exit for
-            if self.yield_function:
-                exit_dict = self.yield_function(direction)
-                if exit_dict:
-                    return exit_dict
+        """wait until it's time for the next step, 'sleep_time' after
+        the last step's deadline (not after whenever we got here).
+        While we wait, if the yield function exists and returns a
+        dict, then we break out and return it"""
+        return self.scheduler.wait(sleep_time, self.yield_function, direction)
 
-            time.sleep(sleep_time / 10)  # yield some time to other processes
-            current_time_microseconds = time.time() * 10**6
-        return {}
+    @property
+    def timing_stats(self) -> StepTimingStats:
+        """how late the steps of the last move were"""
+        return self.scheduler.stats
 
     def setSpeed(self, rpm: int) -> None:
         """set speed of stepper"""
         self.sec_per_step = 60.0 / (self.revsteps * rpm)
         self.stepping_counter = 0
 
-    def step_coils(self, style: int, pwm_a: int, pwm_b: int) -> int:
-        """now that we figured out the next step, let's
-        energize the coils to make the step occur"""
-
-        # only really used for microstepping, otherwise always on!
-        self.pwm.setPWM(self.PWMA, 0, pwm_a * 16)
-        self.pwm.setPWM(self.PWMB, 0, pwm_b * 16)
-
-        # set up coil energizing!
-        coils = [0, 0, 0, 0]
-
-        if style == Raspi_MotorHAT.MICROSTEP:
-            if (self.current_step >= 0) and \
-               (self.current_step < self.MICROSTEPS):
-                coils = [1, 1, 0, 0]
-            elif (self.current_step >= self.MICROSTEPS) and \
-                 (self.current_step < self.MICROSTEPS * 2):
-                coils = [0, 1, 1, 0]
-            elif (self.current_step >= self.MICROSTEPS * 2) and \
-                 (self.current_step < self.MICROSTEPS * 3):
-                coils = [0, 0, 1, 1]
-            elif (self.current_step >= self.MICROSTEPS * 3) and \
-                 (self.current_step < self.MICROSTEPS * 4):
-                coils = [1, 0, 0, 1]
-        else:
-            step2coils = [[1, 0, 0, 0],
-                          [1, 1, 0, 0],
-                          [0, 1, 0, 0],
-                          [0, 1, 1, 0],
-                          [0, 0, 1, 0],
-                          [0, 0, 1, 1],
-                          [0, 0, 0, 1],
-                          [1, 0, 0, 1]]
-
-            coils = step2coils[int(self.current_step / (self.MICROSTEPS / 2))]
-
-        # now energize the coils to perform the step
-        self.pwm.set_pin(self.AIN2, coils[0])
-        self.pwm.set_pin(self.BIN1, coils[1])
-        self.pwm.set_pin(self.AIN1, coils[2])
-        self.pwm.set_pin(self.BIN2, coils[3])
-
-        return self.current_step
-
-    def compute_step(self, step_dir: int, style: int):  #pylint: disable-msg=too-many-branches
-        """compute the our next step."""
-        # first determine what sort of stepping procedure we're up to
+    @staticmethod
+    def microstep_curve(microsteps: int) -> list:
+        """the PWM duty (0-255) for each microstep of a quarter
+        sine wave, a sinusoidal curve NOT LINEAR!"""
+        return [int(round(255 * math.sin(math.pi / 2 * i / microsteps)))
+                for i in range(microsteps + 1)]
+
+    def next_phase(self, phase: int, step_dir: int, style: int) -> int:
+        """compute the phase we move to from 'phase'. The phase is
+        our position (in microsteps) within the 4 full step coil cycle"""
+        half_step = self.MICROSTEPS // 2
+        stride = 0
         if style == Raspi_MotorHAT.SINGLE:
-            if (self.current_step / (self.MICROSTEPS / 2)) % 2:
-                # we're at an odd step, weird
-                if step_dir == Raspi_MotorHAT.FORWARD:
-                    self.current_step += self.MICROSTEPS / 2
-                else:
-                    self.current_step -= self.MICROSTEPS / 2
-            else:
-                # go to next even step
-                if step_dir == Raspi_MotorHAT.FORWARD:
-                    self.current_step += self.MICROSTEPS
-                else:
-                    self.current_step -= self.MICROSTEPS
-
-        if style == Raspi_MotorHAT.DOUBLE:
-            if not self.current_step / (self.MICROSTEPS / 2) % 2:
-                # we're at an even step, weird
-                if step_dir == Raspi_MotorHAT.FORWARD:
-                    self.current_step += self.MICROSTEPS / 2
-                else:
-                    self.current_step -= self.MICROSTEPS / 2
-            else:
-                # go to next odd step
-                if step_dir == Raspi_MotorHAT.FORWARD:
-                    self.current_step += self.MICROSTEPS
-                else:
-                    self.current_step -= self.MICROSTEPS
-
-        if style == Raspi_MotorHAT.INTERLEAVE:
-            if step_dir == Raspi_MotorHAT.FORWARD:
-                self.current_step += self.MICROSTEPS / 2
-            else:
-                self.current_step -= self.MICROSTEPS / 2
-
-        if style == Raspi_MotorHAT.MICROSTEP:
-            if step_dir == Raspi_MotorHAT.FORWARD:
-                self.current_step += 1
-            else:
-                self.current_step -= 1
+            # on an odd step we only go half way to get back to even steps
+            stride = half_step if phase % self.MICROSTEPS else self.MICROSTEPS
+        elif style == Raspi_MotorHAT.DOUBLE:
+            # on an even step we only go half way to get back to odd steps
+            stride = self.MICROSTEPS if phase % self.MICROSTEPS else half_step
+        elif style == Raspi_MotorHAT.INTERLEAVE:
+            stride = half_step
+        elif style == Raspi_MotorHAT.MICROSTEP:
+            stride = 1
+
+        if step_dir != Raspi_MotorHAT.FORWARD:
+            stride = -stride
 
         # go to next 'step' and wrap around
-        self.current_step += self.MICROSTEPS * 4
-        self.current_step %= self.MICROSTEPS * 4
+        return (phase + stride) % (self.MICROSTEPS * 4)
+
+    def phase_duty(self, phase: int) -> tuple:
+        """the (pwm_a, pwm_b) duty values for a phase, these follow
+        the microstep curve (a quarter sine wave) in each quadrant"""
+        quadrant, offset = divmod(phase, self.MICROSTEPS)
+        if quadrant % 2:
+            return (self.MICROSTEP_CURVE[offset],
+                    self.MICROSTEP_CURVE[self.MICROSTEPS - offset])
+        return (self.MICROSTEP_CURVE[self.MICROSTEPS - offset],
+                self.MICROSTEP_CURVE[offset])
+
+    def phase_coils(self, phase: int, style: int) -> tuple:
+        """the coil states (AIN2, BIN1, AIN1, BIN2) to energize for a phase"""
+        if style == Raspi_MotorHAT.MICROSTEP:
+            return self.MICROSTEP_COILS[phase // self.MICROSTEPS]
+        return self.STEP_COILS[phase // (self.MICROSTEPS // 2)]
+
+    def coil_frame(self, pwm_a: int, pwm_b: int, coils: tuple) -> dict:
+        """the PWM frame (channel -> (on, off)) that energizes
+        the coils for a step"""
+        frame = {self.PWMA: (0, pwm_a * 16),
+                 self.PWMB: (0, pwm_b * 16)}
+        for pin, value in zip((self.AIN2, self.BIN1, self.AIN1, self.BIN2), coils):
+            frame[pin] = (4096, 0) if value else (0, 4096)
+        return frame
+
+    def build_phase_tables(self) -> dict:
+        """precompute everything one_step() needs so stepping is a
+        single lookup. The tables are indexed as:
+
+            [style][direction][current phase] -> (next phase, frame)
+
+        where the frame holds the PWM duty values & coil states
+        of the next phase, ready to be written out in one go"""
+        tables = {}
+        for style in (Raspi_MotorHAT.SINGLE, Raspi_MotorHAT.DOUBLE,
+                      Raspi_MotorHAT.INTERLEAVE, Raspi_MotorHAT.MICROSTEP):
+            tables[style] = {}
+            for step_dir in (Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.BACKWARD):
+                phases = []
+                for phase in range(self.MICROSTEPS * 4):
+                    next_phase = self.next_phase(phase, step_dir, style)
+                    pwm_a, pwm_b = self.phase_duty(next_phase)
+                    coils = self.phase_coils(next_phase, style)
+                    phases.append((next_phase, self.coil_frame(pwm_a, pwm_b, coils)))
+                tables[style][step_dir] = phases
+        return tables
+
+    def next_frame(self, step_dir: int, style: int) -> dict:
+        """advance to the next phase and return the frame
+        that has to be written out to get there"""
+        if step_dir != Raspi_MotorHAT.FORWARD:
+            step_dir = Raspi_MotorHAT.BACKWARD
+        self.current_step, frame = \
+            self._phase_tables[style][step_dir][self.current_step]
+        return frame
 
     def one_step(self, step_dir: int, style: int) -> int:
-        """issue step"""
-        self.compute_step(step_dir, style)
-
-        pwm_a = pwm_b = 0
-        try:
-            if (self.current_step >= 0) and (self.current_step < self.MICROSTEPS):
-                pwm_a = self.MICROSTEP_CURVE[int(self.MICROSTEPS - self.current_step)]
-                pwm_b = self.MICROSTEP_CURVE[int(self.current_step)]
-            elif (self.current_step >= self.MICROSTEPS) and \
-                 (self.current_step < self.MICROSTEPS * 2):
-                pwm_a = self.MICROSTEP_CURVE[int(self.current_step - self.MICROSTEPS)]
-                pwm_b = self.MICROSTEP_CURVE[int(self.MICROSTEPS * 2 - self.current_step)]
-            elif (self.current_step >= self.MICROSTEPS * 2) and \
-                 (self.current_step < self.MICROSTEPS * 3):
-                pwm_a = self.MICROSTEP_CURVE[int(self.MICROSTEPS * 3 - self.current_step)]
-                pwm_b = self.MICROSTEP_CURVE[int(self.current_step - self.MICROSTEPS * 2)]
-            elif (self.current_step >= self.MICROSTEPS * 3) and \
-                 (self.current_step < self.MICROSTEPS * 4):
-                pwm_a = self.MICROSTEP_CURVE[int(self.current_step - self.MICROSTEPS * 3)]
-                pwm_b = self.MICROSTEP_CURVE[int(self.MICROSTEPS * 4 - self.current_step)]
-        except TypeError:
-            print("Error indexing! self.currentstep ={0}, self.MICROSTEPS={1}".
-                  format(self.current_step, self.MICROSTEPS))
-            _, _, tb = sys.exc_info()
-            print(traceback.format_list(traceback.extract_tb(tb)[-1:])[-1])
-
-        # go to next 'step' and wrap around
-        self.current_step += self.MICROSTEPS * 4
-        self.current_step %= self.MICROSTEPS * 4
-
-        return self.step_coils(style, pwm_a, pwm_b)
+        """issue step, all the coils are updated with a single frame"""
+        self.pwm.set_frame(self.next_frame(step_dir, style))
+        return self.current_step
 
     def hold(self) -> None:
         """use single step to hold current position"""
         self.one_step(step_dir=Raspi_MotorHAT.FORWARD, style=Raspi_MotorHAT.SINGLE)
 
-    def step(self, steps: int, direction: int, step_style: int) -> dict:
-        """step the motor, returns a dict if interrupted"""
-        s_per_s = self.sec_per_step
+    def style_timing(self, step_style: int) -> tuple:
+        """(seconds per step, steps per full step) at our setSpeed()
+        speed for a step style"""
+        if step_style == Raspi_MotorHAT.INTERLEAVE:
+            return self.sec_per_step / 2.0, 2
+        if step_style == Raspi_MotorHAT.MICROSTEP:
+            return self.sec_per_step / self.MICROSTEPS, self.MICROSTEPS
+        return self.sec_per_step, 1
+
+    def move_intervals(self, steps: int, step_style: int,
+                       profile: MotionProfile = None):
+        """the time to wait after each of the 'steps' steps (of
+        step_style, so microsteps when microstepping) of a move"""
+        s_per_s, substeps = self.style_timing(step_style)
+        if profile:
+            return profile.step_intervals(steps, self.revsteps * substeps,
+                                          1.0 / s_per_s if s_per_s else math.inf)
+        return itertools.repeat(s_per_s, steps)
+
+    def step(self, steps: int, direction: int, step_style: int,
+             profile: MotionProfile = None) -> dict:
+        """step the motor, returns a dict if interrupted. Without a
+        motion profile every step runs at the setSpeed() speed, with one
+        we ramp from that speed up to the profile's cruise speed"""
+        s_per_s, _ = self.style_timing(step_style)
         latest_step = 0
         self._motor_active = True
 
-        if step_style == Raspi_MotorHAT.INTERLEAVE:
-            s_per_s = s_per_s / 2.0
         if step_style == Raspi_MotorHAT.MICROSTEP:
-            s_per_s /= self.MICROSTEPS
             steps *= self.MICROSTEPS
+        intervals = self.move_intervals(steps, step_style, profile)
 
         try:
             # before we start stepping, for safety check the yield function
@@ -251,8 +249,9 @@ class RaspiStepperMotor:
             if yield_dict:
                 return yield_dict
 
-            # okay let's step the motor
-            for _ in range(steps):
+            # okay let's step the motor, deadlines are timed from here
+            self.scheduler.start()
+            for sleep_time in intervals:
                 latest_step = self.one_step(direction, step_style)
                 if direction == Raspi_MotorHAT.FORWARD:
                     self.stepping_counter += 1
@@ -260,7 +259,7 @@ class RaspiStepperMotor:
                     self.stepping_counter -= 1
 
                 # yield the CPU and check for exit conditions
-                exit_dict = self.my_timer(s_per_s, direction)
+                exit_dict = self.my_timer(sleep_time, direction)
                 if exit_dict:
                     return exit_dict
         except KeyboardInterrupt: # if someone types control-c we should exit
@@ -295,7 +294,9 @@ class Raspi_MotorHAT:
 
     @property
     def is_active(self) -> bool:
-        return self._motor_active
+        """have we stepped since the motors were released"""
+        return self._motor_active or \
+            self.camera_stepper._motor_active or self.rotation_stepper._motor_active
 
     @property
     def pwm(self) -> PWMInterface:
@@ -306,19 +307,30 @@ class Raspi_MotorHAT:
     def pwm(self, value):
         self._pwm = value
 
-    def __init__(self, pwm_obj: PWMInterface,
-                 yield_func, freq, debug=False):
+    def __init__(self, pwm_obj: PWMInterface,  # pylint: disable-msg=too-many-arguments
+                 yield_func, freq, debug=False, clock=None,
+                 camera_microsteps: int = RaspiStepperMotor.MICROSTEPS,
+                 rotation_yield_func=None,
+                 rotation_microsteps: int = RaspiStepperMotor.MICROSTEPS):
         self._i2caddr = pwm_obj.address
         self._frequency = freq		# default @1600Hz PWM freq
 
         # Storing the stepper objects in an array:
         #  1 -> Rotation Stepper
         #  2 -> Declination(camera) stepper
-        self.rotation_stepper = RaspiStepperMotor(pwm_obj, 1, steps=200, yield_function=None)
-        self.camera_stepper = RaspiStepperMotor(pwm_obj, 2, steps=200, yield_function=yield_func)
+        # the turntable has no end stops, its yield function only needs
+        # to check for a cancel or an abort
+        self.rotation_stepper = RaspiStepperMotor(pwm_obj, 1, steps=200,
+                                                  yield_function=rotation_yield_func,
+                                                  clock=clock,
+                                                  microsteps=rotation_microsteps)
+        self.camera_stepper = RaspiStepperMotor(pwm_obj, 2, steps=200,
+                                                yield_function=yield_func, clock=clock,
+                                                microsteps=camera_microsteps)
         self.pwm = pwm_obj
         self.pwm.debug = debug
         self.pwm.setPWMFreq(self._frequency)
+        self.scheduler = StepScheduler(clock)  # times moves of both steppers
 
     @property
     def camera_stepper(self) -> RaspiStepperMotor:
@@ -336,6 +348,92 @@ class Raspi_MotorHAT:
     def rotation_stepper(self, value: RaspiStepperMotor) -> None:
         self._rotate = value
 
+    def move_both(self,  # pylint: disable-msg=too-many-arguments,too-many-locals
+                  rotation_steps: int, rotation_dir: int,
+                  camera_steps: int, camera_dir: int,
+                  step_style: int = DOUBLE,
+                  profile: MotionProfile = None) -> dict:
+        """move both steppers at the same time, returns a dict if
+        interrupted. The stepper with more steps to make sets the pace
+        (its speed & the profile), the other's steps are spread evenly
+        through the move (Bresenham style). Both steppers' coils are
+        updated in the same I2C frame.
+
+        The camera stepper's yield function is checked while the camera
+        has steps left to make, the rotation stepper's after that. When
+        microstepping both end on a full step, like step() does"""
+        camera = self.camera_stepper
+        rotation = self.rotation_stepper
+        if step_style == self.MICROSTEP:
+            # the steppers may not microstep alike, compare the steps they'll make
+            rotation_steps *= rotation.MICROSTEPS
+            camera_steps *= camera.MICROSTEPS
+        if rotation_steps >= camera_steps:
+            major, major_dir, major_steps = rotation, rotation_dir, rotation_steps
+            minor, minor_dir, minor_steps = camera, camera_dir, camera_steps
+        else:
+            major, major_dir, major_steps = camera, camera_dir, camera_steps
+            minor, minor_dir, minor_steps = rotation, rotation_dir, rotation_steps
+        if major_steps == 0:
+            return {}
+        major_count = 1 if major_dir == self.FORWARD else -1
+        minor_count = 1 if minor_dir == self.FORWARD else -1
+
+        camera_steps_left = camera_steps
+        yield_dict = camera.is_yielding(camera_dir) if camera_steps_left else {}
+        if yield_dict:
+            return yield_dict
+
+        self._motor_active = True
+        error = major_steps // 2
+        scheduler = self.scheduler
+        scheduler.start()
+        try:
+            for sleep_time in major.move_intervals(major_steps, step_style, profile):
+                frame = major.next_frame(major_dir, step_style)
+                major.stepping_counter += major_count
+                if major is camera:
+                    camera_steps_left -= 1
+
+                error -= minor_steps
+                if error < 0:
+                    error += major_steps
+                    frame = {**frame, **minor.next_frame(minor_dir, step_style)}
+                    minor.stepping_counter += minor_count
+                    if minor is camera:
+                        camera_steps_left -= 1
+                self.pwm.set_frame(frame)
+
+                if camera_steps_left:
+                    exit_dict = scheduler.wait(sleep_time, camera.yield_function, camera_dir)
+                else:
+                    exit_dict = scheduler.wait(sleep_time, rotation.yield_function, rotation_dir)
+                if exit_dict:
+                    return exit_dict
+
+            if step_style == self.MICROSTEP:
+                # this is an edge case, if either is in between full steps
+                # keep it going so it ends on a full step
+                s_per_s, _ = major.style_timing(step_style)
+                moved = [(major, major_dir)] + ([(minor, minor_dir)] if minor_steps else [])
+                while True:
+                    frame = {}
+                    for stepper, step_dir in moved:
+                        if stepper.current_step % stepper.MICROSTEPS:
+                            frame.update(stepper.next_frame(step_dir, step_style))
+                    if not frame:
+                        break
+                    self.pwm.set_frame(frame)
+                    if camera_steps and camera.current_step % camera.MICROSTEPS:
+                        exit_dict = scheduler.wait(s_per_s, camera.yield_function, camera_dir)
+                    else:
+                        exit_dict = scheduler.wait(s_per_s, rotation.yield_function, rotation_dir)
+                    if exit_dict:
+                        return exit_dict
+        except KeyboardInterrupt:  # if someone types control-c we should exit
+            return {'exit': 'KeyboardInterrupt'}
+        return {}
+
     def release_motor(self, motor_num: int) -> None:
         """turns off coil energizing motors"""
         if motor_num == 1:
@@ -359,5 +457,7 @@ class Raspi_MotorHAT:
     def release_motors(self) -> None:
         """release all motors"""
         self._motor_active = False
+        self.camera_stepper._motor_active = False
+        self.rotation_stepper._motor_active = False
         for motor_num in range(1, 5):
             self.release_motor(motor_num)
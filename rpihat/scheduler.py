@@ -0,0 +1,100 @@
+#!/usr/bin/python
+"""Step scheduler - times the steps of a move against absolute
+deadlines so the time spent writing to the I2C bus, or in the yield
+function, doesn't push back every step after it"""
+from array import array
+from rpihat.clock import SystemClock
+
+
+class StepTimingStats:
+    """how late each step of a move was, in nanoseconds"""
+
+    def __init__(self) -> None:
+        self.lateness = array('q')
+        self.resyncs = 0  # times we fell too far behind and gave up catching up
+
+    def record(self, lateness_ns: int) -> None:
+        """record how late a step was"""
+        self.lateness.append(lateness_ns)
+
+    @property
+    def count(self) -> int:
+        """number of steps timed"""
+        return len(self.lateness)
+
+    def percentile(self, percent: float) -> int:
+        """lateness (ns) that 'percent' of the steps were within"""
+        if not self.lateness:
+            return 0
+        ordered = sorted(self.lateness)
+        index = int(round(percent / 100.0 * (len(ordered) - 1)))
+        return ordered[index]
+
+    def summary(self) -> dict:
+        """the statistics in microseconds"""
+        if not self.lateness:
+            return {'steps': 0, 'resyncs': self.resyncs}
+        return {'steps': self.count,
+                'resyncs': self.resyncs,
+                'mean_us': sum(self.lateness) / self.count / 1000.0,
+                'p50_us': self.percentile(50) / 1000.0,
+                'p99_us': self.percentile(99) / 1000.0,
+                'max_us': max(self.lateness) / 1000.0}
+
+
+class StepScheduler:
+    """each step's deadline is the previous deadline plus the step
+    interval, so a step that runs late is caught up on the next one.
+    We sleep until just short of the deadline (checking the yield
+    function as we go) then spin for the last stretch, sleep() alone
+    overshoots by too much at the step rates we run"""
+
+    SPIN_NS = 200000       # busy wait the last 0.2ms before a deadline
+    POLL_NS = 5000000      # call the yield function at least every 5ms
+    MAX_LAG_STEPS = 2      # further behind than this and we resync
+
+    def __init__(self, clock=None) -> None:
+        self.clock = clock if clock else SystemClock()
+        self.deadline = None
+        self.stats = StepTimingStats()
+
+    def start(self) -> None:
+        """start timing a move from now"""
+        self.deadline = self.clock.now_ns()
+        self.stats = StepTimingStats()
+
+    def wait(self, interval: float, yield_function=None, direction: int = 0) -> dict:
+        """wait until 'interval' seconds after the last deadline. If the
+        yield function returns a dict we stop waiting and return it"""
+        if self.deadline is None:
+            self.start()
+        interval_ns = int(interval * 10**9)
+        self.deadline += interval_ns
+
+        # catching up a long stall (GC, a slow yield) would fire a burst
+        # of steps the motor can't follow, so start timing again instead
+        clock = self.clock
+        now = clock.now_ns()
+        if interval_ns and now - self.deadline > self.MAX_LAG_STEPS * interval_ns:
+            self.stats.resyncs += 1
+            self.deadline = now
+
+        # give the yield function a look every step, even when we're late
+        if yield_function:
+            exit_dict = yield_function(direction)
+            if exit_dict:
+                return exit_dict
+
+        remaining = self.deadline - clock.now_ns()
+        while remaining > self.SPIN_NS:
+            clock.sleep(min(remaining - self.SPIN_NS, self.POLL_NS) / 10**9)
+            remaining = self.deadline - clock.now_ns()
+            if yield_function and remaining > self.SPIN_NS:
+                exit_dict = yield_function(direction)
+                if exit_dict:
+                    return exit_dict
+                remaining = self.deadline - clock.now_ns()
+
+        now = clock.spin_until(self.deadline)
+        self.stats.record(now - self.deadline)
+        return {}
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+"""Simulator - a stand in for the I2C bus and the PCA9685 on the motor
+HAT, so the stepping code can run (and be measured) without a Pi.
+
+    clock = VirtualClock()
+    bus = SimulatedBus(clock)
+    hat = Raspi_MotorHAT(PWM(0x6F, i2c=SimulatedI2C(0x6F, bus)),
+                         yield_func=None, freq=1600, clock=clock)
+
+Every transaction is recorded with the (virtual) time it finished, and
+the clock is moved on by as long as the transaction would take on the
+wire, so the step timing stats show the bus time too"""
+from collections import namedtuple
+from rpihat.clock import VirtualClock
+
+# pylint:disable=C0103
+
+Transaction = namedtuple('Transaction', 'time_ns address register data read')
+
+
+class SimulatedBus:
+    """an I2C bus with PCA9685s on it, they're created on first use"""
+    MODE1 = 0x00
+    MODE2 = 0x01
+    LED0_ON_L = 0x06
+    ALL_LED_ON_L = 0xFA
+    PRESCALE = 0xFE
+    AI = 0x20                 # register auto-increment
+    SWRST = 0x06              # software reset, sent to the general call address
+
+    def __init__(self, clock: VirtualClock = None, bus_hz: int = 100000,
+                 record: bool = True) -> None:
+        self.clock = clock if clock else VirtualClock()
+        self.bit_ns = 10**9 // bus_hz
+        self.devices = {}
+        self.record = record  # keep the transactions
+        self.transactions = []
+        self.busy_ns = 0  # time the bus has spent on transactions
+
+    @classmethod
+    def power_on_registers(cls) -> list:
+        """a PCA9685's registers after power on or a reset, asleep
+        with every channel fully off"""
+        registers = [0] * 256
+        registers[cls.MODE1] = 0x11  # SLEEP | ALLCALL
+        registers[cls.MODE2] = 0x04  # OUTDRV
+        for channel in range(16):
+            registers[cls.LED0_ON_L + 4*channel + 3] = 0x10  # full off
+        registers[cls.PRESCALE] = 0x1E
+        return registers
+
+    def registers(self, address: int) -> list:
+        """the register file of the device at an address"""
+        if address not in self.devices:
+            self.devices[address] = self.power_on_registers()
+        return self.devices[address]
+
+    def channel(self, address: int, channel: int) -> tuple:
+        """(on, off) of a PWM channel"""
+        registers = self.registers(address)
+        base = self.LED0_ON_L + 4*channel
+        return (registers[base] | registers[base+1] << 8,
+                registers[base+2] | registers[base+3] << 8)
+
+    def _transfer(self, address: int, register: int, data: list, read: bool) -> None:
+        """the bus is busy for start, address, register, data, stop"""
+        bits = 9 * (len(data) + (1 if register is None else 2)) + 2
+        self.busy_ns += bits * self.bit_ns
+        self.clock.advance(bits * self.bit_ns)
+        if self.record:
+            self.transactions.append(Transaction(self.clock.now_ns(), address,
+                                                 register, tuple(data), read))
+
+    def write(self, address: int, register: int, data: list) -> None:
+        """write bytes starting at a register. Without auto-increment
+        every byte goes to the same register"""
+        self._transfer(address, register, data, False)
+        registers = self.registers(address)
+        auto_increment = registers[self.MODE1] & self.AI
+        for value in data:
+            registers[register] = value & 0xFF
+            if self.ALL_LED_ON_L <= register < self.ALL_LED_ON_L + 4:
+                offset = register - self.ALL_LED_ON_L
+                for channel in range(16):
+                    registers[self.LED0_ON_L + 4*channel + offset] = value & 0xFF
+            if auto_increment:
+                register = (register + 1) & 0xFF
+
+    def write_raw(self, address: int, value: int) -> None:
+        """a byte with no register, to the general call address this
+        can be a reset of every device"""
+        self._transfer(address, None, [value], False)
+        if address == 0x00 and value == self.SWRST:
+            for device_address in self.devices:
+                self.devices[device_address] = self.power_on_registers()
+
+    def read(self, address: int, register: int, length: int) -> list:
+        """read bytes starting at a register"""
+        registers = self.registers(address)
+        auto_increment = registers[self.MODE1] & self.AI
+        if auto_increment:
+            data = [registers[(register + i) & 0xFF] for i in range(length)]
+        else:
+            data = [registers[register]] * length
+        self._transfer(address, register, data, True)
+        return data
+
+    def led_writes(self, address: int = None) -> list:
+        """the writes (time_ns, register, data) to the LED registers, what
+        to compare when checking a change doesn't alter the register stream"""
+        return [(transaction.time_ns, transaction.register, transaction.data)
+                for transaction in self.transactions
+                if not transaction.read and transaction.register is not None and
+                transaction.register >= self.LED0_ON_L and
+                (address is None or transaction.address == address)]
+
+    def clear(self) -> None:
+        """forget the transactions so far"""
+        self.transactions = []
+        self.busy_ns = 0
+
+
+class SimulatedI2C:
+    """looks like a Raspi_I2C, but talks to a SimulatedBus"""
+
+    def __init__(self, address: int, bus: SimulatedBus = None, debug=False) -> None:
+        self.address = address
+        self.bus = bus if bus else SimulatedBus()
+        self.debug = debug
+
+    @property
+    def clock(self) -> VirtualClock:
+        """the bus's clock, a PWM waits on it"""
+        return self.bus.clock
+
+    def write8(self, reg, value):
+        """Writes an 8-bit value to the specified register/address"""
+        self.bus.write(self.address, reg, [value])
+
+    def write16(self, reg, value):
+        """Writes a 16-bit value to the specified register/address pair"""
+        self.bus.write(self.address, reg, [value & 0xFF, value >> 8])
+
+    def writeRaw8(self, value):
+        """Writes an 8-bit value on the bus"""
+        self.bus.write_raw(self.address, value)
+
+    def writeList(self, reg, byte_list) -> int:
+        """Writes an array of bytes using I2C format"""
+        self.bus.write(self.address, reg, list(byte_list))
+        return 0
+
+    def readList(self, reg, length) -> list:
+        """Read a list of bytes from the I2C device"""
+        return self.bus.read(self.address, reg, length)
+
+    def readU8(self, reg):
+        """Read an unsigned byte from the I2C device"""
+        return self.bus.read(self.address, reg, 1)[0]
+
+    def readS8(self, reg):
+        """Reads a signed byte from the I2C device"""
+        result = self.readU8(reg)
+        return result - 256 if result > 127 else result
+
+    def readU16(self, reg, little_endian=True):
+        """Reads an unsigned 16-bit value from the I2C device"""
+        low, high = self.bus.read(self.address, reg, 2)
+        return low | high << 8 if little_endian else high | low << 8
+
+    def readS16(self, reg, little_endian=True):
+        """Reads a signed 16-bit value from the I2C device"""
+        result = self.readU16(reg, little_endian)
+        return result - 65536 if result > 32767 else result
@@ -3,29 +3,7 @@ import atexit
 import threading
 import random
 from rpihat.pimotorhat import Raspi_MotorHAT
-
-# create a default object, no changes to I2C address or frequency
-mh = Raspi_MotorHAT(0x6F)
-
-# create empty threads (these will hold the stepper 1 and 2 threads)
-st1 = threading.Thread()
-st2 = threading.Thread()
-
-
-# recommended for auto-disabling motors on shutdown!
-def turnOffMotors():
-    mh.getMotor(1).run(Raspi_MotorHAT.RELEASE)
-    mh.getMotor(2).run(Raspi_MotorHAT.RELEASE)
-    mh.getMotor(3).run(Raspi_MotorHAT.RELEASE)
-    mh.getMotor(4).run(Raspi_MotorHAT.RELEASE)
-
-
-atexit.register(turnOffMotors)
-
-myStepper1 = mh.getStepper(200, 1)  # 200 steps/rev, motor port #1
-myStepper2 = mh.getStepper(200, 2)  # 200 steps/rev, motor port #1
-myStepper1.setSpeed(60)  # 30 RPM
-myStepper2.setSpeed(60)  # 30 RPM
+from rpihat.Raspi_PWM_Servo_Driver import PWM
 
 stepstyles = [Raspi_MotorHAT.SINGLE, Raspi_MotorHAT.DOUBLE,
               Raspi_MotorHAT.INTERLEAVE, Raspi_MotorHAT.MICROSTEP]
@@ -37,40 +15,48 @@ def stepper_worker(stepper, numsteps, direction, style):
     print("Done")
 
 
-while True:
-    if not st1.isAlive():
-        randomdir = random.randint(0, 1)
-        print("Stepper 1", end=' ')
-        if randomdir == 0:
-            motor_dir = Raspi_MotorHAT.FORWARD
-            print("forward", end=' ')
-        else:
-            motor_dir = Raspi_MotorHAT.BACKWARD
-            print("backward", end=' ')
+def start_random_move(name, stepper):
+    print(name, end=' ')
+    randomdir = random.randint(0, 1)
+    if randomdir == 0:
+        motor_dir = Raspi_MotorHAT.FORWARD
+        print("forward", end=' ')
+    else:
+        motor_dir = Raspi_MotorHAT.BACKWARD
+        print("backward", end=' ')
+
+    randomsteps = random.randint(10, 50)
+    print("%d steps" % randomsteps)
+    worker = threading.Thread(target=stepper_worker, args=(stepper,
+                                                           randomsteps,
+                                                           motor_dir,
+                                                           stepstyles[random.randint(0, 3)],))
+    worker.start()
+    return worker
+
+
+def main():
+    # create a default object, no changes to I2C address or frequency
+    mh = Raspi_MotorHAT(pwm_obj=PWM(0x6F), yield_func=None, freq=1600)
+
+    # recommended for auto-disabling motors on shutdown!
+    atexit.register(mh.release_motors)
+
+    myStepper1 = mh.rotation_stepper  # 200 steps/rev, motor port #1
+    myStepper2 = mh.camera_stepper  # 200 steps/rev, motor port #2
+    myStepper1.setSpeed(60)  # 60 RPM
+    myStepper2.setSpeed(60)  # 60 RPM
 
-        randomsteps = random.randint(10, 50)
-        print("%d steps" % randomsteps)
-        st1 = threading.Thread(target=stepper_worker, args=(myStepper1,
-                                                            randomsteps,
-                                                            motor_dir,
-                                                            stepstyles[random.randint(0, 3)],))
-        st1.start()
+    # create empty threads (these will hold the stepper 1 and 2 threads)
+    st1 = threading.Thread()
+    st2 = threading.Thread()
+    while True:
+        if not st1.is_alive():
+            st1 = start_random_move("Stepper 1", myStepper1)
 
-    if not st2.isAlive():
-        print("Stepper 2", end=' ')
-        randomdir = random.randint(0, 1)
-        if randomdir == 0:
-            motor_dir = Raspi_MotorHAT.FORWARD
-            print("forward", end=' ')
-        else:
-            motor_dir = Raspi_MotorHAT.BACKWARD
-            print("backward", end=' ')
+        if not st2.is_alive():
+            st2 = start_random_move("Stepper 2", myStepper2)
 
-        randomsteps = random.randint(10, 50)
-        print(("%d steps" % randomsteps))
 
-        st2 = threading.Thread(target=stepper_worker, args=(myStepper2,
-                                                            randomsteps,
-                                                            motor_dir,
-                                                            stepstyles[random.randint(0, 3)],))
-        st2.start()
+if __name__ == '__main__':
+    main()
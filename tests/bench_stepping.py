@@ -0,0 +1,155 @@
+#!/usr/bin/python
+"""Stepping benchmarks - run the stepping code against the simulated
+motor HAT and record what each step costs, so a change that slows the
+stepping path down shows up before it gets to the rig.
+
+    python -m tests.bench_stepping --output bench_stepping.json
+
+For each step style and speed we measure:
+    steps_per_sec - how fast we can step with the waits taken out (on
+                    the virtual clock), the CPU cost of the stepping path
+    i2c_writes_per_step, bus_us_per_step - transactions on the simulated
+                    bus, and how long they'd keep a 100kHz bus busy
+    alloc_blocks_per_step - net Python memory blocks allocated per step,
+                    should be 0, anything else is garbage for the GC
+    peak_alloc_bytes - tracemalloc's peak while stepping
+    jitter - how late the steps were (us percentiles) stepping for
+                    real on the system clock at that speed
+"""
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from rpihat.clock import SystemClock, VirtualClock
+from rpihat.simulator import SimulatedBus, SimulatedI2C
+from rpihat.Raspi_PWM_Servo_Driver import PWM
+from rpihat.pimotorhat import Raspi_MotorHAT
+
+STEP_STYLES = {'single': Raspi_MotorHAT.SINGLE,
+               'double': Raspi_MotorHAT.DOUBLE,
+               'interleave': Raspi_MotorHAT.INTERLEAVE,
+               'microstep': Raspi_MotorHAT.MICROSTEP}
+SPEEDS = [30, 240]  # rpm
+HAT_ADDRESS = 0x6F
+
+
+def make_hat(clock) -> tuple:
+    """a motor HAT on a simulated bus, the bus keeps its own virtual
+    time if we're stepping on the system clock"""
+    bus = SimulatedBus(clock if isinstance(clock, VirtualClock) else VirtualClock())
+    hat = Raspi_MotorHAT(PWM(HAT_ADDRESS, i2c=SimulatedI2C(HAT_ADDRESS, bus)),
+                         yield_func=None, freq=1600, clock=clock)
+    return hat, bus
+
+
+def move_steps(stepper, steps: int, style: int) -> int:
+    """how many steps step() actually makes"""
+    return steps * stepper.MICROSTEPS if style == Raspi_MotorHAT.MICROSTEP else steps
+
+
+def bench_throughput(style: int, rpm: int, steps: int) -> dict:
+    """step on the virtual clock, every wait is instant"""
+    clock = VirtualClock()
+    hat, bus = make_hat(clock)
+    stepper = hat.camera_stepper
+    stepper.setSpeed(rpm)
+    stepper.step(steps, Raspi_MotorHAT.FORWARD, style)  # warm up the shadow registers
+    bus.clear()
+
+    bus_start = clock.now_ns()
+    start = time.perf_counter()
+    stepper.step(steps, Raspi_MotorHAT.BACKWARD, style)
+    elapsed = time.perf_counter() - start
+    made = move_steps(stepper, steps, style)
+    return {'steps': made,
+            'steps_per_sec': made / elapsed,
+            'i2c_writes_per_step': len(bus.transactions) / made,
+            'bus_us_per_step': bus.busy_ns / made / 1000.0,
+            'virtual_sec': (clock.now_ns() - bus_start) / 10**9}
+
+
+def bench_allocations(style: int, rpm: int, steps: int) -> dict:
+    """how much memory the stepping loop allocates"""
+    hat, bus = make_hat(VirtualClock())
+    bus.record = False  # the transaction log would count against us
+    stepper = hat.camera_stepper
+    stepper.setSpeed(rpm)
+    stepper.step(steps, Raspi_MotorHAT.FORWARD, style)
+
+    blocks = sys.getallocatedblocks()
+    stepper.step(steps, Raspi_MotorHAT.BACKWARD, style)
+    blocks = sys.getallocatedblocks() - blocks
+
+    tracemalloc.start()
+    stepper.step(steps, Raspi_MotorHAT.FORWARD, style)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'alloc_blocks_per_step': blocks / move_steps(stepper, steps, style),
+            'peak_alloc_bytes': peak}
+
+
+def bench_jitter(style: int, rpm: int, steps: int) -> dict:
+    """step in real time, the lateness of each step is the jitter"""
+    hat, _ = make_hat(SystemClock())
+    stepper = hat.camera_stepper
+    stepper.setSpeed(rpm)
+    stepper.step(steps, Raspi_MotorHAT.FORWARD, style)
+    return stepper.timing_stats.summary()
+
+
+def bench_move_both(steps: int) -> dict:
+    """both steppers at once, sharing I2C frames"""
+    clock = VirtualClock()
+    hat, bus = make_hat(clock)
+    hat.camera_stepper.setSpeed(240)
+    hat.rotation_stepper.setSpeed(240)
+    bus.clear()
+    start = time.perf_counter()
+    hat.move_both(steps, Raspi_MotorHAT.FORWARD, steps // 2, Raspi_MotorHAT.FORWARD)
+    elapsed = time.perf_counter() - start
+    return {'steps': steps + steps // 2,
+            'steps_per_sec': (steps + steps // 2) / elapsed,
+            'i2c_writes_per_step': len(bus.transactions) / (steps + steps // 2)}
+
+
+def run(steps: int, jitter_steps: int) -> dict:
+    """run every benchmark"""
+    results = {'python': sys.version.split()[0],
+               'timestamp': time.time(),
+               'steppers': [],
+               'move_both': bench_move_both(steps)}
+    for name, style in STEP_STYLES.items():
+        for rpm in SPEEDS:
+            result = {'style': name, 'rpm': rpm}
+            result.update(bench_throughput(style, rpm, steps))
+            result.update(bench_allocations(style, rpm, steps))
+            result['jitter'] = bench_jitter(style, rpm, jitter_steps)
+            print('{style:>10} {rpm:4d}rpm {steps_per_sec:9.0f} steps/s '
+                  '{i2c_writes_per_step:5.2f} writes/step '
+                  '{alloc_blocks_per_step:6.3f} blocks/step '
+                  'p99 {p99:7.1f}us'.format(p99=result['jitter'].get('p99_us', 0),
+                                            **result))
+            results['steppers'].append(result)
+    return results
+
+
+def main():
+    """run the benchmarks, write the results as json"""
+    parser = argparse.ArgumentParser(description='stepping benchmarks')
+    parser.add_argument('--output', default='bench_stepping.json',
+                        help='where to write the results')
+    parser.add_argument('--steps', type=int, default=2000,
+                        help='steps per throughput run')
+    parser.add_argument('--jitter-steps', type=int, default=100,
+                        help='steps per real time run')
+    args = parser.parse_args()
+
+    results = run(args.steps, args.jitter_steps)
+    with open(args.output, 'w') as outfile:
+        json.dump(results, outfile, indent=2)
+    print('results written to {0}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+from unittest import TestCase, mock
+import gphoto2 as gp
+from cameractrl import camera
+from cameractrl.camera import CameraManager
+
+
+class FakeCamera:
+    """a gphoto2 camera that answers until it's told not to"""
+
+    def __init__(self):
+        self.ok = True
+        self.checks = 0
+        self.closed = False
+
+
+class TestCameraManager(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.opened = []
+        self.no_camera = False
+        for name, fake in (('init_camera', self.init_camera),
+                           ('camera_ok', self.camera_ok),
+                           ('exit_camera', self.exit_camera)):
+            patcher = mock.patch.object(camera, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(camera.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cameras = CameraManager(keepalive=60.0)
+
+    def init_camera(self):
+        if self.no_camera:
+            raise gp.GPhoto2Error(gp.GP_ERROR_MODEL_NOT_FOUND)
+        self.opened.append(FakeCamera())
+        return self.opened[-1]
+
+    @staticmethod
+    def camera_ok(my_camera):
+        my_camera.checks += 1
+        return my_camera.ok
+
+    @staticmethod
+    def exit_camera(my_camera):
+        my_camera.closed = True
+        if not my_camera.ok:
+            raise gp.GPhoto2Error(gp.GP_ERROR_IO)
+
+    def test_kept_open_between_jobs(self):
+        first = self.cameras.acquire()
+        assert(self.cameras.config.camera is first)
+        self.cameras.release()
+        assert(self.cameras.acquire() is first)
+        assert(len(self.opened) == 1 and not first.closed)
+        self.cameras.close()
+        assert(first.closed and self.cameras.camera is None)
+
+    def test_idle_keepalive(self):
+        my_camera = self.cameras.acquire()
+        self.cameras.release()
+        checks = my_camera.checks
+        self.now += 30
+        self.cameras.idle()
+        assert(my_camera.checks == checks)  # not due yet
+        self.now += 31
+        self.cameras.idle()
+        assert(my_camera.checks == checks + 1)
+        assert(self.cameras.last_used == self.now)
+        self.cameras.idle()
+        assert(my_camera.checks == checks + 1)  # checked, so not due again yet
+
+    def test_dead_camera_reopened_when_wanted(self):
+        first = self.cameras.acquire()
+        self.cameras.release()
+        first.ok = False
+        self.now += 61
+        self.cameras.idle()
+        assert(first.closed and self.cameras.camera is None and self.cameras.config is None)
+        second = self.cameras.acquire()
+        assert(second is not first and self.cameras.config.camera is second)
+
+    def test_reopened_after_error(self):
+        first = self.cameras.acquire()
+        self.cameras.release()
+        first.ok = False  # stopped responding mid job
+        second = self.cameras.acquire()
+        assert(first.closed and second is not first and len(self.opened) == 2)
+
+    def test_no_camera(self):
+        self.no_camera = True
+        with self.assertRaises(gp.GPhoto2Error):
+            self.cameras.acquire()
+        assert(self.cameras.camera is None)
+        self.cameras.idle()  # nothing to check
+        self.no_camera = False
+        assert(self.cameras.acquire() is self.opened[0])
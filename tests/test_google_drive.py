@@ -0,0 +1,354 @@
+import time
+import tempfile
+import threading
+from unittest import TestCase, mock
+from httplib2 import Response
+from googleapiclient.errors import HttpError
+from cloud_drive import google_drive
+from cloud_drive.google_drive import GoogleDrive, UploadPool, FOLDER_MIME_TYPE, UPLOAD_RETRIES, \
+    UPLOAD_ATTEMPTS
+from cloud_drive.spool import PhotoSpool
+import util
+
+
+def http_error(status: int) -> HttpError:
+    return HttpError(Response({'status': status}), b'')
+
+
+class Request:
+    """what a files() call returns, execute() does the work"""
+
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeFiles:
+    """a drive files() client, 'pages' are what list() returns in turn
+    and 'folders' what get() knows about"""
+
+    def __init__(self, pages=(), folders=None):
+        self.errors = []  # for uploads, see ChunkedUpload
+        self.pages = list(pages)
+        self.folders = folders if folders is not None else {}
+        self.queries = []  # (q, pageToken) of each list()
+        self.gets = 0
+
+    def list(self, q, spaces, fields, pageToken):  # pylint: disable=C0103
+        self.queries.append((q, pageToken))
+        return Request(self.pages.pop(0) if self.pages else {'files': []})
+
+    def get(self, fileId, fields):  # pylint: disable=C0103
+        self.gets += 1
+        folder = self.folders.get(fileId, http_error(404))
+        return Request(folder)
+
+    def create(self, body, media_body):
+        self.created = body
+        self.request = ChunkedUpload(media_body, self.errors)
+        return self.request
+
+
+class FakeMedia:
+    """MediaIoBaseUpload, without the http"""
+
+    def __init__(self, stream, mimetype, chunksize, resumable):
+        data = stream.read()
+        self.chunks = [data[start:start + chunksize]
+                       for start in range(0, len(data), chunksize)]
+
+
+class Progress:
+    def __init__(self, fraction):
+        self.fraction = fraction
+
+    def progress(self):
+        return self.fraction
+
+
+class ChunkedUpload:
+    """a resumable upload request, next_chunk() sends the next chunk
+    or raises the next of 'errors' (None lets the chunk go)"""
+
+    def __init__(self, media, errors):
+        self.chunks = media.chunks
+        self.errors = errors
+        self.sent = 0  # chunks the Drive has, a retry carries on from here
+        self.calls = 0
+
+    def next_chunk(self):
+        self.calls += 1
+        error = self.errors.pop(0) if self.errors else None
+        if error:
+            raise error
+        self.sent += 1
+        if self.sent == len(self.chunks):
+            return None, {'id': 'file'}
+        return Progress(self.sent / len(self.chunks)), None
+
+
+def fake_drive(files: FakeFiles) -> GoogleDrive:
+    """a GoogleDrive that talks to 'files', with no credentials"""
+    drive = GoogleDrive.__new__(GoogleDrive)
+    drive.drive_client = files
+    return drive
+
+
+class TestFindFolder(TestCase):
+
+    def test_follows_pages(self):
+        # pages can come back empty with more to follow
+        files = FakeFiles([{'files': [], 'nextPageToken': 'a'},
+                           {'files': [], 'nextPageToken': 'b'},
+                           {'files': [{'id': 'folder'}]}])
+        assert(fake_drive(files).find_folder('rpipg') == 'folder')
+        assert([token for _, token in files.queries] == [None, 'a', 'b'])
+
+    def test_not_found(self):
+        files = FakeFiles([{'files': [], 'nextPageToken': 'a'}, {'files': []}])
+        assert(fake_drive(files).find_folder('rpipg') is None)
+        assert(len(files.queries) == 2)
+
+    def test_query(self):
+        files = FakeFiles([{'files': [{'id': 'folder'}]}])
+        fake_drive(files).find_folder("bob's scans", 'parent')
+        query = files.queries[0][0]
+        assert("name = 'bob\\'s scans'" in query)
+        assert("mimeType = '{0}'".format(FOLDER_MIME_TYPE) in query)
+        assert('trashed = false' in query)
+        assert("'parent' in parents" in query)
+
+    def test_backslash_escaped(self):
+        files = FakeFiles([{'files': [{'id': 'folder'}]}])
+        fake_drive(files).find_folder("bob\\'s scans")
+        assert("name = 'bob\\\\\\'s scans'" in files.queries[0][0])
+
+
+class TestFolderCache(TestCase):
+
+    def setUp(self):
+        state_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(state_dir.cleanup)
+        patcher = mock.patch.object(util, 'STATE_DIR', state_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached_id_used(self):
+        files = FakeFiles([{'files': [{'id': 'root'}]}],
+                          {'root': {'mimeType': FOLDER_MIME_TYPE, 'trashed': False}})
+        drive = fake_drive(files)
+        assert(drive.find_root_folder('rpipg') == 'root')
+        # found again without a search, it's checked with one get
+        assert(drive.find_root_folder('rpipg') == 'root')
+        assert(len(files.queries) == 1 and files.gets == 1)
+
+    def test_bad_cached_id_searched_again(self):
+        fake_drive(FakeFiles([{'files': [{'id': 'old'}]}])).find_root_folder('rpipg')
+        for folder in (http_error(404),  # deleted
+                       http_error(503), http_error(429), OSError('timed out'),  # can't tell
+                       {'mimeType': FOLDER_MIME_TYPE, 'trashed': True},
+                       {'mimeType': 'image/jpeg', 'trashed': False}):
+            files = FakeFiles([{'files': [{'id': 'new'}]}], {'old': folder})
+            drive = fake_drive(files)
+            assert(drive.find_root_folder('rpipg') == 'new')
+            assert(len(files.queries) == 1)
+            GoogleDrive.cache_folder('rpipg', 'old')
+
+    def test_other_errors_raise(self):
+        fake_drive(FakeFiles([{'files': [{'id': 'old'}]}])).find_root_folder('rpipg')
+        drive = fake_drive(FakeFiles(folders={'old': http_error(403)}))
+        self.assertRaises(HttpError, drive.find_root_folder, 'rpipg')
+
+
+class TestUpload(TestCase):
+
+    def setUp(self):
+        for patcher in (mock.patch.object(google_drive.time, 'sleep'),
+                        mock.patch.object(google_drive.random, 'uniform', return_value=1.0),
+                        mock.patch.object(google_drive, 'MediaIoBaseUpload', FakeMedia)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.sleep = google_drive.time.sleep  # no jitter, so the delays are exact
+        self.files = FakeFiles()
+        self.drive = fake_drive(self.files)
+        self.drive.sub_folder_id = 'session'
+
+    def upload(self, errors) -> dict:
+        """upload 4 chunks, with 'errors' along the way"""
+        self.files.errors = list(errors)
+        return self.drive.write_file_bytes('P0000_IMG.JPG',
+                                           bytes(google_drive.UPLOAD_CHUNK_SIZE * 4))
+
+    def test_uploads_in_chunks(self):
+        assert(self.upload([]) == {'id': 'file'})
+        assert(self.files.request.calls == 4)
+        assert(self.files.created['parents'] == ['session'])
+
+    def test_resumes_after_retryable_error(self):
+        # a chunk fails twice, a later one once
+        assert(self.upload([None, http_error(503), OSError('reset'),
+                            None, http_error(429)]) == {'id': 'file'})
+        # carried on from the chunk that failed, not the start
+        assert(self.files.request.sent == 4 and self.files.request.calls == 7)
+        # backing off twice as long each time, until a chunk goes
+        assert([call[0][0] for call in self.sleep.call_args_list] == [1.0, 2.0, 1.0])
+
+    def test_gives_up(self):
+        with self.assertRaises(HttpError):
+            self.upload([None] + [http_error(500)] * (UPLOAD_RETRIES + 1))
+        assert(self.sleep.call_count == UPLOAD_RETRIES)
+        assert(self.files.request.calls == 1 + UPLOAD_RETRIES + 1)
+
+    def test_chunk_size(self):
+        assert(google_drive.upload_chunk_size(1024) == 1024 * 1024)
+        assert(google_drive.upload_chunk_size(1000) == 768 * 1024)  # rounded down
+        assert(google_drive.upload_chunk_size(100) == 256 * 1024)  # but not to nothing
+        assert(google_drive.upload_chunk_size(0) == 256 * 1024)
+        assert(google_drive.UPLOAD_CHUNK_SIZE % (256 * 1024) == 0)
+
+    def test_client_error_not_retried(self):
+        for status in (400, 403, 404):
+            self.sleep.reset_mock()
+            with self.assertRaises(HttpError):
+                self.upload([http_error(status)])
+            assert(self.sleep.call_count == 0)
+
+
+class FakeUploader:
+    """a GoogleDrive as far as the UploadPool is concerned, its clones
+    note the pictures they upload (and who uploaded them) in 'uploads'"""
+
+    def __init__(self, uploads=None, source=None):
+        self.drive_client = 'client'
+        self.sub_folder_id = 'session'
+        self.uploads = uploads if uploads is not None else []
+        self.source = source
+        self.clones = []
+        self.release = threading.Event()
+        self.release.set()
+        self.fail = set()  # file names that fail to upload
+        self.refuse = set()  # file names the Drive won't take
+
+    def clone(self):
+        drive = FakeUploader(self.uploads, self)
+        drive.release, drive.fail, drive.refuse = self.release, self.fail, self.refuse
+        self.clones.append(drive)
+        return drive
+
+    def write_file(self, filename, path, folder_id):
+        self.release.wait(5)
+        with open(path, 'rb') as photo:
+            assert(photo.read() == filename.encode())
+        if filename in self.fail:
+            raise OSError('connection reset')
+        if filename in self.refuse:
+            raise http_error(403)
+        self.uploads.append((filename, folder_id, self, threading.current_thread()))
+
+
+class TestUploadPool(TestCase):
+
+    def setUp(self):
+        spool_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(spool_dir.cleanup)
+        self.spool = PhotoSpool(spool_dir.name)
+        self.session = self.spool.start_session('folder')
+        self.names = ['P{0:04d}_IMG.JPG'.format(index) for index in range(20)]
+        for name in self.names:
+            self.spool.add(name, name.encode())
+        self.pool = UploadPool(self.spool, workers=3)
+        self.drive = FakeUploader()
+        self.pool.drive = self.drive
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def wait_for_uploads(self):
+        while self.pool._in_flight:  # pylint: disable=W0212
+            time.sleep(0.001)
+
+    def test_each_uploaded_once(self):
+        assert(self.pool.submit_pending() == 20)
+        self.pool.shutdown(wait=True)  # waits for the uploads under way
+        assert(sorted(name for name, _, _, _ in self.drive.uploads) == self.names)
+        assert(all(folder == 'folder' for _, folder, _, _ in self.drive.uploads))
+        assert(self.spool.pending() == [])
+        assert(PhotoSpool(self.spool.directory).pending() == [])
+
+    def test_clone_per_worker(self):
+        self.pool.submit_pending()
+        self.pool.shutdown(wait=True)
+        # each worker thread made its own clone, & only used that
+        assert(1 <= len(self.drive.clones) <= 3)
+        used = {}
+        for _, _, drive, thread in self.drive.uploads:
+            assert(used.setdefault(thread, drive) is drive)
+        assert(len(set(used.values())) == len(self.drive.clones))
+
+    def test_reauthorized_drive_recloned(self):
+        self.pool.submit_pending()
+        self.pool.drive = authorized = FakeUploader(self.drive.uploads)
+        self.spool.add('P0020_IMG.JPG', b'P0020_IMG.JPG')
+        self.pool.submit_pending()
+        self.pool.shutdown(wait=True)
+        last = [drive for name, _, drive, _ in self.drive.uploads if name == 'P0020_IMG.JPG']
+        assert(last[0].source is authorized)
+
+    def test_in_flight_not_submitted_again(self):
+        self.drive.release.clear()  # the uploads hang
+        assert(self.pool.submit_pending() == 20)
+        assert(self.pool.submit_pending() == 0)
+        self.drive.release.set()
+        self.pool.shutdown(wait=True)
+        assert(len(self.drive.uploads) == 20)
+
+    def test_failed_upload_stays_spooled(self):
+        self.drive.fail.add(self.names[0])
+        self.pool.submit_pending()
+        self.pool.shutdown(wait=True)
+        assert(self.spool.pending() == [(self.session, self.names[0], 'folder')])
+        # and it's tried again once it's no longer in flight
+        self.drive.fail.clear()
+        pool = UploadPool(self.spool, workers=1)
+        pool.drive = self.drive
+        assert(pool.submit_pending() == 1)
+        pool.shutdown(wait=True)
+        assert(self.spool.pending() == [])
+
+    def test_not_authorized(self):
+        self.pool.drive = None
+        assert(self.pool.submit_pending() == 0)
+
+    def test_refused_upload_given_up(self):
+        self.drive.fail.add(self.names[0])
+        self.drive.refuse.add(self.names[1])
+        assert(self.pool.submit_pending() == 20)
+        self.wait_for_uploads()
+        for _ in range(UPLOAD_ATTEMPTS - 1):
+            assert(self.pool.submit_pending() == 2)
+            self.wait_for_uploads()
+        # the refused one isn't tried again, the one that might go is
+        assert(self.pool.submit_pending() == 1)
+        self.wait_for_uploads()
+        assert(sorted(name for _, name, _ in self.spool.pending()) == self.names[:2])
+
+    def test_no_folder_given_up(self):
+        self.pool.submit_pending()
+        self.wait_for_uploads()
+        self.spool.start_session()  # before we had a folder
+        self.spool.add('P0020_IMG.JPG', b'P0020_IMG.JPG')
+        self.drive.sub_folder_id = None
+        for _ in range(UPLOAD_ATTEMPTS):
+            assert(self.pool.submit_pending() == 1)
+            self.wait_for_uploads()
+        assert(self.pool.submit_pending() == 0)
+        # until there's a folder for it
+        self.drive.sub_folder_id = 'session'
+        assert(self.pool.submit_pending() == 1)
+        self.pool.shutdown(wait=True)
+        assert(self.spool.pending() == [])
+        assert(self.drive.uploads[-1][:2] == ('P0020_IMG.JPG', 'session'))
@@ -0,0 +1,42 @@
+from unittest import TestCase
+from gpiozero import Device
+from gpiozero.pins.mock import MockFactory
+from rpihat.limit_switch import LimitSwitch
+
+
+class TestLimitSwitch(TestCase):
+
+    def setUp(self):
+        self.factory = MockFactory()
+        previous, Device.pin_factory = Device.pin_factory, self.factory
+        self.addCleanup(setattr, Device, 'pin_factory', previous)
+
+    def make_switch(self, pin=18):
+        switch = LimitSwitch(pin, 'CCW')
+        self.addCleanup(switch.switch.close)
+        return switch, self.factory.pin(pin)
+
+    def test_press_latches(self):
+        switch, pin = self.make_switch()
+        assert(not switch.tripped())
+        pin.drive_high()  # pulled down, so high is pressed
+        pin.drive_low()
+        # the press was brief but it's still latched
+        assert(switch.tripped())
+        assert(switch.tripped_at is not None and switch.released_at >= switch.tripped_at)
+
+    def test_rearm(self):
+        switch, pin = self.make_switch()
+        pin.drive_high()
+        pin.drive_low()
+        switch.rearm()
+        assert(not switch.tripped())
+        pin.drive_high()
+        assert(switch.tripped())
+        # still pressed, so rearming doesn't clear it
+        switch.rearm()
+        assert(switch.tripped())
+        pin.drive_low()
+        switch.rearm()
+        assert(not switch.tripped())
+
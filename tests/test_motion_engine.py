@@ -0,0 +1,80 @@
+import threading
+from unittest import TestCase
+from rpihat.motion_engine import MotionEngine
+from rpihat.pimotorhat import RaspiStepperMotor, Raspi_MotorHAT
+from rpihat.Raspi_PWM_Servo_Driver import PWM
+from rpihat.simulator import SimulatedI2C
+
+
+class TestMotionEngine(TestCase):
+
+    def setUp(self):
+        self.engine = MotionEngine()
+
+    def tearDown(self):
+        self.engine.shutdown()
+
+    def test_moves_run_in_order(self):
+        started = threading.Event()
+        release = threading.Event()
+        order = []
+
+        def move(name):
+            started.set()
+            release.wait(5)
+            order.append(name)
+            return {}
+
+        first = self.engine.submit(move, 'first')
+        second = self.engine.submit(move, 'second')
+        started.wait(5)
+        assert(self.engine.busy() and not first.done())
+        release.set()
+        assert(second.wait(5) == {} and first.done())
+        assert(order == ['first', 'second'])
+
+    def test_cancel_queued_move(self):
+        release = threading.Event()
+        first = self.engine.submit(release.wait, 5)
+        second = self.engine.submit(self.fail)
+        second.cancel()
+        release.set()
+        first.wait(5)
+        assert(second.wait(5) == {'exit': 'abort'})
+
+    def test_cancel_move_under_way(self):
+        stepper = RaspiStepperMotor(PWM(0x6F, i2c=SimulatedI2C(0x6F)), 2,
+                                    yield_function=self.engine.guard())
+        stepper.sec_per_step = 0.001
+        handle = self.engine.submit(stepper.step, 10000,
+                                    Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.DOUBLE)
+        while stepper.stepping_counter == 0:
+            pass
+        handle.cancel()
+        assert(handle.wait(5) == {'exit': 'abort'})
+        assert(0 < stepper.stepping_counter < 10000)
+        # the abort was for that move only
+        assert(self.engine.submit(stepper.step, 3, Raspi_MotorHAT.FORWARD,
+                                  Raspi_MotorHAT.DOUBLE).wait(5) == {})
+
+    def test_cancel_rotation_move(self):
+        hat = Raspi_MotorHAT(PWM(0x6F, i2c=SimulatedI2C(0x6F)), yield_func=None, freq=1600,
+                             rotation_yield_func=self.engine.guard())
+        rotation = hat.rotation_stepper
+        rotation.sec_per_step = 0.001
+        for move, args in ((rotation.step, (10000, Raspi_MotorHAT.FORWARD,
+                                            Raspi_MotorHAT.DOUBLE)),
+                           # with no camera steps only the turntable's yield is checked
+                           (hat.move_both, (10000, Raspi_MotorHAT.FORWARD,
+                                            0, Raspi_MotorHAT.FORWARD))):
+            start = rotation.stepping_counter
+            handle = self.engine.submit(move, *args)
+            while rotation.stepping_counter - start < 10:
+                pass
+            handle.cancel()
+            assert(handle.wait(5) == {'exit': 'abort'})
+            assert(10 <= rotation.stepping_counter - start < 10000)
+
+    @staticmethod
+    def fail():
+        raise AssertionError('cancelled move ran')
@@ -0,0 +1,119 @@
+import time
+from unittest import TestCase
+from rpihat.motion_engine import MotionEngine
+from rpihat.clock import VirtualClock
+from rpihat.simulator import SimulatedBus, SimulatedI2C
+from rpihat.Raspi_PWM_Servo_Driver import PWM
+from rpihat.pimotorhat import Raspi_MotorHAT
+from rpihat.motion_process import MotionExecutor, RemoteMotorHAT
+
+REARMED = []
+
+
+def simulated_hat(yield_func, rotation_yield_func=None):
+    clock = VirtualClock()
+    hat = Raspi_MotorHAT(PWM(0x6F, i2c=SimulatedI2C(0x6F, SimulatedBus(clock))),
+                         yield_func=yield_func, freq=1600, clock=clock,
+                         rotation_yield_func=rotation_yield_func)
+    hat.camera_stepper.setSpeed(240)
+    hat.rotation_stepper.setSpeed(240)
+    return hat
+
+
+def real_time_hat(yield_func, rotation_yield_func=None):
+    """steps take as long as they would on the rig"""
+    hat = Raspi_MotorHAT(PWM(0x6F, i2c=SimulatedI2C(0x6F)), yield_func=yield_func,
+                         freq=1600, rotation_yield_func=rotation_yield_func)
+    hat.camera_stepper.setSpeed(240)
+    hat.rotation_stepper.setSpeed(240)
+    return hat
+
+
+def stop_at_ccw(direction):
+    return {'exit': 'ccw'} if REARMED and direction == Raspi_MotorHAT.FORWARD else {}
+
+
+def setup():
+    return stop_at_ccw
+
+
+def rearm():
+    REARMED.append(True)
+
+
+class TestMotionProcess(TestCase):
+
+    def setUp(self):
+        self.executor = MotionExecutor(simulated_hat, realtime=False)
+        self.executor.start()
+        self.hat = RemoteMotorHAT(self.executor)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_remote_steps(self):
+        camera = self.hat.camera_stepper
+        assert(camera.step(100, Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.DOUBLE) == {})
+        assert(camera.stepping_counter == 100)
+        assert(camera.timing_stats.count == 100)
+        assert(self.hat.is_active)
+        assert(self.hat.move_both(10, Raspi_MotorHAT.BACKWARD, 4, Raspi_MotorHAT.FORWARD) == {})
+        assert(self.hat.rotation_stepper.stepping_counter == -10)
+        assert(camera.stepping_counter == 104)
+        assert(self.hat.timing_stats.count == 10)
+
+    def test_remote_settings(self):
+        camera = self.hat.camera_stepper
+        camera.stepping_counter = 7
+        camera.sec_per_step = 0.01
+        assert(camera.stepping_counter == 7 and camera.sec_per_step == 0.01)
+        camera.setSpeed(60)
+        assert(camera.stepping_counter == 0)
+        assert(abs(camera.sec_per_step - 60.0 / (camera.revsteps * 60)) < 1e-12)
+        self.hat.release_motors()
+        assert(not self.hat.is_active)
+
+    def test_remote_error(self):
+        self.assertRaises(RuntimeError, self.executor.call, 'step', 'turntable', 1, 1, 2, None)
+
+
+class TestMotionProcessSetup(TestCase):
+
+    def test_setup_and_before_move(self):
+        executor = MotionExecutor(simulated_hat, setup=setup, before_move=rearm,
+                                  cpu=0, realtime=False)
+        executor.start()
+        try:
+            camera = RemoteMotorHAT(executor).camera_stepper
+            # the yield function only stops us once rearm() ran, in the motion process
+            assert(camera.step(10, Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.DOUBLE) == {'exit': 'ccw'})
+            assert(camera.step(10, Raspi_MotorHAT.BACKWARD, Raspi_MotorHAT.DOUBLE) == {})
+            assert(camera.stepping_counter == -10)
+            assert(not REARMED)  # that was the motion process's copy
+        finally:
+            executor.shutdown()
+
+
+class TestMotionProcessAbort(TestCase):
+
+    def setUp(self):
+        self.executor = MotionExecutor(real_time_hat, realtime=False)
+        self.executor.start()
+        self.hat = RemoteMotorHAT(self.executor)
+        self.engine = MotionEngine(abort_event=self.executor.abort)
+
+    def tearDown(self):
+        self.engine.shutdown()
+        self.executor.shutdown()
+
+    def test_cancel_remote_move(self):
+        for stepper in (self.hat.rotation_stepper, self.hat.camera_stepper):
+            handle = self.engine.submit(stepper.step, 100000,
+                                        Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.DOUBLE)
+            time.sleep(0.2)  # 800 steps a second, so well under way
+            handle.cancel()
+            assert(handle.wait(5) == {'exit': 'abort'})
+            assert(0 < stepper.stepping_counter < 100000)
+        # the abort was for that move only
+        assert(self.engine.submit(self.hat.move_both, 10, Raspi_MotorHAT.FORWARD,
+                                  3, Raspi_MotorHAT.FORWARD).wait(5) == {})
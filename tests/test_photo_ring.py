@@ -0,0 +1,49 @@
+import os
+import tempfile
+from unittest import TestCase
+from cameractrl.photo_ring import PhotoRing
+
+
+class TestPhotoRing(TestCase):
+
+    def setUp(self):
+        self.ring_dir = tempfile.TemporaryDirectory()
+        self.ring = PhotoRing.create(os.path.join(self.ring_dir.name, 'ring'),
+                                     slots=2, slot_size=1024)
+
+    def tearDown(self):
+        self.ring.close()
+        assert(not os.path.exists(self.ring.path))
+        self.ring_dir.cleanup()
+
+    def test_put_read_release(self):
+        slot, sequence = self.ring.put(b'picture')
+        reader = PhotoRing.attach(self.ring.path)
+        view = reader.read(slot, sequence)
+        assert(bytes(view) == b'picture')
+        view.release()
+        reader.release(slot, sequence)
+        reader.close()
+        assert(self.ring.free_slots() == 2)
+
+    def test_full_ring_falls_back(self):
+        first = self.ring.put(b'one')
+        second = self.ring.put(b'two')
+        assert(first[0] != second[0])
+        assert(self.ring.put(b'three') is None)
+        self.ring.release(*first)
+        assert(self.ring.put(b'three')[0] == first[0])
+
+    def test_too_big(self):
+        assert(self.ring.put(bytes(1025)) is None)
+        assert(self.ring.free_slots() == 2)
+
+    def test_stale_descriptor(self):
+        slot, sequence = self.ring.put(b'old')
+        self.ring.release(slot, sequence)
+        newer = self.ring.put(b'new')
+        assert(newer[0] == slot)
+        # the old descriptor neither reads nor frees the new picture
+        assert(self.ring.read(slot, sequence) is None)
+        self.ring.release(slot, sequence)
+        assert(self.ring.free_slots() == 1)
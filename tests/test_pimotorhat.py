@@ -0,0 +1,216 @@
+from unittest import TestCase
+from rpihat.basis import PWMInterface
+from rpihat.pimotorhat import RaspiStepperMotor, Raspi_MotorHAT
+from rpihat.motion_profile import TrapezoidalProfile, SCurveProfile
+
+
+class RecordingPWM(PWMInterface):
+    """PWM stand-in that remembers what each channel was set to"""
+
+    def __init__(self, address=0x40, debug=False):
+        self.channels = {}
+
+    @classmethod
+    def softwareReset(cls):
+        pass
+
+    def setPWMFreq(self, freq):
+        pass
+
+    def setPWM(self, channel, on, off):
+        self.channels[channel] = (on, off)
+
+    def setAllPWM(self, on, off):
+        for channel in range(16):
+            self.channels[channel] = (on, off)
+
+    def set_pin(self, pin: int, value: int) -> None:
+        self.channels[pin] = (4096, 0) if value else (0, 4096)
+
+
+class TestRaspiStepperMotor(TestCase):
+
+    def make_stepper(self, num=1) -> RaspiStepperMotor:
+        stepper = RaspiStepperMotor(RecordingPWM(), num)
+        stepper.sec_per_step = 0
+        return stepper
+
+    def coils(self, stepper: RaspiStepperMotor) -> tuple:
+        channels = stepper.pwm.channels
+        return tuple(int(channels[pin] == (4096, 0))
+                     for pin in (stepper.AIN2, stepper.BIN1,
+                                 stepper.AIN1, stepper.BIN2))
+
+    def test_double_step_sequence(self):
+        stepper = self.make_stepper()
+        phases = []
+        for _ in range(5):
+            phases.append(stepper.one_step(Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.DOUBLE))
+        assert(phases == [4, 12, 20, 28, 4])
+        assert(self.coils(stepper) == (1, 1, 0, 0))
+        assert(stepper.pwm.channels[stepper.PWMA] == (0, 180 * 16))
+        assert(stepper.pwm.channels[stepper.PWMB] == (0, 180 * 16))
+
+    def test_single_step_backward(self):
+        stepper = self.make_stepper(2)
+        phases = []
+        for _ in range(4):
+            phases.append(stepper.one_step(Raspi_MotorHAT.BACKWARD, Raspi_MotorHAT.SINGLE))
+        assert(phases == [24, 16, 8, 0])
+        assert(self.coils(stepper) == (1, 0, 0, 0))
+        assert(stepper.pwm.channels[stepper.PWMA] == (0, 255 * 16))
+        assert(stepper.pwm.channels[stepper.PWMB] == (0, 0))
+
+    def test_microstep_duty(self):
+        stepper = self.make_stepper()
+        stepper.one_step(Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.MICROSTEP)
+        assert(stepper.current_step == 1)
+        assert(stepper.pwm.channels[stepper.PWMA] == (0, 250 * 16))
+        assert(stepper.pwm.channels[stepper.PWMB] == (0, 50 * 16))
+        assert(self.coils(stepper) == (1, 1, 0, 0))
+
+    def test_microstep_move_ends_on_full_step(self):
+        stepper = self.make_stepper()
+        stepper.step(3, Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.MICROSTEP)
+        assert(stepper.current_step in (0, stepper.MICROSTEPS))
+        assert(stepper.stepping_counter == 3 * stepper.MICROSTEPS)
+
+    def test_phase_tables_wrap(self):
+        stepper = self.make_stepper()
+        for style in (Raspi_MotorHAT.SINGLE, Raspi_MotorHAT.DOUBLE,
+                      Raspi_MotorHAT.INTERLEAVE, Raspi_MotorHAT.MICROSTEP):
+            forward = stepper._phase_tables[style][Raspi_MotorHAT.FORWARD]
+            backward = stepper._phase_tables[style][Raspi_MotorHAT.BACKWARD]
+            assert(len(forward) == stepper.MICROSTEPS * 4)
+            for phase, entry in enumerate(forward):
+                assert(0 <= entry[0] < stepper.MICROSTEPS * 4)
+                # stepping back undoes a step forward (off the odd/even fix up)
+                if style in (Raspi_MotorHAT.INTERLEAVE, Raspi_MotorHAT.MICROSTEP):
+                    assert(backward[entry[0]][0] == phase)
+
+    def test_microstep_resolutions(self):
+        for microsteps in (16, 32, 64):
+            stepper = RaspiStepperMotor(RecordingPWM(), 1, microsteps=microsteps)
+            stepper.sec_per_step = 0
+            assert(len(stepper.MICROSTEP_CURVE) == microsteps + 1)
+            assert(stepper.MICROSTEP_CURVE[0] == 0 and stepper.MICROSTEP_CURVE[-1] == 255)
+            assert(stepper.MICROSTEP_CURVE[microsteps // 2] == 180)  # sin(45)
+            forward = stepper._phase_tables[Raspi_MotorHAT.MICROSTEP][Raspi_MotorHAT.FORWARD]
+            assert(len(forward) == microsteps * 4)
+            stepper.step(3, Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.MICROSTEP)
+            assert(stepper.current_step in (0, microsteps))
+            assert(stepper.stepping_counter == 3 * microsteps)
+            # full steps land on the same coils whatever the resolution
+            stepper.current_step = 0
+            stepper.one_step(Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.DOUBLE)
+            assert(stepper.current_step == microsteps // 2)
+            assert(stepper.pwm.channels[stepper.PWMA] == (0, 180 * 16))
+
+    def test_bad_microstep_resolution(self):
+        self.assertRaises(NameError, RaspiStepperMotor, RecordingPWM(), 1, microsteps=12)
+
+    def test_step_with_profile(self):
+        stepper = self.make_stepper()
+        stepper.setSpeed(240)
+        slept = []
+        stepper.my_timer = lambda sleep_time, direction: slept.append(sleep_time) or {}
+        stepper.step(400, Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.DOUBLE,
+                     TrapezoidalProfile(cruise_rpm=480, accel=960))
+        assert(len(slept) == 400)
+        assert(slept[0] == slept[-1] == stepper.sec_per_step)
+        assert(min(slept) < stepper.sec_per_step)
+        assert(stepper.stepping_counter == 400)
+
+
+class TestRaspiMotorHAT(TestCase):
+
+    def test_move_both_interleaves(self):
+        hat = Raspi_MotorHAT(pwm_obj=RecordingPWM(), yield_func=None, freq=1600)
+        hat.camera_stepper.sec_per_step = hat.rotation_stepper.sec_per_step = 0
+        frames = []
+        hat.pwm.set_frame = frames.append
+        exit_dict = hat.move_both(10, Raspi_MotorHAT.FORWARD,
+                                  4, Raspi_MotorHAT.BACKWARD)
+        assert(exit_dict == {})
+        assert(len(frames) == 10)
+        assert(hat.rotation_stepper.stepping_counter == 10)
+        assert(hat.camera_stepper.stepping_counter == -4)
+        # camera steps are spread out, each sharing a frame with a rotation step
+        camera_pwm = hat.camera_stepper.PWMA
+        shared = [i for i, frame in enumerate(frames) if camera_pwm in frame]
+        assert(len(shared) == 4)
+        assert(all(b - a >= 2 for a, b in zip(shared, shared[1:])))
+
+    def test_move_both_stops_on_yield(self):
+        calls = []
+
+        def stop_after_two(direction):
+            calls.append(direction)
+            return {'exit': 'ccw'} if len(calls) > 2 else {}
+
+        hat = Raspi_MotorHAT(pwm_obj=RecordingPWM(), yield_func=stop_after_two, freq=1600)
+        hat.camera_stepper.sec_per_step = hat.rotation_stepper.sec_per_step = 0
+        exit_dict = hat.move_both(5, Raspi_MotorHAT.FORWARD,
+                                  20, Raspi_MotorHAT.FORWARD)
+        assert(exit_dict == {'exit': 'ccw'})
+        assert(hat.camera_stepper.stepping_counter == 2)
+        assert(hat.rotation_stepper.stepping_counter < 5)
+
+
+    def test_move_both_microsteps(self):
+        pwm = RecordingPWM()
+        # a camera stepper that microsteps coarser than the turntable's
+        hat = Raspi_MotorHAT(pwm_obj=pwm, yield_func=None, freq=1600,
+                             camera_microsteps=8, rotation_microsteps=16)
+        hat.camera_stepper.sec_per_step = hat.rotation_stepper.sec_per_step = 0
+        # off a full step, as a DOUBLE step leaves it
+        hat.camera_stepper.one_step(Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.DOUBLE)
+        frames = []
+        pwm.set_frame = frames.append
+        # 48 turntable microsteps set the pace, not the camera's 40
+        exit_dict = hat.move_both(3, Raspi_MotorHAT.FORWARD,
+                                  5, Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.MICROSTEP)
+        assert(exit_dict == {})
+        assert(hat.rotation_stepper.stepping_counter == 48)
+        assert(hat.camera_stepper.stepping_counter == 40)
+        # the camera was finished off on a full step
+        assert(len(frames) == 48 + 4)
+        assert(hat.camera_stepper.current_step % 8 == 0)
+        assert(hat.rotation_stepper.current_step % 16 == 0)
+
+
+class TestMotionProfile(TestCase):
+
+    def check_ramp(self, intervals: list, start_rate: float) -> None:
+        middle = len(intervals) // 2
+        # speeds up to the middle of the move, then slows back down
+        assert(intervals[0] == intervals[-1] == 1.0 / start_rate)
+        assert(all(a >= b for a, b in zip(intervals[:middle], intervals[1:middle])))
+        assert(all(a <= b for a, b in zip(intervals[middle:], intervals[middle+1:])))
+
+    def test_trapezoid_reaches_cruise(self):
+        profile = TrapezoidalProfile(cruise_rpm=480, accel=960)
+        intervals = profile.step_intervals(2000, 200, 800)
+        self.check_ramp(intervals, 800)
+        assert(abs(min(intervals) - 60.0 / (480 * 200)) < 1e-9)
+        # 240->480rpm at 960rpm/s takes 0.25s & 300 steps each way
+        assert(abs(sum(intervals) - (2000 - 600) / 1600.0 - 2 * 0.25) < 0.01)
+
+    def test_trapezoid_short_move(self):
+        profile = TrapezoidalProfile(cruise_rpm=480, accel=960)
+        intervals = profile.step_intervals(50, 200, 800)
+        self.check_ramp(intervals, 800)
+        assert(min(intervals) > 60.0 / (480 * 200))
+
+    def test_slow_cruise_is_constant(self):
+        profile = TrapezoidalProfile(cruise_rpm=120, accel=960)
+        assert(profile.step_intervals(10, 200, 800) == [1.0 / 800] * 10)
+
+    def test_scurve(self):
+        profile = SCurveProfile(cruise_rpm=480, accel=960, jerk=9600)
+        intervals = profile.step_intervals(2000, 200, 800)
+        self.check_ramp(intervals, 800)
+        assert(abs(min(intervals) - 60.0 / (480 * 200)) < 1e-9)
+        # jerk limiting makes the ramps longer than the trapezoid's
+        trapezoid = TrapezoidalProfile(cruise_rpm=480, accel=960).step_intervals(2000, 200, 800)
+        assert(sum(intervals) > sum(trapezoid))
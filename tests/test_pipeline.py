@@ -0,0 +1,49 @@
+import threading
+from unittest import TestCase
+from cameractrl.pipeline import Pipeline
+
+
+class TestPipeline(TestCase):
+
+    def test_items_go_through_every_stage(self):
+        results = []
+        pipeline = Pipeline([('double', lambda item: item * 2),
+                             ('drop_odd', lambda item: item if item % 4 else None),
+                             ('collect', results.append)])
+        for item in range(10):
+            pipeline.put(item)
+        pipeline.close()
+        assert(results == [2, 6, 10, 14, 18])
+        stats = pipeline.stats()
+        assert(stats['double']['count'] == 10)
+        assert(stats['collect']['count'] == 5)
+        assert(stats['collect']['depth'] == 0)
+
+    def test_backpressure(self):
+        release = threading.Event()
+        pipeline = Pipeline([('fast', lambda item: item),
+                             ('slow', lambda item: release.wait(5))], depth=1)
+        putter = threading.Thread(target=lambda: [pipeline.put(item) for item in range(10)])
+        putter.start()
+        putter.join(0.2)
+        # slow is stuck on one item, one waits for it, one for fast & fast has one
+        assert(putter.is_alive())
+        assert(pipeline.stats()['slow']['max_depth'] == 1)
+        release.set()
+        putter.join(5)
+        pipeline.drain()
+        assert(pipeline.stats()['slow']['count'] == 10)
+        pipeline.close()
+
+    def test_failed_item_is_kept(self):
+        results = []
+        pipeline = Pipeline([('invert', lambda item: 1.0 / item),
+                             ('collect', results.append)])
+        for item in (1, 0, 2):
+            pipeline.put(item)
+        failures = pipeline.drain()
+        assert([(stage, item) for stage, item, _ in failures] == [('invert', 0)])
+        assert(isinstance(failures[0][2], ZeroDivisionError))
+        assert(pipeline.close() == failures)
+        assert(results == [1.0, 0.5])
+        assert(pipeline.stats()['invert']['errors'] == 1)
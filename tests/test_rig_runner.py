@@ -1,5 +1,12 @@
-from unittest import TestCase
+import os
+import time
+import tempfile
+from unittest import TestCase, mock
 import util
+import rig_runner
+from rig_runner import CameraControl, CancelListener, HomingError
+from rig_state import TravelCalibration, PositionModel
+from rpihat.motion_engine import MotionEngine
 
 class TestRigRunner(TestCase):
 
@@ -77,3 +84,223 @@ class TestRigRunner(TestCase):
         assert(steps_per_declination == 291)
         assert(steps_per_rotation == int(200/7 + 0.5))
         assert(declination_start == 1249)
+
+    def test_plan_scan_serpentine(self):
+
+        plan = util.plan_scan(declination=3,
+                              rotation=4,
+                              declination_travel=1000,
+                              rotation_travel=200,
+                              start_pos=100,
+                              end_pos=0)
+
+        shots = plan['shots']
+        assert(len(shots) == 3 * 4)
+        # every ring turns the opposite way to the last, no wrap around
+        assert([shot['rotation'] for shot in shots] == [0, 1, 2, 3, 3, 2, 1, 0, 0, 1, 2, 3])
+        assert([shot['rotation_steps'] for shot in shots[4:8]] == [0, -50, -50, -50])
+        assert([shot['declination_steps'] for shot in shots if shot['declination_steps']] == [500, 500])
+        # only the last declination move runs up to the end stop
+        assert([shot['end_stop'] for shot in shots].count(True) == 1)
+        assert(shots[8]['end_stop'])
+        assert(plan['total_steps'] == 3 * 3 * 50 + 1000)
+
+    def test_plan_scan_does_not_overstep(self):
+
+        plan = util.plan_scan(declination=8,
+                              rotation=7,
+                              declination_travel=3287,
+                              rotation_travel=200,
+                              start_pos=62,
+                              end_pos=0)
+
+        declination_moves = [shot['declination_steps'] for shot in plan['shots']
+                             if shot['declination_steps']]
+        assert(sum(declination_moves) <= 3287 - plan['declination_start'])
+        assert(len(plan['shots']) == 8 * 7)
+
+
+class ScriptedStepper:
+    """a stepper whose moves end with the forced exits it's given"""
+
+    def __init__(self, exits):
+        self.exits = list(exits)
+        self.stepping_counter = 0
+        self.sec_per_step = 0.001
+        self.revsteps = 200
+        self.bursts = []
+
+    def step(self, steps, direction, style, profile=None):
+        self.bursts.append(steps)
+        self.stepping_counter += steps if direction == CameraControl.STEP_CAMERA_CCW else -steps
+        return self.exits.pop(0) if self.exits else {}
+
+
+class ScriptedHAT:
+    def __init__(self, camera_stepper):
+        self.camera_stepper = camera_stepper
+        self.rotation_stepper = ScriptedStepper([])
+        self.moves = []
+
+    def move_both(self, rotation_steps, rotation_dir, camera_steps, camera_dir,
+                  style, profile=None):
+        self.moves.append((rotation_steps, rotation_dir, camera_steps, camera_dir))
+        self.rotation_stepper.stepping_counter += \
+            rotation_steps if rotation_dir == CameraControl.STEP_MODEL_CCW else -rotation_steps
+        self.camera_stepper.stepping_counter += \
+            camera_steps if camera_dir == CameraControl.STEP_CAMERA_CCW else -camera_steps
+        return {}
+
+
+class TestHoming(TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.motion = MotionEngine()
+
+    def tearDown(self):
+        self.motion.shutdown()
+        self.state_dir.cleanup()
+
+    def controller(self, exits, travel=0):
+        calibration = TravelCalibration(os.path.join(self.state_dir.name, 'calibration.json'))
+        calibration.travel_steps = travel
+        position = PositionModel(path=os.path.join(self.state_dir.name, 'position.json'))
+        position.set_declination(100)
+        stepper = ScriptedStepper(exits)
+        return CameraControl(ScriptedHAT(stepper), None, calibration, position,
+                             motion=self.motion), stepper
+
+    def test_finds_end_stop(self):
+        control, stepper = self.controller([{}, {'exit': 'cw'}, {}, {'exit': 'cw'}])
+        control.move_camera(CameraControl.STEP_CAMERA_CW)
+        assert(stepper.bursts == [1000, 1000, CameraControl.HOMING_BACKOFF_STEPS, 1000])
+
+    def test_cancel_stops_homing(self):
+        control, stepper = self.controller([{}, {'exit': 'cancel'}])
+        with self.assertRaises(HomingError) as context:
+            control.move_camera(CameraControl.STEP_CAMERA_CW)
+        assert(context.exception.exit == {'exit': 'cancel'})
+        assert(len(stepper.bursts) == 2)
+        assert(not control.position.is_known)
+
+    def test_cancel_during_back_off(self):
+        control, stepper = self.controller([{'exit': 'cw'}, {'exit': 'cancel'}])
+        with self.assertRaises(HomingError) as context:
+            control.move_camera(CameraControl.STEP_CAMERA_CW)
+        assert(context.exception.exit == {'exit': 'cancel'})
+        # no slow approach after the back off
+        assert(stepper.bursts == [1000, CameraControl.HOMING_BACKOFF_STEPS])
+        assert(not control.position.is_known)
+
+    def test_wrong_end_stop_stops_homing(self):
+        control, _ = self.controller([{'exit': 'ccw'}])
+        with self.assertRaises(HomingError):
+            control.move_camera(CameraControl.STEP_CAMERA_CW)
+
+    def test_travel_is_capped(self):
+        # the switch never trips, we give up after 1.5x the travel
+        control, stepper = self.controller([], travel=3000)
+        with self.assertRaises(HomingError) as context:
+            control.move_camera(CameraControl.STEP_CAMERA_CW)
+        assert(context.exception.exit == {'exit': 'travel'})
+        assert(sum(stepper.bursts) == 4500)
+        control, stepper = self.controller([])
+        with self.assertRaises(HomingError):
+            control.move_camera(CameraControl.STEP_CAMERA_CW)
+        assert(sum(stepper.bursts) == CameraControl.HOMING_MAX_STEPS)
+
+
+class TestMoveToStart(TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.motion = MotionEngine()
+
+    def tearDown(self):
+        self.motion.shutdown()
+        self.state_dir.cleanup()
+
+    def test_both_move_together(self):
+        position = PositionModel(path=os.path.join(self.state_dir.name, 'position.json'))
+        position.set_declination(100)
+        position.end_move(rotation_steps=150)
+        hat = ScriptedHAT(ScriptedStepper([]))
+        calibration = TravelCalibration(os.path.join(self.state_dir.name, 'calibration.json'))
+        control = CameraControl(hat, None, calibration, position, motion=self.motion)
+        assert(control.move_to_start(300) == {})
+        # the short way round the turntable, at the same time as the camera
+        assert(hat.moves == [(50, CameraControl.STEP_MODEL_CCW,
+                              200, CameraControl.STEP_CAMERA_CCW)])
+        assert(position.declination == 300 and position.rotation == 0)
+        # already there
+        assert(control.move_to_start(300) == {})
+        assert(len(hat.moves) == 1)
+
+
+class FakeJob:
+    def __init__(self, body):
+        self.body = body
+        self.deleted = False
+
+    def delete(self):
+        self.deleted = True
+
+
+class FakeBeanstalk:
+    """a beanstalk connection, reserve() hands out the 'script' jobs
+    (an exception is raised) then waits out its timeout"""
+    connections = []
+
+    def __init__(self, script, **kwargs):
+        self.script = script
+        self.watched = []
+        FakeBeanstalk.connections.append(self)
+
+    def watch(self, tube):
+        self.watched.append(tube)
+
+    def ignore(self, tube):
+        pass
+
+    def reserve(self, timeout=None):
+        if self.script:
+            job = self.script.pop(0)
+            if isinstance(job, Exception):
+                raise job
+            return job
+        time.sleep(timeout)
+        return None
+
+
+class TestCancelListener(TestCase):
+
+    def listen(self, script):
+        FakeBeanstalk.connections = []
+        patcher = mock.patch.object(rig_runner.beanstalk, 'Connection',
+                                    lambda **kwargs: FakeBeanstalk(script, **kwargs))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        listener = CancelListener()
+        listener.RESERVE_TIMEOUT = 0.01
+        listener.start()
+        self.addCleanup(listener.join, 5)
+        self.addCleanup(listener.stop)
+        return listener
+
+    def test_cancel_latched_and_deleted(self):
+        job = FakeJob('{"cancel": true}')
+        listener = self.listen([job])
+        assert(listener.cancelled.wait(5))
+        assert(job.deleted)
+        assert(FakeBeanstalk.connections[0].watched == [rig_runner.CANCEL_QUEUE])
+        # acted on once
+        assert(listener.consume())
+        assert(listener.last_latency >= 0)
+        assert(not listener.consume())
+
+    def test_reconnects(self):
+        job = FakeJob('{"cancel": true}')
+        listener = self.listen([rig_runner.beanstalk.SocketError(), job])
+        assert(listener.cancelled.wait(5))
+        assert(job.deleted and len(FakeBeanstalk.connections) == 2)
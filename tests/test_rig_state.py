@@ -0,0 +1,117 @@
+import os
+import time
+import tempfile
+from unittest import TestCase, mock
+import util
+from rig_state import TravelCalibration, PositionModel
+
+
+class TestTravelCalibration(TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.state_dir.name, 'calibration.json')
+
+    def tearDown(self):
+        self.state_dir.cleanup()
+
+    def test_save_load_json(self):
+        util.save_json(self.path, {'travel_steps': 3287})
+        assert(util.load_json(self.path) == {'travel_steps': 3287})
+        assert(not os.path.exists(self.path + '.tmp'))
+        assert(util.load_json(self.path + '.missing') == {})
+
+    def test_uncalibrated(self):
+        calibration = TravelCalibration(self.path)
+        assert(not calibration.is_valid())
+
+    def test_measured_persists(self):
+        TravelCalibration(self.path).measured(3287)
+        calibration = TravelCalibration(self.path)
+        assert(calibration.travel_steps == 3287)
+        assert(calibration.confidence == 1.0)
+        assert(calibration.is_valid())
+
+    def test_verify_drift(self):
+        calibration = TravelCalibration(self.path)
+        calibration.measured(3287)
+        assert(calibration.verified(5))
+        assert(calibration.is_valid())
+        assert(not calibration.verified(calibration.DRIFT_THRESHOLD + 1))
+        assert(not calibration.is_valid())
+
+    def test_unverified_decays(self):
+        calibration = TravelCalibration(self.path)
+        calibration.measured(3287)
+        for _ in range(10):
+            assert(calibration.verified())
+        assert(not calibration.is_valid())
+
+    def test_invalidate_and_age(self):
+        calibration = TravelCalibration(self.path)
+        calibration.measured(3287)
+        calibration.invalidate()
+        assert(not TravelCalibration(self.path).is_valid())
+
+        calibration.measured(3287)
+        calibration.timestamp = time.time() - calibration.MAX_AGE - 1
+        assert(not calibration.is_valid())
+
+
+class TestPositionModel(TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.state_dir.name, 'position.json')
+
+    def tearDown(self):
+        self.state_dir.cleanup()
+
+    def test_unknown_until_homed(self):
+        position = PositionModel(path=self.path)
+        assert(not position.is_known)
+        position.end_move(declination_steps=100, rotation_steps=25)
+        assert(not position.is_known)
+        assert(position.rotation == 25)
+
+    def test_journal_survives_restart(self):
+        position = PositionModel(path=self.path)
+        position.set_declination(0)
+        position.begin_move()
+        position.end_move(declination_steps=1249, rotation_steps=-10)
+        restarted = PositionModel(path=self.path)
+        assert(restarted.declination == 1249)
+        assert(restarted.rotation == 190)
+
+    def test_died_mid_move(self):
+        position = PositionModel(path=self.path)
+        position.set_declination(1249)
+        position.begin_move()
+        assert(not PositionModel(path=self.path).is_known)
+
+    def test_shortest_moves(self):
+        position = PositionModel(path=self.path)
+        position.set_declination(1000)
+        assert(position.declination_move(1249) == 249)
+        assert(position.declination_move(0) == -1000)
+        position.end_move(rotation_steps=10)
+        assert(position.rotation_move(60) == 50)
+        assert(position.rotation_move(190) == -20)
+        assert(position.rotation_move(10) == 0)
+
+    def test_turntable_moves_not_journalled(self):
+        position = PositionModel(path=self.path)
+        position.set_declination(500)
+        with mock.patch.object(util, 'save_json', wraps=util.save_json) as save_json:
+            # a ring: the camera moves to it, then the turntable goes round
+            position.begin_move()
+            position.end_move(declination_steps=250)
+            for _ in range(7):
+                position.begin_move(camera=False)
+                assert(PositionModel(path=self.path).is_known)
+                position.end_move(rotation_steps=10)
+            assert(save_json.call_count == 2)
+        assert(PositionModel(path=self.path).rotation == 0)
+        position.save()
+        restarted = PositionModel(path=self.path)
+        assert(restarted.declination == 750 and restarted.rotation == 70)
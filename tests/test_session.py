@@ -0,0 +1,114 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+from cameractrl import camera
+from cameractrl.session import SessionManifest
+
+
+class FakeQueue:
+    """a beanstalk connection that keeps what's put"""
+
+    def __init__(self, **kwargs):
+        self.jobs = []
+
+    def use(self, tube):
+        pass
+
+    def put(self, job):
+        self.jobs.append(job)
+
+    def close(self):
+        self.closed = True
+
+
+class TestSessionManifest(TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.state_dir.name, 'session.json')
+
+    def tearDown(self):
+        self.state_dir.cleanup()
+
+    def test_pending_until_sent(self):
+        manifest = SessionManifest(self.path)
+        manifest.start()
+        first = manifest.add('/DCIM/100', 'IMG_0001.JPG', 'P0000000000_IMG_0001.JPG', 0, 0)
+        manifest.add('/DCIM/100', 'IMG_0002.JPG', 'P0000000020_IMG_0002.JPG', 20, 0)
+        assert(len(manifest.pending()) == 2)
+        manifest.sent(first)
+        pending = manifest.pending()
+        assert(len(pending) == 1)
+        assert(pending[0]['name'] == 'IMG_0002.JPG' and pending[0]['rotation'] == 20)
+
+    def test_survives_restart(self):
+        manifest = SessionManifest(self.path)
+        manifest.start()
+        first = manifest.add('/DCIM/100', 'IMG_0001.JPG', 'P0000000000_IMG_0001.JPG', 0, 0)
+        manifest.add('/DCIM/100', 'IMG_0002.JPG', 'P0000000020_IMG_0002.JPG', 20, 0)
+        manifest.sent(first)
+
+        # a new session keeps what wasn't sent, & only that
+        restarted = SessionManifest(self.path)
+        assert(restarted.session == manifest.session)
+        restarted.start()
+        assert(len(restarted.entries) == 1)
+        assert(restarted.pending()[0]['file_name'] == 'P0000000020_IMG_0002.JPG')
+
+    def test_failed_download_stays_pending(self):
+        manifest = SessionManifest(self.path)
+        manifest.start()
+        manifest.add('/DCIM/100', 'IMG_0001.JPG', 'P0000_IMG_0001.JPG', 0, 0)
+        manifest.add('/DCIM/100', 'IMG_0002.JPG', 'P0020_IMG_0002.JPG', 20, 0)
+
+        def read_photo(my_camera, file_path):
+            if file_path.name == 'IMG_0001.JPG' and not reads:
+                reads.append(file_path.name)
+                raise IOError('usb hiccup')
+            return b'picture'
+
+        reads = []
+        with mock.patch.object(camera, 'read_photo', read_photo), \
+                mock.patch.object(camera.beanstalk, 'Connection', FakeQueue):
+            assert(camera.bulk_download(None, manifest) == 1)
+            assert([entry['name'] for entry in manifest.pending()] == ['IMG_0001.JPG'])
+            # next time round it's downloaded
+            assert(camera.bulk_download(None, manifest) == 1)
+        assert(manifest.pending() == [])
+
+    def test_same_name_in_two_sessions(self):
+        # the camera's numbering started again, the names clash
+        manifest = SessionManifest(self.path)
+        manifest.session = 'first'
+        old = manifest.add('/store_00010001', 'capt0000.jpg', 'P0000_capt0000.jpg', 0, 0)
+        manifest.session = 'second'
+        new = manifest.add('/store_00010001', 'capt0000.jpg', 'P0000_capt0000.jpg', 0, 0)
+        assert(old != new)
+
+        def read_photo(my_camera, file_path):
+            raise IOError('not on the card')
+
+        with mock.patch.object(camera.beanstalk, 'Connection', FakeQueue):
+            manifest.sent(new)
+            assert([entry['session'] for entry in manifest.pending()] == ['first'])
+            # the old one can't be downloaded, so in time it's given up on
+            with mock.patch.object(camera, 'read_photo', read_photo):
+                for _ in range(SessionManifest.MAX_ATTEMPTS):
+                    assert(camera.bulk_download(None, manifest) == 0)
+                    manifest.start()
+        assert(manifest.pending() == [])
+
+    def test_connection_closed(self):
+        manifest = SessionManifest(self.path)
+        manifest.start()
+        manifest.add('/DCIM/100', 'IMG_0001.JPG', 'P0000_IMG_0001.JPG', 0, 0)
+        queues = []
+
+        def connection(**kwargs):
+            queues.append(FakeQueue(**kwargs))
+            return queues[-1]
+
+        with mock.patch.object(camera, 'read_photo', lambda my_camera, file_path: b'picture'), \
+                mock.patch.object(camera.beanstalk, 'Connection', connection):
+            assert(camera.bulk_download(None, manifest) == 1)
+        assert(len(queues) == 1 and queues[0].closed)
@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+from unittest import TestCase, mock
+import gphoto2 as gp
+from cameractrl import settings
+from cameractrl.settings import CameraConfig
+
+
+class FakeWidget:
+    def __init__(self, widget_type, value, choices=()):
+        self.widget_type = widget_type
+        self.value = value
+        self.choices = list(choices)
+
+
+class FakeCamera:
+    """a gphoto2 camera as far as CameraConfig is concerned, its
+    configuration tree is a dict of widgets"""
+
+    def __init__(self):
+        self.tree = {'iso': FakeWidget(gp.GP_WIDGET_RADIO, '100', ('100', '200', '400')),
+                     'shutterspeed': FakeWidget(gp.GP_WIDGET_RADIO, '1/30', ('1/30', '1/60')),
+                     'capturetarget': FakeWidget(gp.GP_WIDGET_RADIO, 'Internal RAM',
+                                                 ('Internal RAM', 'Memory card'))}
+        self.camera_values = {name: widget.value for name, widget in self.tree.items()}
+        self.get_configs = 0
+        self.set_configs = 0
+        self.fail_set = False
+
+    def gp(self):
+        def get_config(camera):
+            self.get_configs += 1
+            self.tree = {name: FakeWidget(widget.widget_type, self.camera_values[name],
+                                          widget.choices)
+                         for name, widget in self.tree.items()}
+            return self.tree
+
+        def set_config(camera, tree):
+            if self.fail_set:
+                raise gp.GPhoto2Error(gp.GP_ERROR_IO)
+            self.set_configs += 1
+            self.camera_values = {name: widget.value for name, widget in tree.items()}
+
+        def set_value(widget, value):
+            widget.value = value
+
+        return SimpleNamespace(
+            check_result=lambda result: result,
+            GP_OK=gp.GP_OK,
+            GP_WIDGET_RADIO=gp.GP_WIDGET_RADIO,
+            GP_WIDGET_MENU=gp.GP_WIDGET_MENU,
+            GP_WIDGET_RANGE=gp.GP_WIDGET_RANGE,
+            GP_WIDGET_TOGGLE=gp.GP_WIDGET_TOGGLE,
+            GPhoto2Error=gp.GPhoto2Error,
+            gp_camera_get_config=get_config,
+            gp_camera_set_config=set_config,
+            gp_widget_get_child_by_name=lambda tree, name:
+            (gp.GP_OK, tree[name]) if name in tree else (gp.GP_ERROR, None),
+            gp_widget_get_value=lambda widget: widget.value,
+            gp_widget_set_value=set_value,
+            gp_widget_get_type=lambda widget: widget.widget_type,
+            gp_widget_count_choices=lambda widget: len(widget.choices),
+            gp_widget_get_choice=lambda widget, index: widget.choices[index])
+
+
+class TestCameraConfig(TestCase):
+
+    def setUp(self):
+        self.camera = FakeCamera()
+        patcher = mock.patch.object(settings, 'gp', self.camera.gp())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.config = CameraConfig(self.camera)
+
+    def test_only_changes_are_written(self):
+        assert(self.config.apply({'iso': '200', 'shutter': '1/30'}) == ['iso'])
+        assert(self.camera.set_configs == 1)
+        assert(self.camera.camera_values['iso'] == '200')
+        # already set, nothing goes to the camera
+        assert(self.config.apply({'iso': 200}) == [])
+        assert(self.camera.set_configs == 1)
+        assert(self.camera.get_configs == 1)  # the tree was only read once
+
+    def test_changes_go_in_one_write(self):
+        changed = self.config.apply({'iso': '400', 'shutter': '1/60',
+                                     'capture_target': 'Memory card'})
+        assert(sorted(changed) == ['capture_target', 'iso', 'shutter'])
+        assert(self.camera.set_configs == 1)
+
+    def test_bad_setting_leaves_copy_alone(self):
+        for bad in ({'iso': '200', 'aperture': '8'},  # no such widget
+                    {'iso': '200', 'shutter': '1/8000'}):  # not a choice
+            with self.assertRaises((NameError, ValueError)):
+                self.config.apply(bad)
+            assert(self.config.get('iso') == '100')
+        assert(self.camera.set_configs == 0)
+        # so the change still goes to the camera
+        assert(self.config.apply({'iso': '200'}) == ['iso'])
+        assert(self.camera.camera_values['iso'] == '200')
+
+    def test_failed_write_rereads(self):
+        self.camera.fail_set = True
+        with self.assertRaises(gp.GPhoto2Error):
+            self.config.apply({'iso': '200'})
+        self.camera.fail_set = False
+        # the copy is read again, so the change isn't thought done
+        assert(self.config.apply({'iso': '200'}) == ['iso'])
+        assert(self.camera.get_configs == 2)
+        assert(self.camera.camera_values['iso'] == '200')
@@ -0,0 +1,175 @@
+import threading
+from unittest import TestCase, mock
+from rpihat.clock import VirtualClock, SystemClock
+from rpihat.simulator import SimulatedBus, SimulatedI2C
+from rpihat.Raspi_PWM_Servo_Driver import PWM
+from rpihat.pimotorhat import Raspi_MotorHAT
+from rpihat.scheduler import StepScheduler
+
+
+class TestSimulatedBus(TestCase):
+
+    def test_auto_increment(self):
+        bus = SimulatedBus()
+        i2c = SimulatedI2C(0x40, bus)
+        i2c.writeList(0x06, [1, 2, 3, 4])
+        # without auto-increment every byte lands on the same register
+        assert(bus.registers(0x40)[0x06:0x0A] == [4, 0, 0, 0x10])
+        i2c.write8(0x00, 0x21)
+        i2c.writeList(0x06, [1, 2, 3, 4])
+        assert(bus.registers(0x40)[0x06:0x0A] == [1, 2, 3, 4])
+        assert(bus.channel(0x40, 0) == (0x0201, 0x0403))
+
+    def test_all_led_and_reset(self):
+        bus = SimulatedBus()
+        i2c = SimulatedI2C(0x40, bus)
+        i2c.write8(0xFC, 0x34)
+        i2c.write8(0xFD, 0x12)
+        assert(all(bus.channel(0x40, channel) == (0, 0x1234) for channel in range(16)))
+        SimulatedI2C(0x00, bus).writeRaw8(0x06)
+        assert(bus.channel(0x40, 3) == (0, 0x1000))
+
+    def test_bus_time(self):
+        clock = VirtualClock()
+        bus = SimulatedBus(clock)
+        SimulatedI2C(0x40, bus).writeList(0x06, [0] * 4)
+        # start, address, register, 4 data bytes & stop at 100kHz
+        assert(clock.now_ns() == (9 * 6 + 2) * 10000)
+        assert(bus.transactions[0].time_ns == clock.now_ns())
+        assert(bus.transactions[0].data == (0, 0, 0, 0))
+
+
+class TestSimulatedPWM(TestCase):
+
+    def test_waits_on_bus_clock(self):
+        clock = VirtualClock()
+        with mock.patch.object(SystemClock, 'sleep', side_effect=AssertionError('slept')):
+            pwm = PWM(0x6F, i2c=SimulatedI2C(0x6F, SimulatedBus(clock)))
+            pwm.setPWMFreq(1600)
+        # the three oscillator waits passed on the virtual clock
+        assert(clock.now_ns() >= 3 * 5000000)
+
+    def test_reset_on_simulated_bus(self):
+        bus = SimulatedBus()
+        pwm = PWM(0x6F, i2c=SimulatedI2C(0x6F, bus))
+        pwm.set_frame({0: (0, 100)})
+        with mock.patch('rpihat.Raspi_PWM_Servo_Driver.Raspi_I2C',
+                        side_effect=AssertionError('opened the real bus')):
+            PWM.softwareReset(SimulatedI2C(0x00, bus))
+        assert(bus.channel(0x6F, 0) == (0, 0x1000))
+        # the shadow was forgotten, so the channel is written again
+        bus.clear()
+        pwm.set_frame({0: (0, 100)})
+        assert(bus.led_writes(0x6F))
+
+    def test_frames_from_two_threads(self):
+        # like a stepper on each thread, as tests/DualStepperTest.py does
+        bus = SimulatedBus()
+        pwm = PWM(0x6F, i2c=SimulatedI2C(0x6F, bus))
+
+        def stepper(channels):
+            for value in range(1, 500):
+                pwm.set_frame({channel: (0, value) for channel in channels})
+
+        workers = [threading.Thread(target=stepper, args=(channels,))
+                   for channels in ((0, 1, 2, 3), (4, 5, 6, 7))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        # the shadow agrees with the device, so nothing was skipped
+        assert([bus.channel(0x6F, channel) for channel in range(8)] == [(0, 499)] * 8)
+        bus.clear()
+        pwm.set_frame({channel: (0, 499) for channel in range(8)})
+        assert(not bus.led_writes(0x6F))
+
+
+class FlakyI2C(SimulatedI2C):
+    """drops the next 'failures' block writes"""
+    failures = 0
+
+    def writeList(self, reg, byte_list) -> int:
+        if self.failures:
+            self.failures -= 1
+            return -1
+        return super().writeList(reg, byte_list)
+
+
+class TestFailedWrite(TestCase):
+
+    def test_rest_of_frame_written(self):
+        bus = SimulatedBus()
+        i2c = FlakyI2C(0x6F, bus)
+        pwm = PWM(0x6F, i2c=i2c)
+        frame = {0: (0, 100), 1: (0, 200), 15: (4096, 0)}
+        i2c.failures = 1  # channels 0 & 1 go in the first block
+        assert(not pwm.set_frame(frame))
+        # the frame's other block still went out
+        assert(bus.channel(0x6F, 15) == (4096, 0))
+        assert(bus.channel(0x6F, 0) == (0, 0))
+        # and nothing is taken for granted next time
+        assert(pwm.set_frame(frame))
+        assert([bus.channel(0x6F, channel) for channel in (0, 1, 15)] ==
+               [(0, 100), (0, 200), (4096, 0)])
+
+
+class TestSimulatedStepping(TestCase):
+
+    def make_hat(self):
+        clock = VirtualClock()
+        bus = SimulatedBus(clock)
+        hat = Raspi_MotorHAT(PWM(0x6F, i2c=SimulatedI2C(0x6F, bus)),
+                             yield_func=None, freq=1600, clock=clock)
+        return hat, bus, clock
+
+    def test_pwm_setup(self):
+        _, bus, _ = self.make_hat()
+        registers = bus.registers(0x6F)
+        assert(registers[0x00] & 0x20)  # auto-increment on
+        assert(not registers[0x00] & 0x10)  # awake
+        assert(registers[0xFE] == 3)  # 1600Hz prescale
+
+    def test_move_runs_on_virtual_time(self):
+        hat, bus, clock = self.make_hat()
+        stepper = hat.camera_stepper
+        stepper.setSpeed(240)
+        bus.clear()
+        start = clock.now_ns()
+        assert(stepper.step(400, Raspi_MotorHAT.FORWARD, Raspi_MotorHAT.DOUBLE) == {})
+        assert(clock.now_ns() - start == 400 * int(stepper.sec_per_step * 10**9))
+        assert(stepper.timing_stats.count == 400)
+        # one block write a step once the registers are known
+        assert(len(bus.led_writes(0x6F)) == 400)
+        assert(bus.channel(0x6F, stepper.PWMA) == (0, 180 * 16))
+
+    def test_register_stream_repeats(self):
+        streams = []
+        for _ in range(2):
+            hat, bus, _ = self.make_hat()
+            hat.move_both(50, Raspi_MotorHAT.FORWARD, 20, Raspi_MotorHAT.BACKWARD)
+            streams.append(bus.led_writes())
+        assert(streams[0] == streams[1])
+
+    def test_scheduler_sees_bus_time(self):
+        clock = VirtualClock()
+        scheduler = StepScheduler(clock)
+        scheduler.start()
+        clock.advance(4 * 10**6)  # a step that took 4ms...
+        scheduler.wait(0.001)  # ...of a 1ms interval
+        assert(scheduler.stats.resyncs == 1)
+        assert(clock.now_ns() == 4 * 10**6)
+
+    def test_late_step_caught_up(self):
+        clock = VirtualClock()
+        scheduler = StepScheduler(clock)
+        scheduler.start()
+        deadlines = []
+        for step in range(4):
+            if step == 1:
+                clock.advance(15 * 10**5)  # took 1.5ms, 0.5ms late but not enough to resync
+            scheduler.wait(0.001)
+            deadlines.append(clock.now_ns())
+        # the late step goes when it can, the rest stay on the 1ms grid
+        assert(deadlines == [1 * 10**6, 25 * 10**5, 3 * 10**6, 4 * 10**6])
+        assert(list(scheduler.stats.lateness) == [0, 5 * 10**5, 0, 0])
+        assert(scheduler.stats.count == 4 and scheduler.stats.resyncs == 0)
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from cloud_drive.spool import PhotoSpool
+
+
+class TestPhotoSpool(TestCase):
+
+    def setUp(self):
+        self.spool_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.spool_dir.cleanup()
+
+    def test_pending_until_uploaded(self):
+        spool = PhotoSpool(self.spool_dir.name)
+        session = spool.start_session('folder')
+        spool.add('P0000_IMG_0001.JPG', b'one')
+        spool.add('P0001_IMG_0002.JPG', memoryview(b'two'))  # straight from the ring
+        assert(spool.pending() == [(session, 'P0000_IMG_0001.JPG', 'folder'),
+                                   (session, 'P0001_IMG_0002.JPG', 'folder')])
+        assert(spool.read(session, 'P0001_IMG_0002.JPG') == b'two')
+        spool.uploaded(session, 'P0000_IMG_0001.JPG')
+        assert(spool.pending() == [(session, 'P0001_IMG_0002.JPG', 'folder')])
+        assert(not os.path.exists(os.path.join(self.spool_dir.name, session,
+                                               'P0000_IMG_0001.JPG')))
+
+    def test_resume_after_restart(self):
+        spool = PhotoSpool(self.spool_dir.name)
+        session = spool.start_session()
+        spool.add('P0000_IMG_0001.JPG', b'one')
+
+        # no folder yet, the pictures wait for one
+        restarted = PhotoSpool(self.spool_dir.name)
+        assert(restarted.session == session)
+        assert(restarted.pending() == [(session, 'P0000_IMG_0001.JPG', None)])
+        restarted.set_folder('folder')
+        assert(restarted.pending() == [(session, 'P0000_IMG_0001.JPG', 'folder')])
+        assert(restarted.read(session, 'P0000_IMG_0001.JPG') == b'one')
+
+    def test_finished_session_removed(self):
+        spool = PhotoSpool(self.spool_dir.name)
+        first = spool.start_session('first')
+        spool.add('P0000_IMG_0001.JPG', b'one')
+        spool.start_session('second')
+        # the first session is kept until its picture is uploaded
+        assert(os.path.isdir(os.path.join(self.spool_dir.name, first)))
+        spool.uploaded(first, 'P0000_IMG_0001.JPG')
+        assert(not os.path.exists(os.path.join(self.spool_dir.name, first)))
+        assert(spool.pending() == [])
+
+    def test_uploaded_from_workers(self):
+        spool = PhotoSpool(self.spool_dir.name)
+        session = spool.start_session('folder')
+        names = ['P{0:04d}_IMG.JPG'.format(index) for index in range(40)]
+        for name in names:
+            spool.add(name, b'photo')
+        workers = [threading.Thread(target=lambda part: [spool.uploaded(session, name)
+                                                         for name in part],
+                                    args=(names[index::4],)) for index in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert(spool.pending() == [])
+        assert(PhotoSpool(self.spool_dir.name).pending() == [])
@@ -1,3 +1,10 @@
+import os
+import json
+
+# where we keep rig state that has to survive a restart
+STATE_DIR = os.environ.get('RPIPG_STATE_DIR', os.path.expanduser('~/.rpipg'))
+
+
 def calculate_steps(declination: int,
                     rotation: int,
                     declination_travel: int,
@@ -23,3 +30,106 @@ def calculate_steps(declination: int,
     steps_per_rotation = int((rotation_travel / rotation) + 0.5)
     return steps_per_declination, steps_per_rotation, declination_start
 
+
+def plan_scan(declination: int,
+              rotation: int,
+              declination_travel: int,
+              rotation_travel: int,
+              start_pos: int, end_pos: int) -> dict:
+    """
+    plan the order we take a scan's pictures in
+    :param declination: # of declination divisions
+    :param rotation: # of rotation divisions
+    :param declination_travel: # of steps to travel entire declination distance
+    :param rotation_travel: # of steps for a complete rotation of the platform
+    :param start_pos: Where to start taking pictures (0->100)
+    :param end_pos: Where to stop taking pictures (0->100)
+    :return: the calculate_steps() values, the shots & the total steps
+
+    The turntable goes back and forth (a serpentine), each ring of
+    pictures is taken turning the opposite way to the last, so we never
+    rotate past the last picture of a ring or wind back round to the first.
+    Each shot is the move to make before taking it (signed steps,
+    positive is CCW) and whether an end stop may stop that move short.
+    The first shot is at the declination start & the current turntable angle
+    """
+    steps_per_declination, \
+        steps_per_rotation, \
+        declination_start = calculate_steps(declination, rotation,
+                                            declination_travel, rotation_travel,
+                                            start_pos, end_pos)
+
+    shots = []
+    remaining_declination_steps = declination_travel - declination_start
+    declination_steps = 0  # to get to the ring, we start on the first
+    for ring in range(0, declination):
+        if ring:
+            # the declination motion may not be perfect fit so don't overstep
+            declination_steps = min(steps_per_declination, remaining_declination_steps)
+            if declination_steps <= 0:
+                break
+        ring_dir = 1 if ring % 2 == 0 else -1
+        ring_order = range(0, rotation) if ring_dir > 0 else reversed(range(0, rotation))
+        for index, rotation_index in enumerate(ring_order):
+            shots.append({'declination': ring,
+                          'rotation': rotation_index,
+                          'rotation_steps': ring_dir * steps_per_rotation if index else 0,
+                          'declination_steps': 0 if index else declination_steps,
+                          # if this is the last position, we expect to hit the end-stop
+                          'end_stop': not index and ring > 0 and
+                                      declination_steps == remaining_declination_steps})
+        remaining_declination_steps -= declination_steps
+
+    return {'steps_per_declination': steps_per_declination,
+            'steps_per_rotation': steps_per_rotation,
+            'declination_start': declination_start,
+            'shots': shots,
+            'total_steps': sum(abs(shot['rotation_steps']) + abs(shot['declination_steps'])
+                               for shot in shots)}
+
+
+def state_file(name: str) -> str:
+    """
+    path of a file in our state directory, which is created if need be
+    :param name: file name
+    :return: full path
+    """
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, name)
+
+
+def save_bytes(path: str, data: bytes) -> None:
+    """
+    write a file so a crash or power cut leaves either the old file or
+    the new one, never a partly written one
+    :param path: file to write
+    :param data: what to write
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as outfile:
+        outfile.write(data)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(temp_path, path)
+
+
+def save_json(path: str, data: dict) -> None:
+    """
+    write json with save_bytes()
+    :param path: file to write
+    :param data: what to write
+    """
+    save_bytes(path, json.dumps(data).encode('utf-8'))
+
+
+def load_json(path: str) -> dict:
+    """
+    read json written by save_json()
+    :param path: file to read
+    :return: the contents, an empty dict if missing or unreadable
+    """
+    try:
+        with open(path, 'r') as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}